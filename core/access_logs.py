@@ -0,0 +1,156 @@
+"""
+Click counting for links with a cacheable redirect policy. Browsers and CDNs
+answer most of their redirects without reaching the app, so their clicks are
+read from the CDN or reverse-proxy access logs instead, in the nginx/Apache
+"combined" format, and saved in batches like buffered clicks.
+"""
+import gzip
+import ipaddress
+import logging
+import os
+import re
+from bisect import bisect_right
+from datetime import datetime
+from operator import itemgetter
+
+from django.db import transaction
+
+from .clicks import click_event, save_clicks
+from .dispatch import SHORT_CODE_PATH
+from .models import AccessLogCursor, Link, RedirectPolicyChange
+
+logger = logging.getLogger(__name__)
+
+COMBINED_LOG_RE = re.compile(
+    r'(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>\S+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) \S+ '
+    r'"(?P<referer>(?:[^"\\]|\\.)*)" "(?P<user_agent>(?:[^"\\]|\\.)*)"'
+)
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+REDIRECT_STATUSES = {'301', '302'}
+
+
+def _field(value):
+    return None if value in ('', '-') else value
+
+
+def _ip(value):
+    # Logs written with hostname lookups on don't fit the inet column
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+
+def parse_line(line):
+    """(short code, request meta, timestamp) for a redirect in a combined log line, else None."""
+    match = COMBINED_LOG_RE.match(line)
+    if not match or match['method'] not in ('GET', 'HEAD') or match['status'] not in REDIRECT_STATUSES:
+        return None
+    code = SHORT_CODE_PATH.match(match['path'].split('?', 1)[0])
+    if not code:
+        return None
+    try:
+        timestamp = datetime.strptime(match['time'], LOG_TIME_FORMAT)
+    except ValueError:
+        return None
+    meta = {
+        'REMOTE_ADDR': _ip(match['ip']),
+        'HTTP_USER_AGENT': _field(match['user_agent']),
+        'HTTP_REFERER': _field(match['referer']),
+    }
+    return code.group(1), meta, timestamp
+
+
+def _policy_history(link_ids):
+    """link id -> [(changed_at, cacheable)] in order, for the links whose policy was ever set."""
+    history = {}
+    changes = (
+        RedirectPolicyChange.objects.filter(link_id__in=link_ids)
+        .order_by('changed_at', 'id').values_list('link_id', 'changed_at', 'policy')
+    )
+    for link_id, changed_at, policy in changes:
+        history.setdefault(link_id, []).append((changed_at, policy != Link.RedirectPolicy.UNCACHED))
+    return history
+
+
+def _was_cacheable(history, timestamp):
+    position = bisect_right(history, timestamp, key=itemgetter(0))
+    return position > 0 and history[position - 1][1]
+
+
+def _save(batch, cursor, inode, position):
+    links = dict(
+        Link.objects.filter(short_code__in={code for code, _, _ in batch}).values_list('short_code', 'id')
+    )
+    history = _policy_history(links.values())
+    # Lines for links that weren't cacheable at the time were already counted by the app
+    events = [
+        click_event(meta, links[code], timestamp)
+        for code, meta, timestamp in batch
+        if code in links and _was_cacheable(history.get(links[code], ()), timestamp)
+    ]
+    # The position moves with the clicks, so a rerun never counts a line twice
+    with transaction.atomic():
+        saved = save_clicks(events) if events else 0
+        cursor.inode, cursor.offset = inode, position
+        cursor.save()
+    return saved
+
+
+def _read(path, compressed, inode, position, cursor, batch_size):
+    """Saves the clicks logged in path after position; (lines read, clicks saved)."""
+    lines = saved = 0
+    batch = []
+    with (gzip.open if compressed else open)(path, 'rb') as log:
+        log.seek(position)
+        for raw in log:
+            # The last line may still be being written
+            if not raw.endswith(b'\n'):
+                break
+            position += len(raw)
+            lines += 1
+            parsed = parse_line(raw.decode('utf-8', 'replace'))
+            if parsed:
+                batch.append(parsed)
+            if len(batch) >= batch_size:
+                saved += _save(batch, cursor, inode, position)
+                batch = []
+    saved += _save(batch, cursor, inode, position)
+    return lines, saved
+
+
+def rotated_path(path, inode):
+    """The file next to path that still has inode (e.g. access.log.1 after a rename), or None."""
+    directory, name = os.path.split(path)
+    for entry in os.scandir(directory):
+        if entry.name.startswith(name) and entry.path != path and entry.is_file() and entry.inode() == inode:
+            return entry.path
+    return None
+
+
+def ingest_log(path, batch_size=1000):
+    """
+    Saves the clicks on cacheable links logged in the file at path since the
+    previous run. When the file was rotated by renaming, the rest of the
+    previous file is read first from its new name, then the new file from the
+    start; a truncated file is read from the start. .gz files are read
+    compressed. Returns (lines read, clicks saved).
+    """
+    path = os.path.abspath(path)
+    compressed = path.endswith('.gz')
+    stat = os.stat(path)
+    cursor, _ = AccessLogCursor.objects.get_or_create(path=path)
+    lines = saved = 0
+    position = cursor.offset
+    if cursor.inode != stat.st_ino:
+        previous = rotated_path(path, cursor.inode) if cursor.offset else None
+        if previous:
+            lines, saved = _read(previous, compressed, cursor.inode, cursor.offset, cursor, batch_size)
+        elif cursor.offset:
+            logger.warning("%s was rotated and the previous file is gone; its unread lines are lost", path)
+        position = 0
+    elif not compressed and stat.st_size < position:
+        position = 0
+
+    more_lines, more_saved = _read(path, compressed, stat.st_ino, position, cursor, batch_size)
+    return lines + more_lines, saved + more_saved
@@ -1,7 +1,23 @@
+import ipaddress
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Q
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.http import urlencode
 from unfold.admin import ModelAdmin
+from unfold.contrib.filters.admin import AutocompleteSelectFilter
 from .models import User, Link, Click
+from .pagination import EstimatedCountPaginator
+from .replicas import replica_reads
+
+class ReplicaChangeListMixin:
+    """List pages read from a replica; actions (POST) and edits stay on the primary."""
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            return replica_reads(super().changelist_view)(request, extra_context)
+        return super().changelist_view(request, extra_context)
 
 @admin.register(User)
 class CustomUserAdmin(BaseUserAdmin, ModelAdmin):
@@ -11,11 +27,19 @@ class CustomUserAdmin(BaseUserAdmin, ModelAdmin):
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'groups')
 
 @admin.register(Link)
-class LinkAdmin(ModelAdmin):
+class LinkAdmin(ReplicaChangeListMixin, ModelAdmin):
     list_display = ('short_code', 'original_url', 'owner', 'clicks_count', 'created_at')
     search_fields = ('short_code', 'original_url', 'owner__email')
-    list_filter = ('created_at', 'owner')
+    search_help_text = "Start of a short code, an owner's email, or 3+ characters of the destination URL."
+    # Owners are picked through autocomplete rather than listed in the sidebar
+    list_filter = ('created_at', ('owner', AutocompleteSelectFilter), 'redirect_policy')
+    list_filter_submit = True
+    autocomplete_fields = ('owner',)
     readonly_fields = ('created_at', 'clicks_count')
+    # Walks the primary key; ids are handed out in creation order
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     # Adding a custom action example
     actions = ['reset_clicks']
@@ -24,9 +48,55 @@ class LinkAdmin(ModelAdmin):
     def reset_clicks(self, request, queryset):
         queryset.update(clicks_count=0)
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Each term matches through an index: short codes by prefix, owners by
+        exact email, destinations through the trigram index of migration 0014.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        match = Q(short_code__startswith=term)
+        if '@' in term:
+            owners = User.objects.filter(email__in={term, term.lower()}).values_list('id', flat=True)
+            match |= Q(owner_id__in=list(owners))
+        if len(term) >= 3:
+            match |= Q(original_url__icontains=term)
+        return queryset.filter(match), False
+
 @admin.register(Click)
-class ClickAdmin(ModelAdmin):
+class ClickAdmin(ReplicaChangeListMixin, ModelAdmin):
     list_display = ('link', 'timestamp', 'ip_address', 'referer')
-    list_filter = ('timestamp', 'link')
+    list_filter = (('link', AutocompleteSelectFilter),)
+    list_filter_submit = True
+    date_hierarchy = 'timestamp'
     search_fields = ('link__short_code', 'ip_address')
+    search_help_text = "An exact short code or IP address."
     readonly_fields = ('timestamp', 'link', 'ip_address', 'user_agent', 'referer')
+    list_select_related = ('link', 'referer')
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        # Opens on today; an undated list would have the date hierarchy and count scan every partition
+        if request.method == 'GET' and not request.GET:
+            today = timezone.localdate()
+            query = urlencode({'timestamp__year': today.year, 'timestamp__month': today.month, 'timestamp__day': today.day})
+            return redirect(f'{request.path}?{query}')
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Clicks of the link with that exact code, or from that IP address."""
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        match = Q()
+        link = Link.objects.get_by_code(term)
+        if link is not None:
+            match |= Q(link=link)
+        try:
+            match |= Q(ip_address=str(ipaddress.ip_address(term)))
+        except ValueError:
+            pass
+        return (queryset.filter(match) if match else queryset.none()), False
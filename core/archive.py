@@ -0,0 +1,241 @@
+"""
+Monthly click partitions and archival of old months.
+
+On PostgreSQL core_click is range-partitioned on timestamp: one partition
+per UTC month (core_click_YYYYMM), core_click_legacy with the rows from
+before partitioning, and core_click_default for anything no month covers.
+SQLite keeps a plain table.
+
+`manage.py archive_clicks` creates the coming months' partitions and moves
+the months older than CLICK_RETENTION_MONTHS to gzipped CSV files in
+CLICK_ARCHIVE_DIR. A month with its own partition is detached and dropped
+whole; other rows are deleted in batches. The rollup tables keep their
+counts, and exports read archived months back from the files, see
+archived_rows().
+"""
+import csv
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime, time, timedelta, timezone as datetime_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Click, Link
+from .rollups import rolled_up_until
+
+logger = logging.getLogger(__name__)
+
+CLICK_TABLE = 'core_click'
+PARTITION_NAME = 'core_click_{month:%Y%m}'
+ARCHIVE_FIELDS = ('link_id', 'timestamp', 'ip_address', 'user_agent', 'referer')
+# clicks-2026-01.0.csv.gz; a month archived in several runs has several parts
+ARCHIVE_NAME = re.compile(r'clicks-(\d{4})-(\d{2})\.\d+\.csv\.gz\Z')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def previous_month(month):
+    return (month - timedelta(days=1)).replace(day=1)
+
+
+def month_bounds(month):
+    """The UTC datetimes a month's partition covers, end excluded."""
+    return (
+        datetime.combine(month, time.min, tzinfo=datetime_timezone.utc),
+        datetime.combine(next_month(month), time.min, tzinfo=datetime_timezone.utc),
+    )
+
+
+def current_month():
+    return month_start(timezone.now().astimezone(datetime_timezone.utc))
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [CLICK_TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def _table_exists(name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        return cursor.fetchone()[0]
+
+
+def ensure_partitions(months_ahead=2):
+    """
+    Creates the partitions of the next months_ahead months that don't exist
+    yet. Returns their names. A month whose clicks already landed in the
+    default partition is left there and logged.
+    """
+    if not is_partitioned():
+        return []
+    created = []
+    month = current_month()
+    for _ in range(months_ahead):
+        month = next_month(month)
+        name = PARTITION_NAME.format(month=month)
+        if _table_exists(name):
+            continue
+        start, end = month_bounds(month)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF {CLICK_TABLE} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+        except DatabaseError:
+            logger.warning("Could not create click partition %s", name, exc_info=True)
+            continue
+        created.append(name)
+    return created
+
+
+def archive_dir():
+    return Path(settings.CLICK_ARCHIVE_DIR)
+
+
+def archived_months():
+    """{month: [archive file paths]}, oldest month first."""
+    months = {}
+    if archive_dir().is_dir():
+        for path in sorted(archive_dir().iterdir()):
+            match = ARCHIVE_NAME.match(path.name)
+            if match:
+                months.setdefault(date(int(match[1]), int(match[2]), 1), []).append(path)
+    return dict(sorted(months.items()))
+
+
+def _write_archive(month, rows):
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    part = len(archived_months().get(month, []))
+    path = directory / f'clicks-{month:%Y-%m}.{part}.csv.gz'
+    partial = directory / f'{path.name}.partial'
+    count = 0
+    with gzip.open(partial, 'wt', newline='') as archive:
+        writer = csv.writer(archive)
+        writer.writerow(ARCHIVE_FIELDS)
+        for link_id, timestamp, ip_address, user_agent, referer in rows:
+            writer.writerow((link_id, timestamp.isoformat(), ip_address, user_agent, referer))
+            count += 1
+    if count:
+        os.replace(partial, path)
+    else:
+        partial.unlink()
+    return count
+
+
+def _partition_rows(name, batch_size):
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f'SELECT c.link_id, c."timestamp", c.ip_address, ua.value, r.value FROM {name} c '
+            'LEFT JOIN core_useragent ua ON ua.id = c.user_agent_id '
+            'LEFT JOIN core_referer r ON r.id = c.referer_id '
+            'ORDER BY c.link_id, c.id'
+        )
+        while rows := cursor.fetchmany(batch_size):
+            yield from rows
+
+
+def archive_month(month, batch_size=10000):
+    """
+    Moves the clicks of month into a new archive file. Returns how many, or
+    None when some of them aren't rolled up yet (their counts would be lost).
+    """
+    start, end = month_bounds(month)
+    clicks = Click.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by()
+    if clicks.filter(id__gt=rolled_up_until()).exists():
+        return None
+
+    name = PARTITION_NAME.format(month=month)
+    if is_partitioned() and _table_exists(name):
+        # Detached first, so clicks arriving meanwhile go to the default partition rather than being dropped
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {CLICK_TABLE} DETACH PARTITION {name}")
+            count = _write_archive(month, _partition_rows(name, batch_size))
+            cursor.execute(f"DROP TABLE {name}")
+        return count
+
+    # Clicks saved from now on have higher ids and wait for the next run
+    last_id = clicks.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return 0
+    clicks = clicks.filter(id__lte=last_id)
+    count = _write_archive(month, clicks.order_by('link_id', 'id').values_list(
+        'link_id', 'timestamp', 'ip_address', 'user_agent__value', 'referer__value',
+    ).iterator(chunk_size=batch_size))
+    while ids := list(clicks.order_by('id').values_list('id', flat=True)[:batch_size]):
+        Click.objects.filter(id__in=ids).delete()
+    return count
+
+
+def archive_old_months(retain_months, batch_size=10000):
+    """
+    Archives every month before the retain_months most recent ones (the
+    current month included). Returns {month: archive_month() result}.
+    """
+    cutoff = current_month()
+    for _ in range(retain_months - 1):
+        cutoff = previous_month(cutoff)
+    # Not the lowest id: imported and buffered clicks are saved late with their original time
+    oldest = Click.objects.aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is None:
+        return {}
+    results = {}
+    month = month_start(oldest.astimezone(datetime_timezone.utc))
+    while month < cutoff:
+        results[month] = archive_month(month, batch_size)
+        month = next_month(month)
+    return results
+
+
+def archived_rows(owner=None, link=None, start=None, end=None):
+    """
+    Archived clicks of link, or of every link owned by owner, on the days
+    [start, end], as the export rows (short_code, timestamp, ip_address,
+    user_agent, referer). Clicks of deleted links are skipped.
+    """
+    tz = timezone.get_current_timezone()
+    since = datetime.combine(start, time.min, tzinfo=tz) if start else None
+    until = datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz) if end else None
+    paths = [
+        path
+        for month, month_paths in archived_months().items()
+        if not (since and month_bounds(month)[1] <= since) and not (until and month_bounds(month)[0] >= until)
+        for path in month_paths
+    ]
+    if not paths:
+        return
+
+    if link is not None:
+        codes = {link.id: link.short_code}
+    else:
+        codes = dict(Link.objects.filter(owner=owner).values_list('id', 'short_code'))
+    for path in paths:
+        with gzip.open(path, 'rt', newline='') as archive:
+            reader = csv.reader(archive)
+            next(reader)
+            for link_id, timestamp, ip_address, user_agent, referer in reader:
+                short_code = codes.get(int(link_id))
+                if short_code is None:
+                    continue
+                timestamp = datetime.fromisoformat(timestamp)
+                if (since and timestamp < since) or (until and timestamp >= until):
+                    continue
+                yield short_code, timestamp, ip_address or None, user_agent or None, referer or None
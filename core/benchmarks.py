@@ -0,0 +1,237 @@
+"""
+In-process benchmarks of the main request paths, shared by
+`manage.py benchmark` and the query-budget tests in core/tests.py.
+"""
+import io
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django_redis.pool import ConnectionFactory
+
+from . import cache as link_cache
+from . import dimensions
+from .bloom import BloomFilter
+from .cache import local_links, redis_client, warm_links
+from .dispatch import RedirectDispatcher
+from .ids import allocate_link_ids, reset_allocator
+from .models import Click, Link, User
+from .rollups import roll_up_clicks
+from .utils import encode
+
+SCENARIOS = (
+    'redirect', 'redirect_missing', 'redirect_wsgi', 'redirect_fast', 'shorten', 'dashboard', 'link_analysis',
+)
+# Requested without a session, like real redirect traffic
+ANONYMOUS_SCENARIOS = {'redirect', 'redirect_missing', 'redirect_wsgi', 'redirect_fast'}
+
+
+def fake_redis_caches():
+    """
+    CACHES pointing the default cache at a new in-process fakeredis server.
+    django-redis keeps one connection pool per URL for the whole process, so
+    each server gets a URL of its own.
+    """
+    import fakeredis
+    import fakeredis.aioredis
+
+    server = fakeredis.FakeServer()
+    return {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': f'redis://benchmark-{uuid.uuid4().hex}/0',
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection, 'server': server},
+                # The same server for cache.async_redis_client
+                'ASYNC_CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.aioredis.FakeConnection, 'server': server},
+            },
+        }
+    }
+
+
+@contextmanager
+def isolated_redis(links, **overrides):
+    """
+    Runs the block against a fresh fakeredis server, with the membership
+    filter sized for `links` codes; a production-sized bitmap takes minutes
+    to fill on fakeredis.
+    """
+    original_filter = link_cache.link_filter
+    link_cache.link_filter = BloomFilter(
+        original_filter.key, max(links * 2, 1000), settings.LINK_FILTER_ERROR_RATE,
+    )
+    caches = fake_redis_caches()
+    local_links.clear()
+    # Ids interned by a rolled-back test would point at rows that are gone
+    dimensions.clear_cache()
+    # Ids reserved from the previous server's counter would overlap the new one's
+    reset_allocator()
+    try:
+        with override_settings(CACHES=caches, **overrides):
+            yield
+    finally:
+        link_cache.link_filter = original_filter
+        local_links.clear()
+        dimensions.clear_cache()
+        reset_allocator()
+        ConnectionFactory._pools.pop(caches['default']['LOCATION'], None)
+
+
+def seed(links=1000, clicks=10000, days=30, username='benchmark'):
+    """
+    Creates a user owning `links` links and `clicks` clicks spread over the
+    last `days` days, skewed towards a few hot links, then builds the
+    membership filter and click rollups as production would have them.
+    Returns the user.
+    """
+    owner, _ = User.objects.get_or_create(username=username, defaults={'email': f'{username}@example.com'})
+    now = timezone.now()
+
+    created = []
+    for start in range(0, links, 1000):
+        ids = allocate_link_ids(min(1000, links - start))
+        batch = [
+            Link(id=link_id, owner=owner, original_url=f'https://example.com/{link_id}', short_code=encode(link_id))
+            for link_id in ids
+        ]
+        Link.objects.bulk_create(batch)
+        created.extend(batch)
+    link_cache.link_filter.rebuild(redis_client(), (link.short_code for link in created))
+
+    # Zipf-like popularity: link n gets clicks in proportion to 1/n
+    weights = [1 / rank for rank in range(1, len(created) + 1)]
+    picks = random.choices(created, weights=weights, k=clicks) if created else []
+    Click.objects.bulk_create(
+        (Click(link=link, timestamp=now - timedelta(seconds=random.randrange(days * 86400))) for link in picks),
+        batch_size=5000,
+    )
+    counts = Counter(link.id for link in picks)
+    for link in created:
+        link.clicks_count = counts[link.id]
+    Link.objects.bulk_update(created, ['clicks_count'], batch_size=1000)
+
+    # The first run only records where the second one stops
+    roll_up_clicks()
+    roll_up_clicks()
+    warm_links(created)
+    return owner
+
+
+def wsgi_get(application, path):
+    """
+    Sends a GET straight to a WSGI application, the way gunicorn would,
+    without the test client's own handler. Returns an object with status_code
+    and headers.
+    """
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    status = []
+    # Like the test client, keep the request signals from closing the connection of a test transaction
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        body = application(environ, lambda line, headers, exc_info=None: status.append((line, headers)))
+        try:
+            b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    line, headers = status[0]
+    return SimpleNamespace(status_code=int(line.split()[0]), headers=dict(headers))
+
+
+def default_scenarios(owner):
+    """
+    {name: callable(client) -> response} for each path in SCENARIOS.
+    redirect_wsgi and redirect_fast bypass the client: the same redirect through
+    Django's WSGI handler, and through the dispatcher in front of it.
+    """
+    codes = list(Link.objects.filter(owner=owner).values_list('short_code', flat=True)[:1000])
+    hot = Link.objects.filter(owner=owner).order_by('-clicks_count').first()
+    counter = iter(range(10 ** 9))
+    django_app = WSGIHandler()
+    fast_app = RedirectDispatcher(django_app)
+    return {
+        'redirect': lambda client: client.get(f'/{random.choice(codes)}'),
+        'redirect_missing': lambda client: client.get(f'/missing-{next(counter)}'),
+        'redirect_wsgi': lambda client: wsgi_get(django_app, f'/{random.choice(codes)}'),
+        'redirect_fast': lambda client: wsgi_get(fast_app, f'/{random.choice(codes)}'),
+        'shorten': lambda client: client.post(
+            '/shorten/', {'original_url': f'https://example.org/{next(counter)}'}, HTTP_HX_REQUEST='true',
+        ),
+        'dashboard': lambda client: client.get('/dashboard/'),
+        'link_analysis': lambda client: client.get(f'/analytics/{hot.short_code}/'),
+    }
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(client, request, iterations=200, warmup=20):
+    """Runs request(client) repeatedly; returns latency percentiles, throughput and DB queries per request."""
+    for _ in range(warmup):
+        request(client)
+
+    latencies, queries, statuses = [], 0, Counter()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request(client)
+            latencies.append(time.perf_counter() - started)
+        queries += len(captured)
+        statuses[response.status_code] += 1
+
+    ordered = sorted(latencies)
+    return {
+        'requests': iterations,
+        'requests_per_second': iterations / sum(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': _percentile(ordered, 50) * 1000,
+        'p95_ms': _percentile(ordered, 95) * 1000,
+        'p99_ms': _percentile(ordered, 99) * 1000,
+        'queries_per_request': queries / iterations,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def run(owner, scenarios=SCENARIOS, iterations=200, warmup=20):
+    """Benchmarks each named scenario with a client logged in as owner."""
+    anonymous, logged_in = Client(), Client()
+    logged_in.force_login(owner)
+    requests = default_scenarios(owner)
+    results = {}
+    for name in scenarios:
+        local_links.clear()
+        client = anonymous if name in ANONYMOUS_SCENARIOS else logged_in
+        results[name] = measure(client, requests[name], iterations, warmup)
+    return results
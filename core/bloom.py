@@ -0,0 +1,68 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Bloom filter kept in a plain Redis bitmap (SETBIT/GETBIT), so it works on
+    managed Redis instances without the RedisBloom module.
+
+    Items can only be added. The bit array size and hash count are derived from
+    capacity and error_rate, so changing either requires a rebuild.
+    """
+
+    def __init__(self, key, capacity, error_rate):
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+
+    def positions(self, item):
+        # Double hashing (Kirsch-Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, pipe, item, key=None):
+        """Queues the SETBITs for item on a pipeline."""
+        for position in self.positions(item):
+            pipe.setbit(key or self.key, position, 1)
+
+    def queue_check(self, pipe, item):
+        """
+        Queues an EXISTS followed by the GETBITs for item; pass the matching
+        slice of pipeline results to check_result().
+        """
+        pipe.exists(self.key)
+        for position in self.positions(item):
+            pipe.getbit(self.key, position)
+
+    def check_result(self, results):
+        """False only when the filter exists and item is definitely not in it."""
+        exists, bits = results[0], results[1:]
+        return not exists or all(bits)
+
+    def rebuild(self, redis, items, chunk_size=5000):
+        """Builds a fresh filter from items under a temporary key, then swaps it in."""
+        building_key = f"{self.key}:building"
+        redis.delete(building_key)
+        pipe = redis.pipeline(transaction=False)
+        count = 0
+        for item in items:
+            self.add(pipe, item, key=building_key)
+            count += 1
+            if count % chunk_size == 0:
+                pipe.execute()
+        pipe.execute()
+        if count:
+            redis.rename(building_key, self.key)
+        else:
+            redis.delete(self.key)
+        return count
+
+    def estimated_false_positive_rate(self, redis):
+        """Expected false positive rate given how many bits are currently set."""
+        filled = redis.bitcount(self.key) / self.size
+        return filled ** self.hashes
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# What a failing or unreachable Redis raises, through django-redis or directly
+REDIS_ERRORS = (RedisError, ConnectionInterrupted, OSError)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. After `threshold` consecutive errors
+    the breaker opens and guarded calls return their fallback immediately;
+    a background thread probes the dependency every `cooldown` seconds and
+    closes the breaker once it answers, so no request waits on the probe.
+
+    State is per process. Transitions and fallbacks are counted for the
+    metrics endpoint, see drain_counts().
+    """
+
+    def __init__(self, name, threshold, cooldown, probe, errors):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probe = probe
+        self.errors = errors
+        self.is_open = False
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._counts = {'opened': 0, 'closed': 0, 'fallbacks': 0}
+
+    def success(self):
+        self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._counts['fallbacks'] += 1
+            self._failures += 1
+            if self.is_open or self._failures < self.threshold:
+                return
+            self.is_open = True
+            self._counts['opened'] += 1
+        logger.warning("%s circuit opened after %d consecutive errors", self.name, self._failures)
+        threading.Thread(target=self._probe_until_closed, name=f'{self.name}-probe', daemon=True).start()
+
+    def allow(self):
+        if self.is_open:
+            with self._lock:
+                self._counts['fallbacks'] += 1
+            return False
+        return True
+
+    def close(self):
+        with self._lock:
+            if not self.is_open:
+                return
+            self.is_open = False
+            self._failures = 0
+            self._counts['closed'] += 1
+        logger.warning("%s circuit closed", self.name)
+
+    def _probe_until_closed(self):
+        while self.is_open:
+            time.sleep(self.cooldown)
+            try:
+                self.probe()
+            except self.errors:
+                continue
+            self.close()
+
+    def drain_counts(self):
+        """Transitions and fallbacks since the last call, then resets them."""
+        with self._lock:
+            counts = dict(self._counts)
+            for key in self._counts:
+                self._counts[key] = 0
+        return counts
+
+    def guard(self, default=None):
+        """
+        Decorates a function (or coroutine function) that talks to the
+        dependency: while the breaker is open, or when the call raises one of
+        `errors`, it returns `default` instead.
+        """
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.allow():
+                        return default
+                    try:
+                        result = await func(*args, **kwargs)
+                    except self.errors:
+                        logger.warning("%s call %s failed", self.name, func.__name__, exc_info=True)
+                        self.failure()
+                        return default
+                    self.success()
+                    return result
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.allow():
+                    return default
+                try:
+                    result = func(*args, **kwargs)
+                except self.errors:
+                    logger.warning("%s call %s failed", self.name, func.__name__, exc_info=True)
+                    self.failure()
+                    return default
+                self.success()
+                return result
+            return wrapper
+        return decorator
+
+
+def _ping_redis():
+    get_redis_connection('default').ping()
+
+
+# Guards every Redis call on the request path; an open breaker falls back to the
+# in-process cache and the database
+redis_breaker = CircuitBreaker(
+    'redis', settings.REDIS_BREAKER_THRESHOLD, settings.REDIS_BREAKER_COOLDOWN, _ping_redis, REDIS_ERRORS,
+)
@@ -0,0 +1,180 @@
+import json
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import IntegrityError, transaction
+
+from .cache import warm_links
+from .ids import allocate_link_ids, get_allocator
+from .models import Link
+from .utils import encode, decode, is_generated_code, url_hash
+
+ALIAS_RE = re.compile(r'^[A-Za-z0-9_-]{1,15}$')
+URL_MAX_LENGTH = 2000
+RETRY_ERROR = "Could not create the link. Please try again."
+# Links validated, inserted and cached together before their results are streamed
+CHUNK_SIZE = 1000
+
+validate_url = URLValidator()
+
+
+class BulkRequestError(Exception):
+    pass
+
+
+def parse_items(request):
+    """
+    Reads the submitted links from a JSON body (a list, or {"links": [...]})
+    or from NDJSON, one object per line. Each item is {"url": ..., "alias": ...}.
+    The stream is read directly, so large batches aren't capped by
+    DATA_UPLOAD_MAX_MEMORY_SIZE; BULK_SHORTEN_MAX_ITEMS caps them instead.
+    """
+    content_type = request.content_type or ''
+    try:
+        if content_type in ('application/x-ndjson', 'application/jsonl'):
+            items = [json.loads(line) for line in request if line.strip()]
+        else:
+            payload = json.load(request)
+            items = payload.get('links') if isinstance(payload, dict) else payload
+    except (ValueError, UnicodeDecodeError) as e:
+        raise BulkRequestError(f"Invalid JSON: {e}")
+
+    if not isinstance(items, list):
+        raise BulkRequestError("Expected a list of links.")
+    if len(items) > settings.BULK_SHORTEN_MAX_ITEMS:
+        raise BulkRequestError(f"At most {settings.BULK_SHORTEN_MAX_ITEMS} links per request.")
+    return items
+
+
+def _validate(item):
+    """Returns (url, alias, error)."""
+    if not isinstance(item, dict):
+        return None, None, "Each link must be an object."
+    url = item.get('url')
+    alias = item.get('alias')
+    if not isinstance(url, str) or not url:
+        return None, None, "URL is required."
+    if alias is not None and not isinstance(alias, str):
+        return None, None, "Alias must be a string."
+    alias = (alias or '').strip() or None
+    if len(url) > URL_MAX_LENGTH:
+        return None, None, f"URL is longer than {URL_MAX_LENGTH} characters."
+    try:
+        validate_url(url)
+    except ValidationError:
+        return None, None, "Enter a valid URL."
+    if alias is not None and not ALIAS_RE.match(alias):
+        return None, None, "Alias can only contain letters, numbers, dashes, and underscores (max 15)."
+    return url, alias, None
+
+
+def _insert(links):
+    """Inserts a chunk in one transaction; on a conflict, falls back to row by row."""
+    try:
+        with transaction.atomic():
+            Link.objects.bulk_create(links)
+        return links, []
+    except IntegrityError:
+        created, failed = [], []
+        for link in links:
+            try:
+                with transaction.atomic():
+                    link.save(force_insert=True)
+                created.append(link)
+            except IntegrityError:
+                failed.append(link)
+        return created, failed
+
+
+def _link_result(index, status, url, short_code, base_url):
+    return {
+        'index': index,
+        'status': status,
+        'url': url,
+        'short_code': short_code,
+        'short_url': base_url + short_code,
+    }
+
+
+def _shorten_chunk(chunk, owner, base_url):
+    results = {}
+    pending = []
+    for index, item in chunk:
+        url, alias, error = _validate(item)
+        if error:
+            results[index] = {'index': index, 'status': 'error', 'error': error}
+        else:
+            pending.append((index, url, alias, None if alias else url_hash(url)))
+
+    # One query for every alias in the chunk, plus the allocator's reserved range
+    aliases = [alias for _, _, alias, _ in pending if alias]
+    taken = set(Link.objects.filter(short_code__in=aliases).values_list('short_code', flat=True))
+    if any(is_generated_code(alias) for alias in aliases):
+        high_water = get_allocator().high_water_mark()
+        taken.update(alias for alias in aliases if is_generated_code(alias) and decode(alias) <= high_water)
+
+    # And one for the owner's links to the same destinations, the oldest winning
+    existing = {}
+    if settings.LINK_DEDUPLICATION:
+        hashes = {digest for _, _, _, digest in pending if digest}
+        if hashes:
+            rows = Link.objects.filter(owner=owner, url_hash__in=hashes).order_by('-id')
+            for digest, url, short_code in rows.values_list('url_hash', 'original_url', 'short_code'):
+                existing[digest] = (url, short_code)
+
+    accepted = []
+    seen, repeated = set(), []
+    for index, url, alias, digest in pending:
+        if alias and alias in taken:
+            results[index] = {'index': index, 'status': 'error', 'error': "That alias is already taken."}
+            continue
+        if alias:
+            # Later duplicates within the same request lose
+            taken.add(alias)
+        elif digest in existing:
+            results[index] = _link_result(index, 'existing', *existing[digest], base_url)
+            continue
+        elif settings.LINK_DEDUPLICATION:
+            if digest in seen:
+                # Gets the link created for the first occurrence
+                repeated.append((index, digest))
+                continue
+            seen.add(digest)
+        accepted.append((index, url, alias, digest))
+
+    links = []
+    for (index, url, alias, digest), link_id in zip(accepted, allocate_link_ids(len(accepted))):
+        short_code = alias or encode(link_id)
+        link = Link(
+            id=link_id, original_url=url, url_hash=digest or url_hash(url), owner=owner, short_code=short_code,
+            is_custom=bool(alias),
+        )
+        link.bulk_index = index
+        links.append(link)
+
+    created, failed = _insert(links)
+    if created:
+        warm_links(created)
+    for link in created:
+        results[link.bulk_index] = _link_result(link.bulk_index, 'created', link.original_url, link.short_code, base_url)
+    for link in failed:
+        # A generated code only conflicts through a race with an alias; the client can retry
+        error = "That alias is already taken." if link.is_custom else RETRY_ERROR
+        results[link.bulk_index] = {'index': link.bulk_index, 'status': 'error', 'error': error}
+    first = {link.url_hash: link for link in created if not link.is_custom}
+    for index, digest in repeated:
+        link = first.get(digest)
+        if link is not None:
+            results[index] = _link_result(index, 'existing', link.original_url, link.short_code, base_url)
+        else:
+            results[index] = {'index': index, 'status': 'error', 'error': RETRY_ERROR}
+    return [results[index] for index, _ in chunk]
+
+
+def shorten_many(items, owner, base_url):
+    """Creates links chunk by chunk, yielding one result dict per submitted item, in order."""
+    for start in range(0, len(items), CHUNK_SIZE):
+        chunk = list(enumerate(items[start:start + CHUNK_SIZE], start=start))
+        yield from _shorten_chunk(chunk, owner, base_url)
@@ -0,0 +1,530 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+
+from .bloom import BloomFilter
+from .breaker import redis_breaker
+from .metrics import record_cache_lookup
+
+# Redirect entries live for a day; Link edits are rare so this is safe.
+REDIRECT_CACHE_TIMEOUT = 3600 * 24
+
+# Redis stream of short codes whose cached entry went stale (link edited or deleted).
+# Every worker replays it into its local cache, see sync_invalidations().
+INVALIDATION_STREAM = 'links:invalidated'
+INVALIDATION_STREAM_MAXLEN = 10000
+# Entries read per sync; getting a full page means we fell behind and drop everything
+INVALIDATION_READ_COUNT = 1000
+
+# Short codes known not to exist, kept briefly so scanners don't reach the DB
+MISSING_KEY = 'links:missing:{code}'
+# Counters for the membership filter: rejected lookups, false positives, negative cache hits
+FILTER_STATS_KEY = 'links:filter:stats'
+
+# Held by the one request loading a missing short code from the DB, see fill_link()
+FILL_LOCK_KEY = 'links:fill:{code}'
+# Seconds between checks while another request fills the entry
+FILL_POLL_INTERVAL = 0.02
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL.
+    Each gunicorn worker has its own, so reads cost no network I/O.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+local_links = LocalCache(settings.LINK_CACHE_LOCAL_SIZE, settings.LINK_CACHE_LOCAL_TTL)
+
+# Membership filter over every existing short code, see `manage.py rebuild_link_filter`
+link_filter = BloomFilter('links:filter', settings.LINK_FILTER_CAPACITY, settings.LINK_FILTER_ERROR_RATE)
+
+_last_invalidation_id = None
+_last_sync = 0.0
+
+# redis.asyncio connections belong to the event loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def redis_client():
+    """Raw client for the Redis structures (lists, bitmaps) the cache API can't express."""
+    return get_redis_connection('default')
+
+
+def async_redis_client():
+    """
+    redis.asyncio client for the async redirect path, on the same server and
+    connection options as the cache. One per event loop and cache location.
+    ASYNC_CONNECTION_POOL_KWARGS in the cache OPTIONS override
+    CONNECTION_POOL_KWARGS for it, e.g. with an asyncio connection_class.
+    """
+    config = settings.CACHES['default']
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(config['LOCATION'])
+    if client is None:
+        options = config.get('OPTIONS', {})
+        pool_kwargs = {
+            'socket_timeout': options.get('SOCKET_TIMEOUT'),
+            'socket_connect_timeout': options.get('SOCKET_CONNECT_TIMEOUT'),
+            **options.get('CONNECTION_POOL_KWARGS', {}),
+            **options.get('ASYNC_CONNECTION_POOL_KWARGS', {}),
+        }
+        client = clients[config['LOCATION']] = aioredis.from_url(config['LOCATION'], **pool_kwargs)
+    return client
+
+
+def _raw_key(key):
+    """The Redis key the cache API stores key under (prefix and version applied)."""
+    return str(cache.client.make_key(key))
+
+
+def redirect_cache_key(short_code):
+    return f"url_{short_code}"
+
+
+def link_cache_entry(link):
+    """Everything the redirect path needs, so a cache hit never touches the DB."""
+    entry = {'id': link.id, 'url': link.original_url}
+    # Only cacheable links carry a policy; entries without one are served uncached
+    if link.redirect_policy != link.RedirectPolicy.UNCACHED:
+        entry['max_age'] = link.cache_max_age
+        entry['permanent'] = link.redirect_policy == link.RedirectPolicy.PERMANENT
+    return entry
+
+
+def is_cacheable(entry):
+    """Whether the redirect for entry may be cached downstream (and isn't counted by the app)."""
+    return entry.get('max_age') is not None
+
+
+def _sync_due(force):
+    global _last_sync
+    now = time.monotonic()
+    if not force and now - _last_sync < settings.LINK_CACHE_SYNC_INTERVAL:
+        return False
+    _last_sync = now
+    return True
+
+
+def _apply_invalidations(entries):
+    global _last_invalidation_id
+    if len(entries) >= INVALIDATION_READ_COUNT:
+        local_links.clear()
+    else:
+        for _entry_id, fields in entries:
+            local_links.delete(fields[b'code'].decode())
+    _last_invalidation_id = entries[-1][0]
+
+
+@redis_breaker.guard()
+def sync_invalidations(force=False):
+    """
+    Evicts local entries invalidated by any worker since the last sync.
+    Runs at most every LINK_CACHE_SYNC_INTERVAL seconds, which bounds how long
+    an edited or deleted link keeps resolving from a stale local entry,
+    while Redis is reachable; during an outage LINK_CACHE_LOCAL_TTL bounds it.
+    """
+    global _last_invalidation_id
+    if not _sync_due(force):
+        return
+
+    redis = redis_client()
+    if _last_invalidation_id is None:
+        # First sync in this process: nothing is cached locally yet, start from the tail
+        latest = redis.xrevrange(INVALIDATION_STREAM, count=1)
+        _last_invalidation_id = latest[0][0] if latest else '0-0'
+        return
+
+    streams = redis.xread({INVALIDATION_STREAM: _last_invalidation_id}, count=INVALIDATION_READ_COUNT)
+    if streams:
+        _apply_invalidations(streams[0][1])
+
+
+@redis_breaker.guard()
+async def async_sync_invalidations(force=False):
+    global _last_invalidation_id
+    if not _sync_due(force):
+        return
+
+    redis = async_redis_client()
+    if _last_invalidation_id is None:
+        latest = await redis.xrevrange(INVALIDATION_STREAM, count=1)
+        _last_invalidation_id = latest[0][0] if latest else '0-0'
+        return
+
+    streams = await redis.xread({INVALIDATION_STREAM: _last_invalidation_id}, count=INVALIDATION_READ_COUNT)
+    if streams:
+        _apply_invalidations(streams[0][1])
+
+
+@redis_breaker.guard()
+def _redis_entry(short_code):
+    return cache.get(redirect_cache_key(short_code))
+
+
+@redis_breaker.guard()
+async def _aredis_entry(short_code):
+    raw = await async_redis_client().get(_raw_key(redirect_cache_key(short_code)))
+    return cache.client.decode(raw) if raw is not None else None
+
+
+@redis_breaker.guard()
+def _store_entry(short_code, entry):
+    cache.set(redirect_cache_key(short_code), entry, timeout=REDIRECT_CACHE_TIMEOUT)
+
+
+@redis_breaker.guard()
+async def _astore_entry(short_code, entry):
+    await async_redis_client().set(
+        _raw_key(redirect_cache_key(short_code)), cache.client.encode(entry), ex=REDIRECT_CACHE_TIMEOUT,
+    )
+
+
+def get_cached_link(short_code):
+    """
+    The redirect entry for short_code from the local cache, then Redis.
+    None on a miss, or when Redis is failing (the caller falls back to the DB).
+    """
+    sync_invalidations()
+    entry = local_links.get(short_code)
+    if entry is not None:
+        record_cache_lookup('local_hit')
+        return entry
+
+    entry = _redis_entry(short_code)
+    # Older entries were bare URL strings without the link id; treat them as a miss
+    if not isinstance(entry, dict):
+        record_cache_lookup('miss')
+        return None
+    record_cache_lookup('redis_hit')
+    local_links.set(short_code, entry)
+    return entry
+
+
+async def aget_cached_link(short_code):
+    await async_sync_invalidations()
+    entry = local_links.get(short_code)
+    if entry is not None:
+        record_cache_lookup('local_hit')
+        return entry
+
+    entry = await _aredis_entry(short_code)
+    if not isinstance(entry, dict):
+        record_cache_lookup('miss')
+        return None
+    record_cache_lookup('redis_hit')
+    local_links.set(short_code, entry)
+    return entry
+
+
+def cache_link(link):
+    entry = link_cache_entry(link)
+    _store_entry(link.short_code, entry)
+    local_links.set(link.short_code, entry)
+    return entry
+
+
+async def acache_link(link):
+    entry = link_cache_entry(link)
+    await _astore_entry(link.short_code, entry)
+    local_links.set(link.short_code, entry)
+    return entry
+
+
+def cache_links(links):
+    """Caches the redirect entries of many links in one pipelined round trip."""
+    entries = {redirect_cache_key(link.short_code): link_cache_entry(link) for link in links}
+    cache.set_many(entries, timeout=REDIRECT_CACHE_TIMEOUT)
+
+
+@redis_breaker.guard()
+def warm_links(links):
+    """
+    Caches redirect entries and registers the codes of new or edited links
+    (write-through), pipelined so a batch costs a couple of round trips.
+    """
+    cache_links(links)
+
+    redis = redis_client()
+    filter_built = redis.exists(link_filter.key)
+    pipe = redis.pipeline(transaction=False)
+    for link in links:
+        if filter_built:
+            link_filter.add(pipe, link.short_code)
+        pipe.delete(MISSING_KEY.format(code=link.short_code))
+    pipe.execute()
+
+
+@redis_breaker.guard(default=True)
+def _take_fill_lock(short_code):
+    # Without Redis every miss fills on its own, like before single-flight
+    return bool(redis_client().set(FILL_LOCK_KEY.format(code=short_code), 1, nx=True, ex=settings.LINK_FILL_LOCK_TIMEOUT))
+
+
+@redis_breaker.guard(default=True)
+async def _atake_fill_lock(short_code):
+    return bool(await async_redis_client().set(
+        FILL_LOCK_KEY.format(code=short_code), 1, nx=True, ex=settings.LINK_FILL_LOCK_TIMEOUT,
+    ))
+
+
+@redis_breaker.guard()
+def _release_fill_lock(short_code):
+    # If load outlived the lock another request may hold it now; it then just fills twice
+    redis_client().delete(FILL_LOCK_KEY.format(code=short_code))
+
+
+@redis_breaker.guard()
+async def _arelease_fill_lock(short_code):
+    await async_redis_client().delete(FILL_LOCK_KEY.format(code=short_code))
+
+
+def _fill_poll(pipe, short_code):
+    pipe.get(_raw_key(redirect_cache_key(short_code)))
+    pipe.exists(MISSING_KEY.format(code=short_code))
+
+
+def _filled(short_code, results):
+    """(done, entry) from a _fill_poll: done once the entry is cached or the code is known missing."""
+    raw, missing = results
+    entry = cache.client.decode(raw) if raw is not None else None
+    if isinstance(entry, dict):
+        local_links.set(short_code, entry)
+        return True, entry
+    return bool(missing), None
+
+
+@redis_breaker.guard()
+def _poll_fill(short_code):
+    pipe = redis_client().pipeline(transaction=False)
+    _fill_poll(pipe, short_code)
+    return _filled(short_code, pipe.execute())
+
+
+@redis_breaker.guard()
+async def _apoll_fill(short_code):
+    pipe = async_redis_client().pipeline(transaction=False)
+    _fill_poll(pipe, short_code)
+    return _filled(short_code, await pipe.execute())
+
+
+def fill_link(short_code, load):
+    """
+    Resolves a cache miss with load(), which caches and returns the entry, or
+    returns None for a code that doesn't exist. Only one request per code runs
+    it at a time: concurrent misses wait up to LINK_FILL_WAIT seconds for that
+    request's result instead of all querying the DB (a cold cache after a Redis
+    flush would otherwise send every hot link's traffic there at once).
+    """
+    if _take_fill_lock(short_code):
+        try:
+            return load()
+        finally:
+            _release_fill_lock(short_code)
+
+    deadline = time.monotonic() + settings.LINK_FILL_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(FILL_POLL_INTERVAL)
+        polled = _poll_fill(short_code)
+        if polled is None:
+            # Redis went away while we waited
+            break
+        done, entry = polled
+        if done:
+            return entry
+    # The filling request is stuck or gone; don't make this one fail
+    return load()
+
+
+async def afill_link(short_code, load):
+    """fill_link for async views; load is a coroutine function."""
+    if await _atake_fill_lock(short_code):
+        try:
+            return await load()
+        finally:
+            await _arelease_fill_lock(short_code)
+
+    deadline = time.monotonic() + settings.LINK_FILL_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(FILL_POLL_INTERVAL)
+        polled = await _apoll_fill(short_code)
+        if polled is None:
+            break
+        done, entry = polled
+        if done:
+            return entry
+    return await load()
+
+
+@redis_breaker.guard()
+def _publish_invalidation(short_code):
+    cache.delete(redirect_cache_key(short_code))
+    redis_client().xadd(
+        INVALIDATION_STREAM, {'code': short_code},
+        maxlen=INVALIDATION_STREAM_MAXLEN, approximate=True,
+    )
+
+
+def invalidate_link(short_code):
+    """Drops a short code from Redis and from the local cache of every worker."""
+    local_links.delete(short_code)
+    _publish_invalidation(short_code)
+
+
+def _queue_missing_check(pipe, short_code):
+    pipe.exists(MISSING_KEY.format(code=short_code))
+    if settings.LINK_FILTER_ENABLED:
+        link_filter.queue_check(pipe, short_code)
+
+
+def _missing_reason(results):
+    """Which FILTER_STATS_KEY counter a lookup counts against, or None if the code may exist."""
+    if results[0]:
+        return 'negative_hits'
+    if settings.LINK_FILTER_ENABLED and not link_filter.check_result(results[1:]):
+        return 'rejected'
+    return None
+
+
+@redis_breaker.guard(default=False)
+def is_known_missing(short_code):
+    """
+    True when short_code certainly doesn't exist: it was looked up in vain
+    recently, or the membership filter has never seen it. One Redis round trip.
+    False when Redis is unavailable, so the lookup falls back to the DB.
+    """
+    pipe = redis_client().pipeline(transaction=False)
+    _queue_missing_check(pipe, short_code)
+    reason = _missing_reason(pipe.execute())
+    if reason:
+        redis_client().hincrby(FILTER_STATS_KEY, reason, 1)
+    return reason is not None
+
+
+@redis_breaker.guard(default=False)
+async def ais_known_missing(short_code):
+    redis = async_redis_client()
+    pipe = redis.pipeline(transaction=False)
+    _queue_missing_check(pipe, short_code)
+    reason = _missing_reason(await pipe.execute())
+    if reason:
+        await redis.hincrby(FILTER_STATS_KEY, reason, 1)
+    return reason is not None
+
+
+@redis_breaker.guard()
+def remember_missing(short_code):
+    """Caches a failed lookup; if the filter let it through, that was a false positive."""
+    redis = redis_client()
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(MISSING_KEY.format(code=short_code), 1, ex=settings.NEGATIVE_CACHE_TIMEOUT)
+    pipe.exists(link_filter.key)
+    _, filter_exists = pipe.execute()
+    if settings.LINK_FILTER_ENABLED and filter_exists:
+        redis.hincrby(FILTER_STATS_KEY, 'false_positives', 1)
+
+
+@redis_breaker.guard()
+async def aremember_missing(short_code):
+    redis = async_redis_client()
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(MISSING_KEY.format(code=short_code), 1, ex=settings.NEGATIVE_CACHE_TIMEOUT)
+    pipe.exists(link_filter.key)
+    _, filter_exists = await pipe.execute()
+    if settings.LINK_FILTER_ENABLED and filter_exists:
+        await redis.hincrby(FILTER_STATS_KEY, 'false_positives', 1)
+
+
+@redis_breaker.guard()
+def register_link_code(short_code):
+    """Makes a new or renamed short code resolvable: adds it to the filter, clears any miss."""
+    redis = redis_client()
+    pipe = redis.pipeline(transaction=False)
+    # SETBIT would create the key, and a filter holding only new codes rejects every old one
+    if redis.exists(link_filter.key):
+        link_filter.add(pipe, short_code)
+    pipe.delete(MISSING_KEY.format(code=short_code))
+    pipe.execute()
+
+
+@redis_breaker.guard()
+def link_filter_stats():
+    """Filter counters and fill for /internal/stats/; None while Redis is unavailable."""
+    redis = redis_client()
+    counters = {key.decode(): int(value) for key, value in redis.hgetall(FILTER_STATS_KEY).items()}
+    rejected = counters.get('rejected', 0)
+    false_positives = counters.get('false_positives', 0)
+    misses = rejected + false_positives
+    return {
+        'enabled': settings.LINK_FILTER_ENABLED,
+        'built': bool(redis.exists(link_filter.key)),
+        'size_bits': link_filter.size,
+        'hashes': link_filter.hashes,
+        'rejected': rejected,
+        'false_positives': false_positives,
+        'negative_cache_hits': counters.get('negative_hits', 0),
+        # Share of lookups for nonexistent codes the filter failed to reject
+        'observed_false_positive_rate': false_positives / misses if misses else 0.0,
+        'estimated_false_positive_rate': link_filter.estimated_false_positive_rate(redis),
+    }
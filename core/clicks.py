@@ -0,0 +1,223 @@
+import json
+import logging
+import queue
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .breaker import redis_breaker
+from .cache import redis_client, async_redis_client
+from .dimensions import intern
+from .leaderboards import add_clicks
+from .models import Link, Click, Referer, UserAgent
+from .visitors import add_visitors
+
+logger = logging.getLogger(__name__)
+
+# Redis list the 'buffered' mode appends to, drained by `manage.py flush_clicks`
+CLICK_QUEUE_KEY = 'clicks:queue'
+# Per-consumer list holding the batch being written (at-least-once mode)
+CLICK_PROCESSING_KEY = 'clicks:processing:{consumer}'
+
+# Pending clicks for the 'deferred' mode, written by a single background thread
+_pending = queue.Queue(maxsize=settings.CLICK_QUEUE_MAXSIZE)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def click_event(meta, link_id, timestamp=None):
+    """
+    Captures the request data a Click row needs, trimmed to the column sizes.
+    meta is request.META, or the WSGI environ on the redirect fast path.
+    timestamp defaults to now; access log lines carry their own.
+    """
+    user_agent = meta.get('HTTP_USER_AGENT')
+    referer = meta.get('HTTP_REFERER')
+    return {
+        'link_id': link_id,
+        'timestamp': (timestamp or timezone.now()).isoformat(),
+        'ip_address': meta.get('REMOTE_ADDR'),
+        'user_agent': user_agent[:500] if user_agent else None,
+        'referer': referer[:1000] if referer else None,
+    }
+
+
+def save_clicks(events):
+    """
+    Writes a batch of click events: one bulk INSERT for the Click rows and one
+    UPDATE per distinct increment for Link.clicks_count, instead of a row lock
+    on the hot Link for every single click. User agents and referers are
+    interned first and stored as ids (see core/dimensions.py).
+    Visitors are then added to the links' HyperLogLog sketches and clicks to
+    the top-link leaderboards, one pipeline each per batch.
+    Events for links deleted in the meantime are dropped. Returns the number saved.
+    """
+    link_ids = {event['link_id'] for event in events}
+    owners = dict(Link.objects.filter(id__in=link_ids).values_list('id', 'owner_id'))
+    events = [event for event in events if event['link_id'] in owners]
+    if not events:
+        return 0
+
+    user_agents = intern(UserAgent, (event['user_agent'] for event in events if event['user_agent']))
+    referers = intern(Referer, (event['referer'] for event in events if event['referer']))
+    clicks = [
+        Click(
+            link_id=event['link_id'],
+            timestamp=datetime.fromisoformat(event['timestamp']),
+            ip_address=event['ip_address'],
+            user_agent_id=user_agents.get(event['user_agent']),
+            referer_id=referers.get(event['referer']),
+        )
+        for event in events
+    ]
+    # Links that received the same number of clicks share one UPDATE
+    by_increment = defaultdict(list)
+    for link_id, count in Counter(event['link_id'] for event in events).items():
+        by_increment[count].append(link_id)
+
+    with transaction.atomic():
+        Click.objects.bulk_create(clicks, batch_size=1000)
+        for count, ids in by_increment.items():
+            Link.objects.filter(id__in=ids).update(clicks_count=F('clicks_count') + count)
+    # After the commit; a replayed batch adds the same visitors again, which HyperLogLog ignores
+    add_visitors(events)
+    add_clicks(events, owners)
+    return len(events)
+
+
+def _defer(event):
+    """Hands event to the background writer; False if its queue is full."""
+    _ensure_writer()
+    try:
+        _pending.put_nowait(event)
+        return True
+    except queue.Full:
+        # The writer is falling behind; don't lose the click
+        logger.warning("Click queue full, recording click synchronously")
+        return False
+
+
+@redis_breaker.guard(default=False)
+def _buffer(event):
+    redis_client().rpush(CLICK_QUEUE_KEY, json.dumps(event))
+    return True
+
+
+@redis_breaker.guard(default=False)
+async def _abuffer(event):
+    await async_redis_client().rpush(CLICK_QUEUE_KEY, json.dumps(event))
+    return True
+
+
+def record_click(meta, link_id):
+    """
+    Records a click according to settings.CLICK_RECORDING:
+    'sync' writes it during the request, 'deferred' hands it to a background
+    thread, and 'buffered' appends it to a Redis list for `flush_clicks`.
+    The last two leave the redirect itself with no database work.
+    Buffered clicks are written synchronously while Redis is unavailable.
+    """
+    event = click_event(meta, link_id)
+    if settings.CLICK_RECORDING == 'buffered':
+        if _buffer(event):
+            return
+    elif settings.CLICK_RECORDING == 'deferred':
+        if _defer(event):
+            return
+    save_clicks([event])
+
+
+async def arecord_click(meta, link_id):
+    """record_click for async views; only the 'sync' mode leaves the event loop."""
+    event = click_event(meta, link_id)
+    if settings.CLICK_RECORDING == 'buffered':
+        if await _abuffer(event):
+            return
+    elif settings.CLICK_RECORDING == 'deferred':
+        if _defer(event):
+            return
+    await sync_to_async(save_clicks)([event])
+
+
+@redis_breaker.guard()
+def queue_depth():
+    """Clicks waiting in the Redis buffer, or None while Redis is unavailable."""
+    return redis_client().llen(CLICK_QUEUE_KEY)
+
+
+class ClickBuffer:
+    """
+    Drains the Redis click buffer in batches.
+
+    With at_least_once, each batch is moved atomically to a per-consumer
+    processing list and only removed after the DB transaction commits, so a
+    failed write is retried by the next flush and a crash mid-batch replays it
+    on the next start (clicks may be counted twice if the crash comes after
+    the commit). Without it, batches are popped and a crash loses them.
+    """
+
+    def __init__(self, batch_size=None, at_least_once=None, consumer='default'):
+        self.batch_size = batch_size or settings.CLICK_BATCH_SIZE
+        if at_least_once is None:
+            at_least_once = settings.CLICK_AT_LEAST_ONCE
+        self.at_least_once = at_least_once
+        self.processing_key = CLICK_PROCESSING_KEY.format(consumer=consumer)
+        self.redis = redis_client()
+
+    def recover(self):
+        """Puts back a batch left behind by a crashed consumer. Returns its size."""
+        restored = 0
+        while self.redis.lmove(self.processing_key, CLICK_QUEUE_KEY, 'RIGHT', 'LEFT'):
+            restored += 1
+        return restored
+
+    def flush(self):
+        """Writes one batch. Returns (events taken, clicks saved)."""
+        if self.at_least_once:
+            # A batch whose write failed earlier goes first; taking more would delete it unsaved
+            raw = self.redis.lrange(self.processing_key, 0, -1)
+            if not raw:
+                pipe = self.redis.pipeline()
+                for _ in range(self.batch_size):
+                    pipe.lmove(CLICK_QUEUE_KEY, self.processing_key, 'LEFT', 'RIGHT')
+                raw = [item for item in pipe.execute() if item]
+        else:
+            raw = self.redis.lpop(CLICK_QUEUE_KEY, self.batch_size) or []
+
+        if not raw:
+            return 0, 0
+        saved = save_clicks([json.loads(item) for item in raw])
+        if self.at_least_once:
+            self.redis.delete(self.processing_key)
+        return len(raw), saved
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_pending, name='click-writer', daemon=True)
+            _writer.start()
+
+
+def _write_pending():
+    while True:
+        events = [_pending.get()]
+        while len(events) < settings.CLICK_BATCH_SIZE:
+            try:
+                events.append(_pending.get_nowait())
+            except queue.Empty:
+                break
+        close_old_connections()
+        try:
+            save_clicks(events)
+        except Exception:
+            logger.exception("Failed to record %d clicks", len(events))
@@ -0,0 +1,149 @@
+"""
+User agents and referers stored once in their own tables (UserAgent, Referer)
+and referenced from Click by id. Values are interned by a hash of the string
+through a per-worker cache, so saving a batch of clicks usually costs no
+dimension queries at all.
+"""
+import hashlib
+import re
+from collections import Counter
+from datetime import datetime, time, timedelta
+from urllib.parse import urlsplit
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from .cache import LocalCache
+from .models import Click, DailyBreakdownCount, Referer, UserAgent
+from .rollups import breakdown_counts, rolled_up_until
+
+# Ids never change, so entries only leave the cache when it is full
+_ids = LocalCache(maxsize=50000, ttl=86400)
+
+BOT_RE = re.compile(r'bot|crawl|spider|slurp|curl|wget|python-requests|httpclient|headless|preview', re.I)
+# First match wins, so more specific tokens come first (Edge and Opera also claim Chrome)
+BROWSERS = (
+    ('Edge', re.compile(r'edg(e|a|ios)?/', re.I)),
+    ('Opera', re.compile(r'opr/|opera', re.I)),
+    ('Samsung Internet', re.compile(r'samsungbrowser', re.I)),
+    ('Firefox', re.compile(r'firefox|fxios', re.I)),
+    ('Chrome', re.compile(r'chrome|crios', re.I)),
+    ('Safari', re.compile(r'safari', re.I)),
+)
+OPERATING_SYSTEMS = (
+    ('Windows', re.compile(r'windows', re.I)),
+    ('iOS', re.compile(r'iphone|ipad|ipod', re.I)),
+    ('macOS', re.compile(r'mac os x|macintosh', re.I)),
+    ('Android', re.compile(r'android', re.I)),
+    ('ChromeOS', re.compile(r'cros', re.I)),
+    ('Linux', re.compile(r'linux', re.I)),
+)
+
+
+def digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+def _first_match(patterns, value):
+    return next((name for name, pattern in patterns if pattern.search(value)), 'Other')
+
+
+def parse_user_agent(value):
+    """{browser, os, device} from a User-Agent header, by a few well-known tokens."""
+    lower = value.lower()
+    if BOT_RE.search(value):
+        device = 'bot'
+    elif 'ipad' in lower or 'tablet' in lower or ('android' in lower and 'mobile' not in lower):
+        device = 'tablet'
+    elif 'mobi' in lower or 'iphone' in lower:
+        device = 'mobile'
+    else:
+        device = 'desktop'
+    return {
+        'browser': _first_match(BROWSERS, value),
+        'os': _first_match(OPERATING_SYSTEMS, value),
+        'device': device,
+    }
+
+
+def parse_referer(value):
+    try:
+        host = urlsplit(value).hostname or ''
+    except ValueError:
+        host = ''
+    return {'domain': host.removeprefix('www.')[:255]}
+
+
+PARSERS = {
+    'useragent': parse_user_agent,
+    'referer': parse_referer,
+}
+
+
+def intern(model, values):
+    """
+    {value: id} for the given UserAgent or Referer values, creating the rows
+    that don't exist yet.
+    """
+    name = model._meta.model_name
+    ids, missing = {}, {}
+    for value in set(values):
+        key = digest(value)
+        cached = _ids.get((name, key))
+        if cached is not None:
+            ids[value] = cached
+        else:
+            missing[key] = value
+    if not missing:
+        return ids
+
+    parse = PARSERS[name]
+    # Concurrent writers may insert the same value; the unique digest keeps one row
+    model.objects.bulk_create(
+        [model(digest=key, value=value, **parse(value)) for key, value in missing.items()],
+        ignore_conflicts=True,
+    )
+    for key, pk in model.objects.filter(digest__in=list(missing)).values_list('digest', 'id'):
+        _ids.set((name, key), pk)
+        ids[missing[key]] = pk
+    return ids
+
+
+def clear_cache():
+    _ids.clear()
+
+
+def breakdowns(link, start, end, limit=5):
+    """
+    Top browsers, operating systems, devices and referer domains among link's
+    clicks on the days [start, end], as {name: [(label, clicks)]}. Read from
+    the daily breakdown rollup plus the clicks not rolled up yet, so the cost
+    follows the range rather than the link's click volume.
+    """
+    counts = {dimension: Counter() for dimension in DailyBreakdownCount.Dimension}
+    rolled_up = (
+        DailyBreakdownCount.objects.filter(link=link, day__range=(start, end))
+        .values_list('dimension', 'value')
+        .annotate(total=Sum('count'))
+        .order_by()
+    )
+    for dimension, value, total in rolled_up:
+        counts[dimension][value] += total
+
+    tz = timezone.get_current_timezone()
+    recent = Click.objects.filter(
+        link=link,
+        id__gt=rolled_up_until(),
+        timestamp__gte=datetime.combine(start, time.min, tzinfo=tz),
+        timestamp__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+    for (_, _, dimension, value), n in breakdown_counts(recent).items():
+        counts[dimension][value] += n
+
+    Dimension = DailyBreakdownCount.Dimension
+    return {
+        'browsers': counts[Dimension.BROWSER].most_common(limit),
+        'operating_systems': counts[Dimension.OS].most_common(limit),
+        'devices': counts[Dimension.DEVICE].most_common(limit),
+        'referers': counts[Dimension.REFERER].most_common(limit),
+    }
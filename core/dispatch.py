@@ -0,0 +1,177 @@
+"""
+WSGI/ASGI wrappers that answer cached redirects before Django's handler, so a
+redirect skips the middleware stack (sessions, CSRF, auth, messages, htmx,
+allauth), URL resolution and request construction.
+
+Only GET/HEAD requests for a single-segment path whose short code is in the
+local or Redis cache are answered here. Everything else, including cache
+misses and unknown codes, falls through to the full Django stack.
+"""
+import re
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.utils.encoding import iri_to_uri
+
+from . import metrics
+from .cache import get_cached_link, aget_cached_link, is_cacheable
+from .clicks import record_click, arecord_click
+
+SHORT_CODE_PATH = re.compile(r'/([A-Za-z0-9_-]+)\Z')
+# HttpResponseRedirect refuses other schemes; leave those to Django
+REDIRECT_SCHEMES = {'http', 'https', 'ftp'}
+
+
+def _short_code(method, path, secure):
+    if not settings.REDIRECT_FAST_PATH or method not in ('GET', 'HEAD'):
+        return None
+    # SecurityMiddleware has to redirect plain HTTP requests first
+    if settings.SECURE_SSL_REDIRECT and not secure:
+        return None
+    match = SHORT_CODE_PATH.match(path)
+    return match.group(1) if match else None
+
+
+def _proxy_secure(header_value):
+    # Same rule as HttpRequest.is_secure()
+    _header, expected = settings.SECURE_PROXY_SSL_HEADER
+    return header_value is not None and header_value.split(',', 1)[0].strip() == expected
+
+
+def _redirect_status(entry):
+    if is_cacheable(entry) and entry['permanent']:
+        return 301, '301 Moved Permanently'
+    return 302, '302 Found'
+
+
+def _redirect_headers(entry):
+    """The headers redirect_url's response gets from the view and the security middleware."""
+    if urlsplit(entry['url']).scheme not in REDIRECT_SCHEMES:
+        return None
+    headers = [
+        ('Content-Type', 'text/html; charset=utf-8'),
+        ('Content-Length', '0'),
+        ('Location', iri_to_uri(entry['url'])),
+    ]
+    if is_cacheable(entry):
+        headers.append(('Cache-Control', f"public, max-age={entry['max_age']}"))
+    else:
+        headers += [
+            ('Cache-Control', 'no-cache, no-store, must-revalidate'),
+            ('Pragma', 'no-cache'),
+            ('Expires', '0'),
+        ]
+    if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+        headers.append(('X-Content-Type-Options', 'nosniff'))
+    if settings.SECURE_REFERRER_POLICY:
+        policy = settings.SECURE_REFERRER_POLICY
+        headers.append(('Referrer-Policy', policy if isinstance(policy, str) else ','.join(policy)))
+    if settings.SECURE_CROSS_ORIGIN_OPENER_POLICY:
+        headers.append(('Cross-Origin-Opener-Policy', settings.SECURE_CROSS_ORIGIN_OPENER_POLICY))
+    headers.append(('X-Frame-Options', settings.X_FRAME_OPTIONS))
+    return headers
+
+
+def _click_meta(scope, headers):
+    """The request.META keys click_event() reads, from an ASGI scope."""
+    client = scope.get('client')
+    return {
+        'REMOTE_ADDR': client[0] if client else None,
+        'HTTP_USER_AGENT': headers.get(b'user-agent', b'').decode('latin-1') or None,
+        'HTTP_REFERER': headers.get(b'referer', b'').decode('latin-1') or None,
+    }
+
+
+def _discard(state):
+    if state:
+        metrics.discard(state)
+
+
+class RedirectDispatcher:
+    """Wraps the WSGI application, see the module docstring."""
+
+    def __init__(self, application):
+        self.application = application
+
+    def _secure(self, environ):
+        if settings.SECURE_PROXY_SSL_HEADER:
+            return _proxy_secure(environ.get(settings.SECURE_PROXY_SSL_HEADER[0]))
+        return environ.get('wsgi.url_scheme') == 'https'
+
+    def _record_click(self, environ, link_id):
+        # Django's handler would send these around the request; their close_old_connections
+        # replaces a connection that went stale or outlived CONN_MAX_AGE before the click is saved
+        request_started.send(sender=self.__class__, environ=environ)
+        try:
+            record_click(environ, link_id)
+        finally:
+            request_finished.send(sender=self.__class__)
+
+    def __call__(self, environ, start_response):
+        code = _short_code(environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''), self._secure(environ))
+        if code is None:
+            return self.application(environ, start_response)
+
+        state = metrics.begin()
+        try:
+            entry = get_cached_link(code)
+            headers = _redirect_headers(entry) if entry else None
+            if headers is not None and not is_cacheable(entry):
+                self._record_click(environ, entry['id'])
+        except BaseException:
+            _discard(state)
+            raise
+        if headers is None:
+            _discard(state)
+            return self.application(environ, start_response)
+
+        start_response(_redirect_status(entry)[1], headers)
+        if state and metrics.finish(state, 'redirect'):
+            metrics.flush()
+        return [b'']
+
+
+class AsyncRedirectDispatcher:
+    """Wraps the ASGI application, see the module docstring."""
+
+    def __init__(self, application):
+        self.application = application
+
+    def _secure(self, scope, headers):
+        if settings.SECURE_PROXY_SSL_HEADER:
+            # HTTP_X_FORWARDED_PROTO -> x-forwarded-proto
+            name = settings.SECURE_PROXY_SSL_HEADER[0][5:].lower().replace('_', '-').encode('latin-1')
+            value = headers.get(name)
+            return _proxy_secure(value.decode('latin-1') if value is not None else None)
+        return scope.get('scheme') == 'https'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.application(scope, receive, send)
+        headers = dict(scope['headers'])
+        code = _short_code(scope['method'], scope['path'], self._secure(scope, headers))
+        if code is None:
+            return await self.application(scope, receive, send)
+
+        state = metrics.begin()
+        try:
+            entry = await aget_cached_link(code)
+            response_headers = _redirect_headers(entry) if entry else None
+            if response_headers is not None and not is_cacheable(entry):
+                await arecord_click(_click_meta(scope, headers), entry['id'])
+        except BaseException:
+            _discard(state)
+            raise
+        if response_headers is None:
+            _discard(state)
+            return await self.application(scope, receive, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': _redirect_status(entry)[0],
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response_headers],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        if state and metrics.finish(state, 'redirect'):
+            await metrics.aflush()
@@ -0,0 +1,191 @@
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from .cache import redis_client
+from .utils import encode
+
+# When a counter is first set up, ids start this far above the current max id,
+# clear of anything handed out by processes still running the old code
+ID_HEADROOM = 10000
+
+REDIS_COUNTER_KEY = 'links:id_hwm'
+# Replaced whenever the counter is recreated, e.g. after a Redis flush
+REDIS_EPOCH_KEY = 'links:id_epoch'
+# Created by migration 0006 on PostgreSQL, INCREMENT BY the block size
+BLOCK_SEQUENCE = 'core_link_id_block'
+
+
+def _max_link_id():
+    from .models import Link
+    return Link.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+
+class RedisIdBlocks:
+    """
+    Blocks come from INCRBY on a Redis counter; works with any database.
+
+    A counter lost with Redis is recreated above the highest committed id,
+    together with a new epoch. Each worker then raises it past the ids it
+    reserved from the old counter before taking a block, so the counter never
+    goes back over them, and the allocator drops the ids it still held.
+    """
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        # The highest id this worker has reserved, and the epoch of the counter it came from
+        self.high = 0
+        self.epoch = None
+
+    def _ensure_counter(self, redis):
+        def create(pipe):
+            if pipe.exists(REDIS_EPOCH_KEY):
+                return
+            # A counter left from before epochs existed is kept where it is
+            floor = max(_max_link_id() + ID_HEADROOM, self.high, int(pipe.get(REDIS_COUNTER_KEY) or 0))
+            pipe.multi()
+            pipe.set(REDIS_COUNTER_KEY, floor)
+            pipe.set(REDIS_EPOCH_KEY, uuid.uuid4().hex)
+
+        if not redis.exists(REDIS_EPOCH_KEY):
+            # Watched, so only one worker creates it; SET rather than NX replaces a
+            # counter INCRBY recreated from zero after the flush
+            redis.transaction(create, REDIS_EPOCH_KEY, REDIS_COUNTER_KEY)
+
+    def _raise_counter(self, redis):
+        def raise_to_high(pipe):
+            current = int(pipe.get(REDIS_COUNTER_KEY) or 0)
+            pipe.multi()
+            if current < self.high:
+                pipe.set(REDIS_COUNTER_KEY, self.high)
+
+        redis.transaction(raise_to_high, REDIS_COUNTER_KEY)
+
+    def reserve(self):
+        redis = redis_client()
+        while True:
+            self._ensure_counter(redis)
+            pipe = redis.pipeline()
+            pipe.incrby(REDIS_COUNTER_KEY, self.block_size)
+            pipe.get(REDIS_EPOCH_KEY)
+            high, epoch = pipe.execute()
+            if epoch is None:
+                # Flushed again in between
+                continue
+            if epoch != self.epoch and high - self.block_size < self.high:
+                # A new counter below our old blocks, whose ids may still be going into INSERTs:
+                # drop this block and take one past them
+                self._raise_counter(redis)
+                self.epoch = epoch
+                continue
+            self.epoch = epoch
+            self.high = max(self.high, high)
+            return range(high - self.block_size + 1, high + 1)
+
+    def high_water_mark(self):
+        redis = redis_client()
+        self._ensure_counter(redis)
+        return max(int(redis.get(REDIS_COUNTER_KEY) or 0), self.high)
+
+
+class SequenceIdBlocks:
+    """Blocks come from a PostgreSQL sequence whose increment is the block size."""
+    # Kept with the links, so it's never recreated under the allocator
+    epoch = None
+
+    def __init__(self):
+        self._block_size = None
+
+    @property
+    def block_size(self):
+        if self._block_size is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT increment_by FROM pg_sequences WHERE sequencename = %s", [BLOCK_SEQUENCE])
+                self._block_size = cursor.fetchone()[0]
+        return self._block_size
+
+    def reserve(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [BLOCK_SEQUENCE])
+            low = cursor.fetchone()[0]
+        return range(low, low + self.block_size)
+
+    def high_water_mark(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT last_value, is_called FROM {BLOCK_SEQUENCE}")
+            last_value, is_called = cursor.fetchone()
+        return last_value + self.block_size - 1 if is_called else last_value - 1
+
+
+class IdAllocator:
+    """
+    Hands out Link ids from blocks reserved in one round trip (hi-lo), so a
+    worker knows a link's id, and therefore its short code, before the INSERT.
+
+    Ids whose generated code is already taken by a custom alias are skipped
+    when the block is reserved, and aliases inside reserved ranges are refused
+    by Link.objects.alias_taken, so the two namespaces never collide.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        with self._lock:
+            while len(self._ids) < count:
+                self._reserve_block()
+            return [self._ids.popleft() for _ in range(count)]
+
+    def _reserve_block(self):
+        from .models import Link
+        epoch = self.blocks.epoch
+        block = self.blocks.reserve()
+        if self.blocks.epoch != epoch:
+            # The counter was recreated; ids left from its old blocks may be handed out again
+            self._ids.clear()
+        codes = {encode(link_id): link_id for link_id in block}
+        taken = set(Link.objects.filter(short_code__in=list(codes)).values_list('short_code', flat=True))
+        self._ids.extend(link_id for code, link_id in codes.items() if code not in taken)
+
+    def high_water_mark(self):
+        """Every id up to here has been reserved by some worker."""
+        return self.blocks.high_water_mark()
+
+
+def _build_allocator():
+    backend = settings.LINK_ID_ALLOCATOR
+    if backend == 'auto':
+        backend = 'sequence' if connection.vendor == 'postgresql' else 'redis'
+    if backend == 'sequence':
+        return IdAllocator(SequenceIdBlocks())
+    return IdAllocator(RedisIdBlocks(settings.LINK_ID_BLOCK_SIZE))
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = _build_allocator()
+    return _allocator
+
+
+def allocate_link_ids(count=1):
+    return get_allocator().allocate(count)
+
+
+def reset_allocator():
+    """Drops the allocator with its reserved ids; the next allocation builds a new one."""
+    global _allocator
+    with _allocator_lock:
+        _allocator = None
@@ -0,0 +1,108 @@
+"""
+Top links in Redis sorted sets scored by clicks: one set per day for the
+whole site and one per owner. Saved click batches are added with ZINCRBY;
+longer windows are merged from the daily sets with ZUNIONSTORE and kept for
+a short while. Top-K reads never aggregate Click or sort Link.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .breaker import redis_breaker
+from .cache import redis_client
+from .models import Link
+
+LEADERBOARD_KEY = 'top:{scope}:{day}'
+# A merged window, named after its last day so it is rebuilt when the day rolls over
+WINDOW_KEY = 'top:{scope}:{window}:{day}'
+GLOBAL_SCOPE = 'global'
+# Days covered by each window, counting today
+WINDOWS = {
+    'day': 1,
+    'week': 7,
+}
+
+
+def owner_scope(owner_id):
+    return f'user:{owner_id}'
+
+
+def leaderboard_key(scope, day):
+    return LEADERBOARD_KEY.format(scope=scope, day=day.isoformat())
+
+
+def _expire_seconds():
+    # Daily sets only need to outlive the longest window
+    return (max(WINDOWS.values()) + 1) * 86400
+
+
+@redis_breaker.guard()
+def add_clicks(events, owners):
+    """
+    Adds a batch of click events to the daily sets of the site and of each
+    link's owner. owners maps link id to owner id (None for anonymous links).
+    """
+    counts = Counter(
+        (event['link_id'], timezone.localdate(datetime.fromisoformat(event['timestamp'])))
+        for event in events
+    )
+    keys = set()
+    pipe = redis_client().pipeline(transaction=False)
+    for (link_id, day), n in counts.items():
+        scopes = [GLOBAL_SCOPE]
+        if owners.get(link_id) is not None:
+            scopes.append(owner_scope(owners[link_id]))
+        for scope in scopes:
+            key = leaderboard_key(scope, day)
+            pipe.zincrby(key, n, link_id)
+            keys.add(key)
+    for key in keys:
+        pipe.expire(key, _expire_seconds())
+    pipe.execute()
+
+
+@redis_breaker.guard()
+def top_links(scope, window='day', limit=10):
+    """
+    [(link_id, clicks)] of the busiest links of scope over the window ending
+    today, busiest first, or None while Redis is unavailable.
+    """
+    today = timezone.localdate()
+    redis = redis_client()
+    if WINDOWS[window] == 1:
+        key = leaderboard_key(scope, today)
+    else:
+        key = WINDOW_KEY.format(scope=scope, window=window, day=today.isoformat())
+        if not redis.exists(key):
+            days = [leaderboard_key(scope, today - timedelta(days=i)) for i in range(WINDOWS[window])]
+            pipe = redis.pipeline()
+            pipe.zunionstore(key, days)
+            pipe.zremrangebyrank(key, 0, -settings.LEADERBOARD_SIZE - 1)
+            pipe.expire(key, settings.LEADERBOARD_MERGE_TTL)
+            pipe.execute()
+    return [(int(member), int(score)) for member, score in redis.zrevrange(key, 0, limit - 1, withscores=True)]
+
+
+def leaderboard(scope, window='day', limit=10):
+    """top_links() as [(Link, clicks)], skipping deleted links; None while Redis is unavailable."""
+    entries = top_links(scope, window, limit)
+    if entries is None:
+        return None
+    links = Link.objects.in_bulk([link_id for link_id, _ in entries])
+    return [(links[link_id], clicks) for link_id, clicks in entries if link_id in links]
+
+
+@redis_breaker.guard(default=0)
+def trim_leaderboards():
+    """
+    Keeps the LEADERBOARD_SIZE busiest links in each site-wide daily set,
+    which otherwise holds every link clicked that day. Owner sets are bounded
+    by the owner's links and left alone. Returns the number of entries removed.
+    """
+    today = timezone.localdate()
+    pipe = redis_client().pipeline(transaction=False)
+    for i in range(max(WINDOWS.values())):
+        pipe.zremrangebyrank(leaderboard_key(GLOBAL_SCOPE, today - timedelta(days=i)), 0, -settings.LEADERBOARD_SIZE - 1)
+    return sum(pipe.execute())
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.archive import archive_dir, archive_old_months, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the next months' click partitions and moves clicks older than the retention "
+        "period to gzipped CSV files. Run it daily, after rollup_clicks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retain-months', type=int, default=settings.CLICK_RETENTION_MONTHS,
+            help="Months of raw clicks kept in the database, the current one included (0 archives nothing).",
+        )
+        parser.add_argument('--months-ahead', type=int, default=2, help="Partitions created in advance.")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows read or deleted per query.")
+
+    def handle(self, *args, **options):
+        for name in ensure_partitions(options['months_ahead']):
+            self.stdout.write(f"Created partition {name}")
+        if options['retain_months'] <= 0:
+            return
+        for month, count in archive_old_months(options['retain_months'], options['batch_size']).items():
+            if count is None:
+                self.stdout.write(f"{month:%Y-%m}: skipped, clicks not rolled up yet")
+            elif count:
+                self.stdout.write(f"{month:%Y-%m}: archived {count} clicks to {archive_dir()}")
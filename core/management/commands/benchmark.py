@@ -0,0 +1,84 @@
+import json
+import subprocess
+import sys
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmarks
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and benchmarks redirect, shorten, dashboard "
+        "and analytics requests in-process. Never touches the configured database or Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--links', type=int, default=1000)
+        parser.add_argument('--clicks', type=int, default=10000)
+        parser.add_argument('--iterations', type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests per scenario.")
+        parser.add_argument('--scenario', choices=benchmarks.SCENARIOS, action='append', dest='scenarios',
+                            help="Repeatable; all scenarios by default.")
+        parser.add_argument('--click-recording', choices=['sync', 'deferred', 'buffered'],
+                            help="Overrides CLICK_RECORDING for the run.")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+        parser.add_argument('--output', help="Also write the JSON results to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            import fakeredis  # noqa: F401
+        except ImportError:
+            raise CommandError("The benchmark needs fakeredis: pip install fakeredis")
+
+        overrides = {}
+        if options['click_recording']:
+            overrides['CLICK_RECORDING'] = options['click_recording']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with benchmarks.isolated_redis(options['links'], **overrides):
+                owner = benchmarks.seed(options['links'], options['clicks'])
+                results = benchmarks.run(
+                    owner, options['scenarios'] or benchmarks.SCENARIOS, options['iterations'], options['warmup'],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'links': options['links'],
+            'clicks': options['clicks'],
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{'scenario':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<18} {result['requests_per_second']:>8.0f} {result['p50_ms']:>8.2f} "
+                f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['queries_per_request']:>8.1f}"
+            )
@@ -0,0 +1,100 @@
+import asyncio
+import random
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Link
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def _connect(parts):
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    context = ssl.create_default_context() if parts.scheme == 'https' else None
+    return await asyncio.open_connection(parts.hostname, port, ssl=context)
+
+
+async def _worker(target, paths, counter, latencies, statuses):
+    parts = urlsplit(target)
+    reader, writer = await _connect(parts)
+    try:
+        while counter[0] > 0:
+            counter[0] -= 1
+            path = random.choice(paths)
+            started = time.perf_counter()
+            writer.write(f"GET {parts.path.rstrip('/')}/{path} HTTP/1.1\r\nHost: {parts.netloc}\r\n\r\n".encode())
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            headers = {}
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get(b'content-length', 0))
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            status = int(head.split(b' ', 2)[1])
+            statuses[status] = statuses.get(status, 0) + 1
+            # Sync gunicorn workers don't keep connections alive
+            if headers.get(b'connection', b'').lower() == b'close':
+                writer.close()
+                reader, writer = await _connect(parts)
+    finally:
+        writer.close()
+
+
+async def _run(target, paths, requests, concurrency):
+    counter, latencies, statuses = [requests], [], {}
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(_worker(target, paths, counter, latencies, statuses) for _ in range(concurrency)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for result in results if isinstance(result, Exception))
+    return elapsed, sorted(latencies), statuses, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the redirect endpoint of running servers side by side, e.g. the "
+        "sync WSGI deployment against the ASGI one with ASYNC_REDIRECTS=True."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help="Base URLs, e.g. http://127.0.0.1:8000 http://127.0.0.1:8001")
+        parser.add_argument('--requests', type=int, default=10000, help="Requests per target.")
+        parser.add_argument('--concurrency', type=int, default=100, help="Open keep-alive connections.")
+        parser.add_argument('--codes', type=int, default=1000, help="Short codes sampled from the database.")
+        parser.add_argument('--missing-ratio', type=float, default=0.0, help="Share of requests for unknown codes.")
+
+    def handle(self, *args, **options):
+        codes = list(Link.objects.values_list('short_code', flat=True)[:options['codes']])
+        if not codes:
+            raise CommandError("No links to request; create some first.")
+        missing = max(1, int(len(codes) * options['missing_ratio'])) if options['missing_ratio'] else 0
+        paths = codes + [f"missing-{i}" for i in range(missing)]
+
+        self.stdout.write(f"{options['requests']} requests per target, {options['concurrency']} connections")
+        self.stdout.write(f"{'target':<32} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        for target in options['targets']:
+            elapsed, latencies, statuses, errors = asyncio.run(
+                _run(target, paths, options['requests'], options['concurrency'])
+            )
+            if not latencies:
+                self.stderr.write(f"{target}: no successful requests ({errors} connection errors)")
+                continue
+            ms = [latency * 1000 for latency in latencies]
+            status_summary = ' '.join(f"{status}:{count}" for status, count in sorted(statuses.items()))
+            if errors:
+                status_summary += f" errors:{errors}"
+            self.stdout.write(
+                f"{target:<32} {len(ms) / elapsed:>9.0f} {statistics.median(ms):>8.2f} "
+                f"{_percentile(ms, 95):>8.2f} {_percentile(ms, 99):>8.2f}  {status_summary}"
+            )
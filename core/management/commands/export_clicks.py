@@ -0,0 +1,55 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import archived_rows
+from core.exports import EXPORT_FORMATS, export_clicks, export_queryset
+from core.models import Link, User
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Streams the raw clicks of a link or of a whole account as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--user', help="Username or email; exports the clicks of all their links.")
+        target.add_argument('--link', help="Short code of a single link.")
+        parser.add_argument('--start', type=_date, help="First day included (YYYY-MM-DD).")
+        parser.add_argument('--end', type=_date, help="Last day included (YYYY-MM-DD).")
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output.")
+        parser.add_argument('--output', help="File to write to; stdout by default.")
+
+    def handle(self, *args, **options):
+        if options['link']:
+            link = Link.objects.get_by_code(options['link'])
+            if link is None:
+                raise CommandError(f"No link {options['link']!r}")
+            filters = {'link': link}
+        else:
+            user = User.objects.filter(username=options['user']).first() or User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user {options['user']!r}")
+            filters = {'owner': user}
+        filters.update(start=options['start'], end=options['end'])
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            chunks = export_clicks(
+                export_queryset(**filters), options['format'], options['gzip'], archived=archived_rows(**filters),
+            )
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
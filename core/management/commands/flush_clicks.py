@@ -0,0 +1,54 @@
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.clicks import ClickBuffer, queue_depth
+
+
+class Command(BaseCommand):
+    help = "Drains buffered clicks from Redis into the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.CLICK_BATCH_SIZE)
+        parser.add_argument(
+            '--interval', type=float, default=settings.CLICK_FLUSH_INTERVAL,
+            help="Seconds to sleep when the buffer is empty.",
+        )
+        parser.add_argument(
+            '--consumer', default=socket.gethostname(),
+            help="Name of this flusher; its in-flight batch is replayed after a crash.",
+        )
+        parser.add_argument('--once', action='store_true', help="Drain the buffer once and exit.")
+        parser.add_argument('--stats', action='store_true', help="Print the queue depth and exit.")
+        parser.add_argument(
+            '--at-most-once', action='store_true',
+            help="Pop batches without a processing list (faster, a crash loses the batch).",
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(f"Queue depth: {queue_depth()}")
+            return
+
+        buffer = ClickBuffer(
+            batch_size=options['batch_size'],
+            at_least_once=False if options['at_most_once'] else None,
+            consumer=options['consumer'],
+        )
+        if buffer.at_least_once:
+            restored = buffer.recover()
+            if restored:
+                self.stdout.write(f"Replaying {restored} clicks from an interrupted batch")
+
+        while True:
+            taken, saved = buffer.flush()
+            if taken:
+                self.stdout.write(f"Flushed {saved} clicks ({taken - saved} for deleted links)")
+                # A full batch means there is probably more waiting
+                if taken == buffer.batch_size:
+                    continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.access_logs import ingest_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Counts clicks on links with a cacheable redirect policy from CDN or reverse-proxy "
+        "access logs in the combined format, picking up where the previous run stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Access log files; .gz files are read compressed.")
+        parser.add_argument('--batch-size', type=int, default=settings.CLICK_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep running every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        while True:
+            for path in options['paths']:
+                lines, saved = ingest_log(path, batch_size=options['batch_size'])
+                self.stdout.write(f"{path}: read {lines} lines, saved {saved} clicks")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Link, User
+from core.qr import prerender_qr, QR_FORMATS, QR_SIZES, DEFAULT_QR_SIZE
+
+
+class Command(BaseCommand):
+    help = "Renders and caches QR codes for a user's links ahead of time, e.g. before a print campaign."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="Username or email of the link owner.")
+        parser.add_argument('--base-url', required=True, help="Public origin of the short links, e.g. https://nexl.ink")
+        parser.add_argument('--size', type=int, action='append', dest='sizes', help="Pixels per module; repeatable.")
+        parser.add_argument('--format', choices=sorted(QR_FORMATS), action='append', dest='formats', help="Repeatable.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first() or User.objects.filter(email=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user {options['user']!r}")
+        sizes = options['sizes'] or [DEFAULT_QR_SIZE]
+        formats = options['formats'] or ['png']
+        invalid = [size for size in sizes if size not in QR_SIZES]
+        if invalid:
+            raise CommandError(f"Unsupported sizes: {invalid}")
+
+        base_url = options['base_url'].rstrip('/') + '/'
+        codes = Link.objects.filter(owner=user).values_list('short_code', flat=True).iterator(chunk_size=options['batch_size'])
+        drawn = total = 0
+        batch = []
+        for code in codes:
+            batch.append(base_url + code)
+            if len(batch) >= options['batch_size']:
+                drawn += prerender_qr(batch, sizes, formats)
+                total += len(batch)
+                batch = []
+        if batch:
+            drawn += prerender_qr(batch, sizes, formats)
+            total += len(batch)
+        self.stdout.write(f"Rendered {drawn} QR images for {total} links; the rest were already cached")
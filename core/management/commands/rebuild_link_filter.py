@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.cache import link_filter, link_filter_stats, redis_client, register_link_code
+from core.models import Link
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the Redis membership filter over all short codes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help="Print filter statistics and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(link_filter_stats(), indent=2))
+            return
+
+        started = timezone.now()
+        codes = (
+            Link.objects.exclude(short_code__isnull=True)
+            .values_list('short_code', flat=True)
+            .iterator(chunk_size=5000)
+        )
+        count = link_filter.rebuild(redis_client(), codes)
+
+        # Links created while we were scanning only reached the old filter
+        for code in Link.objects.filter(created_at__gte=started).values_list('short_code', flat=True):
+            if code:
+                register_link_code(code)
+
+        if count > link_filter.capacity:
+            self.stdout.write(self.style.WARNING(
+                f"{count} codes exceed LINK_FILTER_CAPACITY={link_filter.capacity}; "
+                "the false positive rate will be above target"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Filter rebuilt with {count} codes ({link_filter.size} bits, {link_filter.hashes} hashes)"
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.leaderboards import trim_leaderboards
+from core.rollups import roll_up_clicks
+from core.visitors import persist_sketches
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds new clicks into the hourly and daily rollup tables used by the analysis page, "
+        "copies changed unique-visitor sketches from Redis to the database and trims the top-link leaderboards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100000, help="Click ids aggregated per query.")
+        parser.add_argument('--loop', action='store_true', help="Keep running every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        # Each run rolls up to the newest click seen by the previous run, so one-off
+        # invocations (cron) lag one run behind; the analysis page reads that tail live.
+        while True:
+            total = roll_up_clicks(chunk_size=options['chunk_size'])
+            self.stdout.write(f"Rolled up {total} clicks")
+            self.stdout.write(f"Saved {persist_sketches()} visitor sketches")
+            self.stdout.write(f"Trimmed {trim_leaderboards()} leaderboard entries")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.cache import cache_links
+from core.models import Link
+from core.rollups import top_link_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads the redirect cache entries of the most clicked links into Redis, "
+        "e.g. after a Redis flush or failover, so they don't all miss at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10000, help="Number of links to cache.")
+        parser.add_argument(
+            '--days', type=int,
+            help="Rank by rolled-up clicks over the last N days instead of all-time clicks_count.",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Entries written per pipeline.")
+
+    def _batches(self, options):
+        links = Link.objects.exclude(short_code__isnull=True).only(
+            'id', 'short_code', 'original_url', 'redirect_policy', 'cache_max_age',
+        )
+        size = options['batch_size']
+        if options['days']:
+            since = timezone.now().date() - timedelta(days=options['days'] - 1)
+            ids = top_link_ids(since, options['top'])
+            for start in range(0, len(ids), size):
+                yield list(links.filter(id__in=ids[start:start + size]))
+            return
+
+        batch = []
+        for link in links.order_by('-clicks_count', '-id')[:options['top']].iterator(chunk_size=size):
+            batch.append(link)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def handle(self, *args, **options):
+        total = 0
+        for batch in self._batches(options):
+            cache_links(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Cached {total} redirect entries"))
@@ -0,0 +1,265 @@
+"""
+Per-view request metrics in Prometheus text format: latency histograms, SQL
+query count and time, and hits/misses on the url_{short_code} redirect cache.
+
+Each worker accumulates samples in memory and adds them to a Redis hash every
+METRICS_FLUSH_INTERVAL seconds, so the metrics endpoint reports all workers
+whichever one serves the scrape.
+"""
+import contextvars
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .breaker import redis_breaker
+
+# Redis hash holding every series, summed over all workers
+METRICS_KEY = 'metrics:series'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help)
+FAMILIES = {
+    'nextlink_request_duration_seconds': ('histogram', 'Request latency by URL name.'),
+    'nextlink_db_queries_total': ('counter', 'SQL queries run by requests, by URL name.'),
+    'nextlink_db_query_seconds_total': ('counter', 'Time spent in SQL queries, by URL name.'),
+    'nextlink_link_cache_lookups_total': (
+        'counter', 'Redirect cache lookups by URL name and result (local_hit, redis_hit, miss).',
+    ),
+    'nextlink_redis_breaker_transitions_total': (
+        'counter', 'Redis circuit breaker state changes by new state (opened, closed), over all workers.',
+    ),
+    'nextlink_redis_fallbacks_total': (
+        'counter', 'Redis calls that failed or were skipped by the open circuit breaker.',
+    ),
+}
+# Requests not resolved to a URL pattern (404s from the resolver, middleware responses)
+UNRESOLVED = 'unresolved'
+
+# Samples of the request being measured; None when it isn't sampled
+_current = contextvars.ContextVar('nextlink_metrics', default=None)
+
+_pending = defaultdict(float)
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+class RequestSample:
+    __slots__ = ('queries', 'query_seconds', 'cache_lookups')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_lookups = defaultdict(int)
+
+
+def _series(name, **labels):
+    rendered = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return f'{name}{{{rendered}}}'
+
+
+def _sampled():
+    rate = settings.METRICS_SAMPLE_RATE
+    return settings.METRICS_ENABLED and (rate >= 1 or random.random() < rate)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name or match.view_name if match else UNRESOLVED
+
+
+def record_cache_lookup(result):
+    """Counts a redirect cache lookup ('local_hit', 'redis_hit' or 'miss') against the current request."""
+    sample = _current.get()
+    if sample is not None:
+        sample.cache_lookups[result] += 1
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper installed on every connection (see CoreConfig.ready).
+    The context variable follows the request into sync_to_async threads, so
+    queries of async views are counted too.
+    """
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.query_seconds += time.perf_counter() - started
+        sample.queries += 1
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def _observe(view, duration, sample):
+    bucket = bisect_left(LATENCY_BUCKETS, duration)
+    with _pending_lock:
+        # Buckets are cumulative: the observation counts towards every bound above it
+        for bound in LATENCY_BUCKETS[bucket:]:
+            _pending[_series('nextlink_request_duration_seconds_bucket', view=view, le=bound)] += 1
+        _pending[_series('nextlink_request_duration_seconds_bucket', view=view, le='+Inf')] += 1
+        _pending[_series('nextlink_request_duration_seconds_count', view=view)] += 1
+        _pending[_series('nextlink_request_duration_seconds_sum', view=view)] += duration
+        _pending[_series('nextlink_db_queries_total', view=view)] += sample.queries
+        _pending[_series('nextlink_db_query_seconds_total', view=view)] += sample.query_seconds
+        for result, count in sample.cache_lookups.items():
+            _pending[_series('nextlink_link_cache_lookups_total', view=view, result=result)] += count
+
+
+def _flush_due():
+    return time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+
+@redis_breaker.guard(default=False)
+def _write(pending):
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for series, value in pending.items():
+        pipe.hincrbyfloat(METRICS_KEY, series, value)
+    pipe.execute()
+    return True
+
+
+def flush():
+    """Adds this worker's samples since the last flush to the shared Redis hash."""
+    global _last_flush
+    breaker = redis_breaker.drain_counts()
+    with _pending_lock:
+        _last_flush = time.monotonic()
+        for state in ('opened', 'closed'):
+            if breaker[state]:
+                _pending[_series('nextlink_redis_breaker_transitions_total', state=state)] += breaker[state]
+        if breaker['fallbacks']:
+            _pending['nextlink_redis_fallbacks_total'] += breaker['fallbacks']
+        pending = dict(_pending)
+        _pending.clear()
+    if pending and not _write(pending):
+        # Counters are sums, so samples kept through an outage are added once Redis is back
+        with _pending_lock:
+            for series, value in pending.items():
+                _pending[series] += value
+
+
+async def aflush():
+    await sync_to_async(flush)()
+
+
+def _family(series):
+    name = series.split('{', 1)[0]
+    for suffix in ('_bucket', '_count', '_sum'):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def _sort_key(series):
+    # Buckets in ascending order of their bound, after the other series of the view
+    le = re.search(r'le="([^"]+)"', series)
+    return re.sub(r',?le="[^"]+"', '', series), float(le.group(1)) if le else float('inf')
+
+
+def _format(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render():
+    """All series in the Prometheus text exposition format."""
+    flush()
+    stored = get_redis_connection('default').hgetall(METRICS_KEY)
+    by_family = defaultdict(list)
+    for series, value in stored.items():
+        series = series.decode()
+        by_family[_family(series)].append((series, float(value)))
+
+    lines = [
+        '# HELP nextlink_metrics_sample_rate Share of requests measured by this deployment.',
+        '# TYPE nextlink_metrics_sample_rate gauge',
+        f'nextlink_metrics_sample_rate {_format(settings.METRICS_SAMPLE_RATE)}',
+    ]
+    for name, (kind, help_text) in FAMILIES.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for series, value in sorted(by_family[name], key=lambda item: _sort_key(item[0])):
+            lines.append(f'{series} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Drops all stored and pending samples."""
+    with _pending_lock:
+        _pending.clear()
+    get_redis_connection('default').delete(METRICS_KEY)
+
+
+def begin():
+    """
+    Starts measuring a request if it is sampled. Returns the state to pass
+    to finish(), or None for unsampled requests.
+    """
+    if not _sampled():
+        return None
+    sample = RequestSample()
+    return sample, _current.set(sample), time.perf_counter()
+
+
+def finish(state, view):
+    """Records a request started with begin() under the URL name view. True when a flush is due."""
+    sample, token, started = state
+    _observe(view, time.perf_counter() - started, sample)
+    _current.reset(token)
+    return _flush_due()
+
+
+def discard(state):
+    """Stops measuring a request without recording it (handed on to another layer)."""
+    _current.reset(state[1])
+
+
+class MetricsMiddleware:
+    """
+    Measures a sampled share (METRICS_SAMPLE_RATE) of requests. Unsampled
+    requests cost one random() call; sampled ones a few dict updates, plus a
+    Redis pipeline every METRICS_FLUSH_INTERVAL seconds per worker.
+    Goes first in MIDDLEWARE so the latency covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = begin()
+        if state is None:
+            return self.get_response(request)
+        try:
+            return self.get_response(request)
+        finally:
+            if finish(state, _view_name(request)):
+                flush()
+
+    async def __acall__(self, request):
+        state = begin()
+        if state is None:
+            return await self.get_response(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            if finish(state, _view_name(request)):
+                await aflush()
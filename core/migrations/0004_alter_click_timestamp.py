@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-16 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_link_short_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='click',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
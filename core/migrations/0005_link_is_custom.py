@@ -0,0 +1,52 @@
+# Generated by Django 6.0.1 on 2026-10-16 10:05
+
+import string
+
+from django.db import migrations, models
+
+# Base62 as of this migration, copied so later changes to core.utils don't alter it
+BASE62_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+
+
+def encode(num):
+    if num == 0:
+        return BASE62_ALPHABET[0]
+    digits = []
+    while num:
+        num, rem = divmod(num, len(BASE62_ALPHABET))
+        digits.append(BASE62_ALPHABET[rem])
+    return ''.join(reversed(digits))
+
+
+def mark_custom_links(apps, schema_editor):
+    """Links whose code isn't the encoding of their id were given a custom alias."""
+    Link = apps.get_model('core', 'Link')
+    custom_ids = []
+    for link_id, short_code in Link.objects.values_list('id', 'short_code').iterator(chunk_size=5000):
+        if short_code and short_code != encode(link_id):
+            custom_ids.append(link_id)
+        if len(custom_ids) >= 1000:
+            Link.objects.filter(id__in=custom_ids).update(is_custom=True)
+            custom_ids = []
+    if custom_ids:
+        Link.objects.filter(id__in=custom_ids).update(is_custom=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_click_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='is_custom',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_custom_links, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(condition=models.Q(('is_custom', True)), fields=['short_code'], name='core_link_alias_idx'),
+        ),
+    ]
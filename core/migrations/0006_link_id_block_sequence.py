@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-16 11:20
+
+from django.db import migrations
+from django.db.models import Max
+
+# Matches core.ids; the sequence's INCREMENT BY is the allocator block size.
+# Change it later with: ALTER SEQUENCE core_link_id_block INCREMENT BY <n>;
+BLOCK_SEQUENCE = 'core_link_id_block'
+BLOCK_SIZE = 100
+ID_HEADROOM = 10000
+
+
+def create_block_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Link = apps.get_model('core', 'Link')
+    start = (Link.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + ID_HEADROOM
+    schema_editor.execute(
+        f"CREATE SEQUENCE IF NOT EXISTS {BLOCK_SEQUENCE} INCREMENT BY {BLOCK_SIZE} START WITH {start}"
+    )
+
+
+def drop_block_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP SEQUENCE IF EXISTS {BLOCK_SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_link_is_custom'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_block_sequence, drop_block_sequence),
+    ]
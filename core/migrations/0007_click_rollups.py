@@ -0,0 +1,62 @@
+# Generated by Django 6.0.1 on 2026-10-16 12:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_link_id_block_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyClickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyClickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_click_id', models.BigIntegerField(default=0)),
+                ('pending_click_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='click',
+            index=models.Index(fields=['link', 'id'], name='core_click_link_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailyclickcount',
+            name='link',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='core.link'),
+        ),
+        migrations.AddField(
+            model_name='hourlyclickcount',
+            name='link',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_counts', to='core.link'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyclickcount',
+            constraint=models.UniqueConstraint(fields=('link', 'day'), name='core_dailyclickcount_link_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyclickcount',
+            constraint=models.UniqueConstraint(fields=('link', 'hour'), name='core_hourlyclickcount_link_hour'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-16 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_click_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='core_link_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['owner', '-clicks_count', '-id'], name='core_link_owner_clicks_idx'),
+        ),
+    ]
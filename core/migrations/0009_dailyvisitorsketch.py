@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-16 22:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_link_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sketch', models.BinaryField()),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='core.link')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('link', 'day'), name='core_dailyvisitorsketch_link_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,164 @@
+# Generated by Django 6.0.1 on 2026-10-16 23:20
+
+import hashlib
+import re
+from urllib.parse import urlsplit
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Parsing as of this migration, copied so later changes to core.dimensions don't alter it
+BOT_RE = re.compile(r'bot|crawl|spider|slurp|curl|wget|python-requests|httpclient|headless|preview', re.I)
+BROWSERS = (
+    ('Edge', re.compile(r'edg(e|a|ios)?/', re.I)),
+    ('Opera', re.compile(r'opr/|opera', re.I)),
+    ('Samsung Internet', re.compile(r'samsungbrowser', re.I)),
+    ('Firefox', re.compile(r'firefox|fxios', re.I)),
+    ('Chrome', re.compile(r'chrome|crios', re.I)),
+    ('Safari', re.compile(r'safari', re.I)),
+)
+OPERATING_SYSTEMS = (
+    ('Windows', re.compile(r'windows', re.I)),
+    ('iOS', re.compile(r'iphone|ipad|ipod', re.I)),
+    ('macOS', re.compile(r'mac os x|macintosh', re.I)),
+    ('Android', re.compile(r'android', re.I)),
+    ('ChromeOS', re.compile(r'cros', re.I)),
+    ('Linux', re.compile(r'linux', re.I)),
+)
+
+
+def _first_match(patterns, value):
+    return next((name for name, pattern in patterns if pattern.search(value)), 'Other')
+
+
+def parse_user_agent(value):
+    lower = value.lower()
+    if BOT_RE.search(value):
+        device = 'bot'
+    elif 'ipad' in lower or 'tablet' in lower or ('android' in lower and 'mobile' not in lower):
+        device = 'tablet'
+    elif 'mobi' in lower or 'iphone' in lower:
+        device = 'mobile'
+    else:
+        device = 'desktop'
+    return {'browser': _first_match(BROWSERS, value), 'os': _first_match(OPERATING_SYSTEMS, value), 'device': device}
+
+
+def parse_referer(value):
+    try:
+        host = urlsplit(value).hostname or ''
+    except ValueError:
+        host = ''
+    return {'domain': host.removeprefix('www.')[:255]}
+
+
+def intern(model, parse, values):
+    """{value: id} for values, creating the rows that don't exist yet."""
+    by_digest = {hashlib.blake2b(value.encode(), digest_size=16).hexdigest(): value for value in set(values)}
+    if not by_digest:
+        return {}
+    model.objects.bulk_create(
+        [model(digest=key, value=value, **parse(value)) for key, value in by_digest.items()],
+        ignore_conflicts=True,
+    )
+    return {
+        by_digest[key]: pk
+        for key, pk in model.objects.filter(digest__in=list(by_digest)).values_list('digest', 'id')
+    }
+
+
+def intern_click_dimensions(apps, schema_editor):
+    """Points every click at the UserAgent and Referer rows for its strings, a batch at a time."""
+    Click = apps.get_model('core', 'Click')
+    UserAgent = apps.get_model('core', 'UserAgent')
+    Referer = apps.get_model('core', 'Referer')
+
+    def save(batch):
+        user_agents = intern(UserAgent, parse_user_agent, (user_agent for _, user_agent, _ in batch if user_agent))
+        referers = intern(Referer, parse_referer, (referer for _, _, referer in batch if referer))
+        Click.objects.bulk_update(
+            [
+                Click(id=pk, user_agent_dim_id=user_agents.get(user_agent), referer_dim_id=referers.get(referer))
+                for pk, user_agent, referer in batch
+            ],
+            ['user_agent_dim', 'referer_dim'],
+        )
+
+    batch = []
+    clicks = Click.objects.exclude(user_agent__isnull=True, referer__isnull=True).order_by()
+    for row in clicks.values_list('id', 'user_agent', 'referer').iterator(chunk_size=5000):
+        batch.append(row)
+        if len(batch) >= 1000:
+            save(batch)
+            batch = []
+    if batch:
+        save(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_dailyvisitorsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('value', models.TextField()),
+                ('browser', models.CharField(max_length=50)),
+                ('os', models.CharField(max_length=50)),
+                ('device', models.CharField(max_length=20)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Referer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('value', models.TextField()),
+                ('domain', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='user_agent_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.useragent'),
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='referer_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.referer'),
+        ),
+        migrations.RunPython(intern_click_dimensions, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='click',
+            name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='click',
+            name='referer',
+        ),
+        migrations.RenameField(
+            model_name='click',
+            old_name='user_agent_dim',
+            new_name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='click',
+            old_name='referer_dim',
+            new_name='referer',
+        ),
+        migrations.AlterField(
+            model_name='click',
+            name='user_agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='core.useragent'),
+        ),
+        migrations.AlterField(
+            model_name='click',
+            name='referer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='core.referer'),
+        ),
+    ]
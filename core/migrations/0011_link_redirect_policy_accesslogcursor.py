@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_click_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='redirect_policy',
+            field=models.CharField(choices=[('uncached', 'Not cacheable'), ('temporary', 'Cacheable temporary redirect (302)'), ('permanent', 'Cacheable permanent redirect (301)')], default='uncached', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(default=3600, help_text='Seconds a cacheable redirect may be reused.'),
+        ),
+        migrations.CreateModel(
+            name='AccessLogCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1000, unique=True)),
+                ('inode', models.BigIntegerField(default=0)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
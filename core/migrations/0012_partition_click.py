@@ -0,0 +1,93 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:30
+
+from datetime import date, datetime, time, timezone
+
+from django.db import migrations
+
+
+def month_bounds(month):
+    """The UTC datetimes a month's partition covers, end excluded."""
+    following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return (
+        datetime.combine(month, time.min, tzinfo=timezone.utc),
+        datetime.combine(following, time.min, tzinfo=timezone.utc),
+    )
+
+
+def partition_clicks(apps, schema_editor):
+    """
+    Turns core_click into a table range-partitioned by month on PostgreSQL.
+    The existing table is attached as core_click_legacy, covering everything
+    up to the end of this month, so no rows are copied; months from the next
+    one on get their own partitions. SQLite keeps its plain table.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    now = datetime.now(timezone.utc)
+    _, legacy_end = month_bounds(date(now.year, now.month, 1))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'core_click'")
+        indexes = [name for name, in cursor.fetchall()]
+        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM core_click")
+        next_id = cursor.fetchone()[0]
+
+    schema_editor.execute("ALTER TABLE core_click RENAME TO core_click_legacy")
+    # Index names are schema-wide; the partitioned table takes over the originals
+    for name in indexes:
+        schema_editor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+    # A partition can't bring its own identity column, ids now come from a plain sequence
+    schema_editor.execute("ALTER TABLE core_click_legacy ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    schema_editor.execute("ALTER TABLE core_click_legacy ALTER COLUMN id DROP DEFAULT")
+    schema_editor.execute("CREATE SEQUENCE IF NOT EXISTS core_click_id_seq")
+    schema_editor.execute(f"SELECT setval('core_click_id_seq', {next_id}, false)")
+
+    schema_editor.execute('CREATE TABLE core_click (LIKE core_click_legacy) PARTITION BY RANGE ("timestamp")')
+    schema_editor.execute("ALTER TABLE core_click ALTER COLUMN id SET DEFAULT nextval('core_click_id_seq')")
+    schema_editor.execute("ALTER SEQUENCE core_click_id_seq OWNED BY core_click.id")
+    # The partition key has to be part of the primary key
+    schema_editor.execute('ALTER TABLE core_click ADD CONSTRAINT core_click_pkey PRIMARY KEY (id, "timestamp")')
+    # Also serves the link foreign key
+    schema_editor.execute("CREATE INDEX core_click_link_id_idx ON core_click (link_id, id)")
+    # A few pages per month of clicks; finds a month's rows in the legacy and default partitions
+    schema_editor.execute('CREATE INDEX core_click_timestamp_brin ON core_click USING brin ("timestamp")')
+    for column, table in (('link_id', 'core_link'), ('user_agent_id', 'core_useragent'), ('referer_id', 'core_referer')):
+        schema_editor.execute(
+            f"ALTER TABLE core_click ADD CONSTRAINT core_click_{column}_fk FOREIGN KEY ({column}) "
+            f"REFERENCES {table} (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+
+    # A validated CHECK matching the bounds lets ATTACH PARTITION skip its own scan of
+    # the legacy rows; once attached, the partition constraint makes it redundant
+    schema_editor.execute(
+        f"ALTER TABLE core_click_legacy ADD CONSTRAINT core_click_legacy_bounds "
+        f"CHECK (\"timestamp\" IS NOT NULL AND \"timestamp\" < '{legacy_end.isoformat()}') NOT VALID"
+    )
+    schema_editor.execute("ALTER TABLE core_click_legacy VALIDATE CONSTRAINT core_click_legacy_bounds")
+    schema_editor.execute(
+        f"ALTER TABLE core_click ATTACH PARTITION core_click_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_end.isoformat()}')"
+    )
+    schema_editor.execute("ALTER TABLE core_click_legacy DROP CONSTRAINT core_click_legacy_bounds")
+    schema_editor.execute("CREATE TABLE core_click_default PARTITION OF core_click DEFAULT")
+    # The next two months; `manage.py archive_clicks` keeps creating them from here
+    start = legacy_end
+    for _ in range(2):
+        start, end = month_bounds(start.date())
+        schema_editor.execute(
+            f"CREATE TABLE core_click_{start:%Y%m} PARTITION OF core_click "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        start = end
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_link_redirect_policy_accesslogcursor'),
+    ]
+
+    operations = [
+        # Deliberately one-way: the partitioned table serves the models of 0011 as it
+        # is, and folding the partitions back into one table would copy every click
+        migrations.RunPython(partition_clicks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 6.0.1 on 2026-10-17 18:10
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations, models
+
+# Canonicalization as of this migration, copied so later changes to core.utils don't alter it
+TRACKING_PARAM_PREFIXES = ('utm_',)
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonical_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    userinfo = parts.netloc.rpartition('@')[0]
+    netloc = f'{userinfo}@{host}' if userinfo else host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith(TRACKING_PARAM_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), parts.fragment))
+
+
+def url_hash(url):
+    return hashlib.blake2b(canonical_url(url).encode(), digest_size=16).hexdigest()
+
+
+def hash_link_urls(apps, schema_editor):
+    """Fills url_hash for the existing links, a batch at a time."""
+    Link = apps.get_model('core', 'Link')
+
+    batch = []
+    for pk, url in Link.objects.order_by('id').values_list('id', 'original_url').iterator(chunk_size=5000):
+        batch.append(Link(id=pk, url_hash=url_hash(url)))
+        if len(batch) >= 1000:
+            Link.objects.bulk_update(batch, ['url_hash'])
+            batch = []
+    if batch:
+        Link.objects.bulk_update(batch, ['url_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_partition_click'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='url_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(hash_link_urls, migrations.RunPython.noop),
+        # Built once the hashes are in, rather than maintained through the backfill
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['owner', 'url_hash'], name='core_link_owner_url_idx'),
+        ),
+    ]
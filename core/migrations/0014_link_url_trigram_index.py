@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-17 21:05
+
+import logging
+
+from django.db import DatabaseError, migrations
+
+logger = logging.getLogger(__name__)
+
+
+def create_url_trigram_index(apps, schema_editor):
+    """
+    Indexes original_url for the admin's substring search on PostgreSQL.
+    The index is on UPPER(original_url), the expression icontains filters
+    on, and built concurrently so shortening keeps working meanwhile. Without
+    the pg_trgm extension (and the rights to create it) search still works,
+    by scanning.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        logger.warning("pg_trgm is not available; admin URL search will scan core_link", exc_info=True)
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS core_link_url_trgm_idx "
+        "ON core_link USING gin (UPPER(original_url) gin_trgm_ops)"
+    )
+
+
+def drop_url_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS core_link_url_trgm_idx")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_link_url_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_url_trigram_index, drop_url_trigram_index),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:20
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+
+
+def roll_up_breakdowns(apps, schema_editor):
+    """
+    Counts the clicks rollup_clicks already covered into the new table, by
+    id range. Later clicks are added by rollup_clicks as they're rolled up.
+    """
+    Click = apps.get_model('core', 'Click')
+    DailyBreakdownCount = apps.get_model('core', 'DailyBreakdownCount')
+    Referer = apps.get_model('core', 'Referer')
+    RollupState = apps.get_model('core', 'RollupState')
+    UserAgent = apps.get_model('core', 'UserAgent')
+
+    state = RollupState.objects.filter(name='click_counts').first()
+    upper = state.last_click_id if state else 0
+    low = Click.objects.filter(id__lte=upper).order_by('id').values_list('id', flat=True).first()
+    if low is None:
+        return
+    low -= 1
+    agents = {pk: (browser, os, device) for pk, browser, os, device in UserAgent.objects.values_list('id', 'browser', 'os', 'device')}
+    domains = dict(Referer.objects.values_list('id', 'domain'))
+
+    while low < upper:
+        high = min(low + 100000, upper)
+        clicks = Click.objects.filter(id__gt=low, id__lte=high).annotate(day=TruncDay('timestamp')).order_by()
+        counts = Counter()
+        for link_id, day, pk, n in clicks.values_list('link_id', 'day', 'user_agent_id').annotate(n=Count('id')):
+            browser, os, device = agents.get(pk, ('Unknown', 'Unknown', 'Unknown'))
+            for dimension, value in (('browser', browser), ('os', os), ('device', device)):
+                counts[(link_id, day.date(), dimension, value)] += n
+        for link_id, day, pk, n in clicks.values_list('link_id', 'day', 'referer_id').annotate(n=Count('id')):
+            counts[(link_id, day.date(), 'referer', domains.get(pk) or 'Direct')] += n
+
+        # A day's clicks can span two id ranges
+        existing = {
+            (row.link_id, row.day, row.dimension, row.value): row
+            for row in DailyBreakdownCount.objects.filter(
+                link_id__in={key[0] for key in counts}, day__in={key[1] for key in counts},
+            )
+        }
+        to_update, to_create = [], []
+        for (link_id, day, dimension, value), n in counts.items():
+            row = existing.get((link_id, day, dimension, value))
+            if row is not None:
+                row.count += n
+                to_update.append(row)
+            else:
+                to_create.append(DailyBreakdownCount(link_id=link_id, day=day, dimension=dimension, value=value, count=n))
+        DailyBreakdownCount.objects.bulk_update(to_update, ['count'], batch_size=1000)
+        DailyBreakdownCount.objects.bulk_create(to_create, batch_size=1000)
+        low = high
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_link_url_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBreakdownCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('browser', 'Browser'), ('os', 'Operating system'), ('device', 'Device'), ('referer', 'Referer domain')], max_length=10)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='breakdown_counts', to='core.link')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('link', 'day', 'dimension', 'value'), name='core_dailybreakdowncount_link_day_value')],
+            },
+        ),
+        migrations.RunPython(roll_up_breakdowns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_current_policies(apps, schema_editor):
+    """Links already cacheable are taken to have been since their creation, the best time known."""
+    Link = apps.get_model('core', 'Link')
+    RedirectPolicyChange = apps.get_model('core', 'RedirectPolicyChange')
+
+    cacheable = Link.objects.exclude(redirect_policy='uncached').values_list('id', 'redirect_policy', 'created_at')
+    batch = []
+    for link_id, policy, created_at in cacheable.iterator(chunk_size=5000):
+        batch.append(RedirectPolicyChange(link_id=link_id, policy=policy, changed_at=created_at))
+        if len(batch) >= 1000:
+            RedirectPolicyChange.objects.bulk_create(batch)
+            batch = []
+    RedirectPolicyChange.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_dailybreakdowncount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RedirectPolicyChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy', models.CharField(choices=[('uncached', 'Not cacheable'), ('temporary', 'Cacheable temporary redirect (302)'), ('permanent', 'Cacheable permanent redirect (301)')], max_length=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='policy_changes', to='core.link')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['link', 'changed_at'], name='core_policychange_link_idx')],
+            },
+        ),
+        migrations.RunPython(record_current_policies, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
-from .utils import encode
+from django.utils import timezone
+from .ids import allocate_link_ids, get_allocator
+from .utils import encode, decode, is_generated_code, url_hash
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -13,9 +15,73 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+class LinkQuerySet(models.QuerySet):
+    def get_by_code(self, short_code):
+        """
+        Resolves a short code, or returns None. Generated codes are the Base62
+        id, so they decode straight to a primary-key fetch; custom aliases are
+        looked up through the partial alias index.
+        """
+        if is_generated_code(short_code):
+            try:
+                link = self.get(pk=decode(short_code), is_custom=False)
+            except self.model.DoesNotExist:
+                pass
+            else:
+                if link.short_code == short_code:
+                    return link
+        try:
+            return self.get(short_code=short_code, is_custom=True)
+        except self.model.DoesNotExist:
+            return None
+
+    async def aget_by_code(self, short_code):
+        if is_generated_code(short_code):
+            try:
+                link = await self.aget(pk=decode(short_code), is_custom=False)
+            except self.model.DoesNotExist:
+                pass
+            else:
+                if link.short_code == short_code:
+                    return link
+        try:
+            return await self.aget(short_code=short_code, is_custom=True)
+        except self.model.DoesNotExist:
+            return None
+
+    def alias_taken(self, alias):
+        """
+        True if alias is in use, or is the generated code of an id that was
+        already reserved by the allocator; those stay with generated links.
+        """
+        if is_generated_code(alias) and decode(alias) <= get_allocator().high_water_mark():
+            return True
+        return self.filter(short_code=alias).exists()
+
+    def duplicate_of(self, url, owner):
+        """
+        owner's oldest link to the same destination as url once canonicalized
+        (see utils.canonical_url), or None; one lookup on the (owner, url_hash)
+        index. Anonymous links share the owner None.
+        """
+        return self.filter(owner=owner, url_hash=url_hash(url)).order_by('id').first()
+
+
 class Link(models.Model):
+    class RedirectPolicy(models.TextChoices):
+        # Every click reaches the app and is recorded as it happens
+        UNCACHED = 'uncached', 'Not cacheable'
+        # Browsers and CDNs may reuse the redirect for cache_max_age seconds;
+        # clicks are counted from access logs (manage.py ingest_access_logs)
+        TEMPORARY = 'temporary', 'Cacheable temporary redirect (302)'
+        PERMANENT = 'permanent', 'Cacheable permanent redirect (301)'
+
     original_url = models.URLField(max_length=2000)
+    # Hex BLAKE2b-128 of the canonical original_url, for finding an owner's duplicates
+    url_hash = models.CharField(max_length=32, default='', editable=False)
     short_code = models.CharField(max_length=15, unique=True, blank=True, null=True, db_index=True)
+    # Chosen by the user rather than derived from the id
+    is_custom = models.BooleanField(default=False)
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -25,31 +91,219 @@ class Link(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     clicks_count = models.PositiveIntegerField(default=0)
+    redirect_policy = models.CharField(max_length=10, choices=RedirectPolicy, default=RedirectPolicy.UNCACHED)
+    cache_max_age = models.PositiveIntegerField(default=3600, help_text="Seconds a cacheable redirect may be reused.")
+
+    objects = LinkQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
+        if self._state.adding and self.id is None:
+            # Take the id from a pre-reserved block so the code goes out with the INSERT
+            self.id = allocate_link_ids()[0]
+            kwargs['force_insert'] = True
         if not self.short_code:
-            # Save first to get an ID for encoding if not provided
-            # Note: This is a simple approach. A more robust one might use a UUID or a pre-defined sequence.
-            super().save(*args, **kwargs)
             self.short_code = encode(self.id)
-            kwargs['force_insert'] = False # Ensure we update the existing record
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'original_url' in update_fields:
+            self.url_hash = url_hash(self.original_url)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'url_hash'}
+        # Any code other than the id's own encoding is an alias
+        self.is_custom = self.short_code != encode(self.id)
         super().save(*args, **kwargs)
+        if update_fields is None or 'redirect_policy' in update_fields:
+            previous = getattr(self, '_loaded_redirect_policy', self.RedirectPolicy.UNCACHED)
+            if self.redirect_policy != previous:
+                RedirectPolicyChange.objects.create(link=self, policy=self.redirect_policy)
+                self._loaded_redirect_policy = self.redirect_policy
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the code the row was loaded with, so edits can invalidate its cache entry
+        instance._loaded_short_code = instance.__dict__.get('short_code')
+        # And the policy, so a change is recorded in the link's policy history
+        instance._loaded_redirect_policy = instance.__dict__.get('redirect_policy')
+        return instance
 
     def __str__(self):
         return f"{self.short_code} -> {self.original_url}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Aliases are a small fraction of links; generated codes resolve by primary key
+            models.Index(fields=['short_code'], condition=models.Q(is_custom=True), name='core_link_alias_idx'),
+            # Keyset pagination of the dashboard, one per sort order
+            models.Index(fields=['owner', '-created_at', '-id'], name='core_link_owner_created_idx'),
+            models.Index(fields=['owner', '-clicks_count', '-id'], name='core_link_owner_clicks_idx'),
+            models.Index(fields=['owner', 'url_hash'], name='core_link_owner_url_idx'),
+        ]
+
+class RedirectPolicyChange(models.Model):
+    """
+    When a link's redirect policy was set, so access log lines are counted by
+    the policy the link had at request time rather than its current one.
+    """
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='policy_changes')
+    policy = models.CharField(max_length=10, choices=Link.RedirectPolicy)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['link', 'changed_at'], name='core_policychange_link_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.link_id} -> {self.policy} at {self.changed_at}"
+
+class UserAgent(models.Model):
+    """A distinct User-Agent header, parsed once; clicks point at it instead of repeating it."""
+    # Hex BLAKE2b-128 of value, what clicks are interned by (see core/dimensions.py)
+    digest = models.CharField(max_length=32, unique=True)
+    value = models.TextField()
+    browser = models.CharField(max_length=50)
+    os = models.CharField(max_length=50)
+    device = models.CharField(max_length=20)
+
+    def __str__(self):
+        return self.value
+
+
+class Referer(models.Model):
+    """A distinct Referer URL with its domain."""
+    digest = models.CharField(max_length=32, unique=True)
+    value = models.TextField()
+    domain = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.value
+
 
 class Click(models.Model):
     link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='clicks')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered clicks are written after the fact with their original time
+    timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    user_agent = models.CharField(max_length=500, null=True, blank=True)
-    referer = models.URLField(max_length=1000, null=True, blank=True)
+    # Small integer keys into deduplicated tables; unindexed, reads always go through the link
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='clicks', db_index=False,
+    )
+    referer = models.ForeignKey(
+        Referer, on_delete=models.PROTECT, null=True, blank=True, related_name='clicks', db_index=False,
+    )
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Per-link reads of the clicks newer than the last rollup
+            models.Index(fields=['link', 'id'], name='core_click_link_id_idx'),
+        ]
 
     def __str__(self):
         return f"Click on {self.link.short_code} at {self.timestamp}"
+
+
+class HourlyClickCount(models.Model):
+    """Clicks per link per hour, maintained incrementally by `manage.py rollup_clicks`."""
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='hourly_counts')
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['link', 'hour'], name='core_hourlyclickcount_link_hour'),
+        ]
+
+    def __str__(self):
+        return f"{self.link_id} @ {self.hour:%Y-%m-%d %H:00}: {self.count}"
+
+
+class DailyClickCount(models.Model):
+    """Clicks per link per (UTC) day, maintained alongside the hourly counts."""
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='daily_counts')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['link', 'day'], name='core_dailyclickcount_link_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.link_id} @ {self.day}: {self.count}"
+
+
+class DailyBreakdownCount(models.Model):
+    """
+    A link's clicks per (UTC) day by browser, OS, device or referer domain,
+    maintained alongside the daily counts from the parsed dimension tables.
+    """
+    class Dimension(models.TextChoices):
+        BROWSER = 'browser', 'Browser'
+        OS = 'os', 'Operating system'
+        DEVICE = 'device', 'Device'
+        REFERER = 'referer', 'Referer domain'
+
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='breakdown_counts')
+    day = models.DateField()
+    dimension = models.CharField(max_length=10, choices=Dimension)
+    value = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['link', 'day', 'dimension', 'value'], name='core_dailybreakdowncount_link_day_value',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.link_id} @ {self.day} {self.dimension}={self.value}: {self.count}"
+
+
+class DailyVisitorSketch(models.Model):
+    """
+    A link's unique visitors for one (UTC) day as a Redis HyperLogLog,
+    copied from Redis by `manage.py rollup_clicks` so ranges older than the
+    Redis keys can still be counted. At most 12 KB, far less for quiet days.
+    """
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='visitor_sketches')
+    day = models.DateField()
+    sketch = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['link', 'day'], name='core_dailyvisitorsketch_link_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.link_id} @ {self.day}: {len(self.sketch)} bytes"
+
+
+class RollupState(models.Model):
+    """
+    Progress of an incremental aggregation job over Click ids.
+    Clicks up to last_click_id are rolled up. pending_click_id was the newest
+    click at the previous run; it becomes the next upper bound, so any
+    transaction still in flight back then has committed before we read it.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_click_id = models.BigIntegerField(default=0)
+    pending_click_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_click_id}"
+
+
+class AccessLogCursor(models.Model):
+    """How far `manage.py ingest_access_logs` has read an access log file."""
+    path = models.CharField(max_length=1000, unique=True)
+    # A different inode means the file was rotated (see access_logs.ingest_log); a shorter one, truncated
+    inode = models.BigIntegerField(default=0)
+    offset = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path}: {self.offset}"
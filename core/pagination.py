@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+
+def encode_cursor(values):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, and the seek has to match exactly
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_page(queryset, ordering, cursor, page_size):
+    """
+    Returns (items, next_cursor) for one page of queryset ordered by
+    `ordering`, a (field, 'id') pair such as ('-created_at', '-id').
+    The cursor holds the last row's values, so each page is a seek on the
+    matching index instead of an OFFSET over everything before it.
+    """
+    field, tiebreak = ordering
+    name = field.lstrip('-')
+    descending = field.startswith('-')
+    queryset = queryset.order_by(field, tiebreak)
+
+    values = decode_cursor(cursor) if cursor else None
+    if values and len(values) == 2:
+        model_field = queryset.model._meta.get_field(name)
+        try:
+            value, last_id = model_field.to_python(values[0]), int(values[1])
+        except (ValueError, TypeError, ValidationError):
+            value = None
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        if value is not None:
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{name}__{op}': value}) | Q(**{name: value, f'id__{op}': last_id})
+            )
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, name), last.id])
+    return items, next_cursor
+
+
+def table_estimate(queryset):
+    """Rows in queryset's table per the planner statistics, summed over its partitions."""
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint "
+            "FROM pg_partition_tree(%s::regclass) t JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf",
+            [queryset.model._meta.db_table],
+        )
+        return cursor.fetchone()[0]
+
+
+def query_estimate(queryset):
+    """Rows queryset would return per the planner, without running it."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin lists of tables too big to COUNT(*). On PostgreSQL an
+    unfiltered list takes its count from the table statistics; a filtered one
+    is counted exactly unless that takes longer than ADMIN_COUNT_TIMEOUT
+    milliseconds, then the planner's estimate stands in. Pages past the
+    real end of an estimate come back empty.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+        if not queryset.query.where:
+            estimate = table_estimate(queryset)
+            # Small tables, or ones never analyzed, are cheap enough to count
+            if estimate >= settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        try:
+            with transaction.atomic(using=queryset.db), connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(settings.ADMIN_COUNT_TIMEOUT)])
+                return queryset.count()
+        except OperationalError:
+            return query_estimate(queryset)
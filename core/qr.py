@@ -0,0 +1,64 @@
+import hashlib
+import io
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.cache import cache
+
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+DEFAULT_QR_SIZE = 10
+# Pixels per QR module
+QR_SIZES = range(2, 41)
+
+
+def qr_digest(full_url, size=DEFAULT_QR_SIZE, fmt='png'):
+    """Identifies a rendered QR image; the same inputs always draw the same image."""
+    return hashlib.sha256(f'{fmt}:{size}:{full_url}'.encode()).hexdigest()[:32]
+
+
+def qr_cache_key(full_url, size=DEFAULT_QR_SIZE, fmt='png'):
+    return f'qr:{qr_digest(full_url, size, fmt)}'
+
+
+def _draw(full_url, size, fmt):
+    qr = qrcode.QRCode(version=1, box_size=size, border=5)
+    qr.add_data(full_url)
+    qr.make(fit=True)
+    if fmt == 'svg':
+        # Pure Python path output, no Pillow rasterizing
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def render_qr(full_url, size=DEFAULT_QR_SIZE, fmt='png'):
+    """
+    Returns the QR image bytes for full_url, drawing it only on a cache miss.
+    Entries expire after QR_CACHE_TIMEOUT and are otherwise left to Redis'
+    eviction policy, so rarely viewed codes fall out on their own.
+    """
+    key = qr_cache_key(full_url, size, fmt)
+    data = cache.get(key)
+    if data is None:
+        data = _draw(full_url, size, fmt)
+        cache.set(key, data, settings.QR_CACHE_TIMEOUT)
+    return data
+
+
+def prerender_qr(full_urls, sizes=(DEFAULT_QR_SIZE,), formats=('png',)):
+    """Draws and caches every missing (url, size, format) image. Returns how many were drawn."""
+    keys = {
+        qr_cache_key(url, size, fmt): (url, size, fmt)
+        for url in full_urls for size in sizes for fmt in formats
+    }
+    cached = cache.get_many(list(keys))
+    missing = {key: _draw(*args) for key, args in keys.items() if key not in cached}
+    cache.set_many(missing, settings.QR_CACHE_TIMEOUT)
+    return len(missing)
@@ -0,0 +1,169 @@
+"""
+Optional read replicas (DATABASE_REPLICA_URLS) for the heavy read-only pages:
+analytics, dashboard listings, profile counts, exports and admin lists.
+Views opt in with @replica_reads; every other query, and every write, stays
+on the primary. A replica that fails or lags more than REPLICA_MAX_LAG
+seconds is skipped until a background probe finds it healthy again, and a
+user who just wrote something reads from the primary for REPLICA_PIN_SECONDS.
+"""
+import contextvars
+import logging
+import random
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, InterfaceError, OperationalError, connections
+from django.utils.deprecation import MiddlewareMixin
+
+from .breaker import CircuitBreaker
+from .cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+# Set while a request pinned to the primary is being handled; the value doesn't matter
+PIN_COOKIE = 'nexlink_primary'
+
+# The replica alias reads go to during the current @replica_reads view, if any
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+# Aliases whose lag was checked recently, so a request costs at most one extra query
+_checked = LocalCache(maxsize=100, ttl=settings.REPLICA_CHECK_INTERVAL)
+
+
+class ReplicaLagging(Exception):
+    pass
+
+
+REPLICA_ERRORS = (OperationalError, InterfaceError, ReplicaLagging)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def replication_lag(alias):
+    """Seconds the replica is behind the primary; 0 for backends that can't tell."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        # A replica that has replayed everything it received is current, however old its last transaction
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def _check(alias):
+    lag = replication_lag(alias)
+    if lag > settings.REPLICA_MAX_LAG:
+        raise ReplicaLagging(f"{alias} is {lag:.1f}s behind")
+
+
+def _probe(alias):
+    # Runs on the breaker's own thread, whose connection would otherwise stay open
+    try:
+        _check(alias)
+    finally:
+        connections[alias].close()
+
+
+# One per replica: a single error or lag report takes it out of rotation
+_breakers = {
+    alias: CircuitBreaker(
+        f'db:{alias}', 1, settings.REPLICA_CHECK_INTERVAL, partial(_probe, alias), REPLICA_ERRORS,
+    )
+    for alias in replica_aliases()
+}
+
+
+def pick_replica():
+    """A healthy replica alias, or None to read from the primary."""
+    aliases = [alias for alias in _breakers if _breakers[alias].allow()]
+    random.shuffle(aliases)
+    for alias in aliases:
+        if _checked.get(alias):
+            return alias
+        try:
+            _check(alias)
+        except REPLICA_ERRORS:
+            logger.warning("Replica %s unavailable", alias, exc_info=True)
+            _breakers[alias].failure()
+            continue
+        _checked.set(alias, True)
+        return alias
+    return None
+
+
+def _pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def replica_reads(view):
+    """
+    Sends the reads of a read-only view to a replica. The response is
+    rendered before returning so template-evaluated querysets go there too.
+    If the replica fails mid-request, the view runs again on the primary.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = None if _pinned(request) else pick_replica()
+        if alias is None:
+            return view(request, *args, **kwargs)
+        token = _read_alias.set(alias)
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+        except (OperationalError, InterfaceError):
+            logger.warning("Replica %s failed, reading from the primary", alias, exc_info=True)
+            _breakers[alias].failure()
+        finally:
+            _read_alias.reset(token)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def read_alias():
+    """The alias reads go to right now; for querysets evaluated after the view returns."""
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Routes reads to the replica chosen by @replica_reads, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """
+    Reads from the primary for REPLICA_PIN_SECONDS after a successful
+    POST/PUT/PATCH/DELETE, so a link a user just created is on their
+    dashboard even if the replicas haven't replayed it yet.
+    """
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+                secure=request.is_secure(),
+            )
+        return response
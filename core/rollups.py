@@ -0,0 +1,178 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import (
+    Click, HourlyClickCount, DailyBreakdownCount, DailyClickCount, Referer, RollupState, UserAgent,
+)
+
+ROLLUP_NAME = 'click_counts'
+
+
+def _apply_increments(model, key_fields, increments):
+    """
+    Adds {(link_id, *key): n} onto existing rollup rows, creating missing
+    ones; key_fields names the fields of key, e.g. ('hour',).
+    """
+    if not increments:
+        return
+    filters = {'link_id__in': {key[0] for key in increments}}
+    for position, field in enumerate(key_fields, start=1):
+        filters[f'{field}__in'] = {key[position] for key in increments}
+    existing = {
+        (row.link_id, *(getattr(row, field) for field in key_fields)): row
+        for row in model.objects.filter(**filters)
+    }
+    to_update, to_create = [], []
+    for key, n in increments.items():
+        row = existing.get(key)
+        if row is not None:
+            row.count += n
+            to_update.append(row)
+        else:
+            to_create.append(model(link_id=key[0], count=n, **dict(zip(key_fields, key[1:]))))
+    model.objects.bulk_update(to_update, ['count'], batch_size=1000)
+    model.objects.bulk_create(to_create, batch_size=1000)
+
+
+def breakdown_counts(clicks):
+    """
+    {(link_id, day, dimension, value): n} for the clicks in a queryset,
+    labelled from the parsed UserAgent and Referer rows.
+    """
+    Dimension = DailyBreakdownCount.Dimension
+    clicks = clicks.annotate(day=TruncDay('timestamp')).order_by()
+    counts = Counter()
+
+    by_agent = list(clicks.values_list('link_id', 'day', 'user_agent_id').annotate(n=Count('id')))
+    agents = UserAgent.objects.only('browser', 'os', 'device').in_bulk(
+        {pk for _, _, pk, _ in by_agent if pk is not None}
+    )
+    for link_id, day, pk, n in by_agent:
+        agent = agents.get(pk)
+        for dimension, value in (
+            (Dimension.BROWSER, agent.browser if agent else 'Unknown'),
+            (Dimension.OS, agent.os if agent else 'Unknown'),
+            (Dimension.DEVICE, agent.device if agent else 'Unknown'),
+        ):
+            counts[(link_id, day.date(), dimension, value)] += n
+
+    by_referer = list(clicks.values_list('link_id', 'day', 'referer_id').annotate(n=Count('id')))
+    domains = dict(
+        Referer.objects.filter(id__in={pk for _, _, pk, _ in by_referer if pk is not None}).values_list('id', 'domain')
+    )
+    for link_id, day, pk, n in by_referer:
+        counts[(link_id, day.date(), Dimension.REFERER, domains.get(pk) or 'Direct')] += n
+    return counts
+
+
+def roll_up_clicks(chunk_size=100000):
+    """
+    Folds clicks newer than the last run into the hourly and daily tables.
+    Works through Click ids rather than timestamps: buffered and imported
+    clicks arrive late with their original time, and would slip behind a
+    timestamp high-water mark. Returns the number of clicks rolled up.
+    """
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+        upper = state.pending_click_id
+        total = 0
+        low = state.last_click_id
+        while low < upper:
+            high = min(low + chunk_size, upper)
+            rows = (
+                Click.objects.filter(id__gt=low, id__lte=high)
+                .annotate(bucket=TruncHour('timestamp'))
+                .values('link_id', 'bucket')
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            hourly, daily = {}, {}
+            for row in rows:
+                hourly[(row['link_id'], row['bucket'])] = row['n']
+                day_key = (row['link_id'], row['bucket'].date())
+                daily[day_key] = daily.get(day_key, 0) + row['n']
+                total += row['n']
+            _apply_increments(HourlyClickCount, ('hour',), hourly)
+            _apply_increments(DailyClickCount, ('day',), daily)
+            _apply_increments(
+                DailyBreakdownCount, ('day', 'dimension', 'value'),
+                breakdown_counts(Click.objects.filter(id__gt=low, id__lte=high)),
+            )
+            low = high
+
+        state.last_click_id = upper
+        state.pending_click_id = Click.objects.aggregate(max_id=Max('id'))['max_id'] or upper
+        state.save()
+    return total
+
+
+def rolled_up_until():
+    """Id of the newest click counted in the rollup tables."""
+    state = RollupState.objects.filter(name=ROLLUP_NAME).first()
+    return state.last_click_id if state else 0
+
+
+def _day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start, time.min, tzinfo=tz),
+        datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+
+
+def clicks_per_day(link, start, end):
+    """
+    {date: clicks} for every day in [start, end]. Reads the daily rollup plus
+    the few clicks not rolled up yet, so the cost follows the range length
+    rather than the link's total clicks.
+    """
+    counts = {start + timedelta(days=i): 0 for i in range((end - start).days + 1)}
+    for day, count in DailyClickCount.objects.filter(link=link, day__range=(start, end)).values_list('day', 'count'):
+        counts[day] += count
+
+    since, until = _day_bounds(start, end)
+    recent = (
+        Click.objects.filter(link=link, id__gt=rolled_up_until(), timestamp__gte=since, timestamp__lt=until)
+        .annotate(bucket=TruncDay('timestamp'))
+        .values('bucket')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for row in recent:
+        counts[row['bucket'].date()] += row['n']
+    return counts
+
+
+def clicks_per_hour(link, day):
+    """{hour datetime: clicks} for the 24 hours of day, same sources as clicks_per_day."""
+    since, until = _day_bounds(day, day)
+    counts = {since + timedelta(hours=i): 0 for i in range(24)}
+    for hour, count in HourlyClickCount.objects.filter(link=link, hour__gte=since, hour__lt=until).values_list('hour', 'count'):
+        counts[hour] += count
+
+    recent = (
+        Click.objects.filter(link=link, id__gt=rolled_up_until(), timestamp__gte=since, timestamp__lt=until)
+        .annotate(bucket=TruncHour('timestamp'))
+        .values('bucket')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for row in recent:
+        counts[row['bucket']] += row['n']
+    return counts
+
+
+def top_link_ids(since, limit):
+    """Ids of the limit links with the most rolled-up clicks on or after the date since, busiest first."""
+    return list(
+        DailyClickCount.objects.filter(day__gte=since)
+        .values('link_id')
+        .annotate(total=Sum('count'))
+        .order_by('-total')
+        .values_list('link_id', flat=True)[:limit]
+    )
@@ -0,0 +1,31 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_link, warm_links
+from .models import Link
+
+
+def _invalidate_after_commit(codes):
+    for code in codes:
+        # Invalidating before the commit would let a concurrent redirect re-cache the old row
+        transaction.on_commit(partial(invalidate_link, code))
+
+
+@receiver(post_save, sender=Link)
+def write_through_saved_link(sender, instance, created, **kwargs):
+    if not created:
+        codes = {instance.short_code, getattr(instance, '_loaded_short_code', None)}
+        _invalidate_after_commit(code for code in codes if code)
+    # Cached after the invalidation (callbacks run in order), so the first visitor
+    # doesn't miss. Adding a code that is already in the filter is harmless.
+    if instance.short_code:
+        transaction.on_commit(partial(warm_links, [instance]))
+
+
+@receiver(post_delete, sender=Link)
+def invalidate_deleted_link(sender, instance, **kwargs):
+    if instance.short_code:
+        _invalidate_after_commit([instance.short_code])
@@ -1,3 +1,1332 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as datetime_time, timedelta, timezone as datetime_timezone
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import OperationalError, connection, connections
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import urlencode
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from . import benchmarks, metrics, replicas, views
+from . import cache as link_cache
+from .access_logs import ingest_log
+from .archive import archive_month, archive_old_months, archived_months, current_month, previous_month
+from .breaker import CircuitBreaker, redis_breaker
+from .clicks import ClickBuffer, click_event, queue_depth, record_click, save_clicks
+from .cache import (
+    FILL_LOCK_KEY, LocalCache, async_sync_invalidations, cache_links, fill_link, get_cached_link, is_known_missing,
+    link_filter_stats, local_links, redirect_cache_key, redis_client, register_link_code, remember_missing,
+    sync_invalidations,
+)
+from .dimensions import parse_user_agent
+from .dispatch import AsyncRedirectDispatcher, RedirectDispatcher
+from .ids import ID_HEADROOM, REDIS_COUNTER_KEY, IdAllocator, RedisIdBlocks
+from .leaderboards import GLOBAL_SCOPE, owner_scope, top_links
+from .models import Click, Link, Referer, User, UserAgent
+from .qr import prerender_qr, qr_cache_key, qr_digest, render_qr
+from .rollups import roll_up_clicks
+from .utils import MAX_ID, canonical_url, decode, decode_many, encode, encode_many, is_generated_code
+from .visitors import persist_sketches, unique_visitors, visitor_key
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class SeededTestCase(TestCase):
+    """
+    A test against fakeredis (see benchmarks.isolated_redis) with self.owner's
+    seed_links links and seed_clicks clicks; redis_settings are overridden too.
+    """
+    seed_links = 5
+    seed_clicks = 0
+    redis_settings = {}
+
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(100, **self.redis_settings))
+        self.owner = benchmarks.seed(links=self.seed_links, clicks=self.seed_clicks)
+
+
+@skipUnless(fakeredis, "the request benchmarks need fakeredis")
+class RequestBudgetTests(TestCase):
+    """
+    Query budgets for the hot request paths, measured with the same harness as
+    `manage.py benchmark`. Latency is left to the command; these only fail
+    when a path starts doing more database work than it should.
+    """
+
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(500, CLICK_RECORDING='buffered'))
+        self.owner = benchmarks.seed(links=200, clicks=2000)
+        self.requests = benchmarks.default_scenarios(self.owner)
+        self.client.force_login(self.owner)
+
+    def measure(self, name, iterations=20):
+        client = Client() if name in benchmarks.ANONYMOUS_SCENARIOS else self.client
+        return benchmarks.measure(client, self.requests[name], iterations=iterations, warmup=5)
+
+    def test_report(self):
+        result = self.measure('redirect')
+        self.assertEqual(result['requests'], 20)
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertGreater(result['requests_per_second'], 0)
+
+    def test_cached_redirect_makes_no_queries(self):
+        result = self.measure('redirect')
+        self.assertEqual(result['statuses'], {'302': 20})
+        self.assertEqual(result['queries_per_request'], 0)
+
+    def test_unknown_code_makes_no_queries(self):
+        result = self.measure('redirect_missing')
+        self.assertEqual(result['statuses'], {'404': 20})
+        self.assertEqual(result['queries_per_request'], 0)
+
+    def test_fast_redirect_makes_no_queries(self):
+        result = self.measure('redirect_fast')
+        self.assertEqual(result['statuses'], {'302': 20})
+        self.assertEqual(result['queries_per_request'], 0)
+
+    def test_fast_path_falls_through_on_misses_and_app_pages(self):
+        fast_app = RedirectDispatcher(WSGIHandler())
+        self.assertEqual(benchmarks.wsgi_get(fast_app, '/missing-code').status_code, 404)
+        # The login redirect comes from the full stack
+        self.assertEqual(benchmarks.wsgi_get(fast_app, '/dashboard/').status_code, 302)
+
+    def test_shorten_inserts_once(self):
+        # Session and user lookups, the duplicate check, then the INSERT
+        result = self.measure('shorten')
+        self.assertEqual(result['statuses'], {'200': 20})
+        self.assertEqual(result['queries_per_request'], 4)
+
+    def test_dashboard_queries_do_not_grow_with_links(self):
+        before = self.measure('dashboard', iterations=5)['queries_per_request']
+        benchmarks.seed(links=300, clicks=0)
+        self.assertEqual(Link.objects.filter(owner=self.owner).count(), 500)
+        self.assertEqual(self.measure('dashboard', iterations=5)['queries_per_request'], before)
+
+    def test_link_analysis_queries_do_not_grow_with_clicks(self):
+        before = self.measure('link_analysis', iterations=5)['queries_per_request']
+        hot = Link.objects.filter(owner=self.owner).order_by('-clicks_count').first()
+        Click.objects.bulk_create([Click(link=hot) for _ in range(2000)])
+        roll_up_clicks()
+        roll_up_clicks()
+        self.assertEqual(self.measure('link_analysis', iterations=5)['queries_per_request'], before)
+
+
+@skipUnless(fakeredis, "the dashboard tests need fakeredis")
+@override_settings(DASHBOARD_PAGE_SIZE=10)
+class DashboardPagingTests(TestCase):
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(500))
+        self.owner = benchmarks.seed(links=200, clicks=0)
+        # Runs of four equal timestamps, a microsecond apart
+        base = timezone.now()
+        links = list(Link.objects.filter(owner=self.owner).order_by('id'))
+        for index, link in enumerate(links):
+            link.created_at = base + timedelta(microseconds=index // 4)
+        Link.objects.bulk_update(links, ['created_at'])
+        self.client.force_login(self.owner)
+
+    def pages(self, sort):
+        ids = []
+        query = urlencode({'sort': sort})
+        while query:
+            context = self.client.get(f'/dashboard/?{query}', HTTP_HX_REQUEST='true').context
+            ids.extend(link.id for link in context['links'])
+            query = context['next_query']
+            self.assertLessEqual(len(ids), 200)
+        return ids
+
+    def test_every_sort_pages_through_every_link_once(self):
+        links = Link.objects.filter(owner=self.owner)
+        for sort, ordering in (('newest', ('-created_at', '-id')), ('oldest', ('created_at', 'id')), ('clicks', ('-clicks_count', '-id'))):
+            with self.subTest(sort=sort):
+                self.assertEqual(self.pages(sort), list(links.order_by(*ordering).values_list('id', flat=True)))
+
+
+@skipUnless(fakeredis, "the redirect dispatcher tests need fakeredis")
+class RedirectDispatcherTests(SeededTestCase):
+    redis_settings = {'CLICK_RECORDING': 'sync'}
+
+    def test_sync_click_is_saved_between_the_request_signals(self):
+        link = Link.objects.filter(owner=self.owner).first()
+        seen = []
+
+        def receiver(signal, **kwargs):
+            seen.append((signal, Click.objects.filter(link=link).count()))
+
+        # close_old_connections is on both signals, disconnected by wsgi_get for the test transaction
+        for signal in (request_started, request_finished):
+            signal.connect(receiver)
+            self.addCleanup(signal.disconnect, receiver)
+        response = benchmarks.wsgi_get(RedirectDispatcher(WSGIHandler()), f'/{link.short_code}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(seen, [(request_started, 0), (request_finished, 1)])
+
+
+@skipUnless(fakeredis, "the cache warming tests need fakeredis")
+class CacheWarmingTests(SeededTestCase):
+    seed_links = 20
+    seed_clicks = 200
+    redis_settings = {'LINK_FILL_WAIT': 0.1}
+
+    def test_created_and_edited_links_are_written_through(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            link = Link.objects.create(original_url='https://example.org/new', owner=self.owner)
+        self.assertEqual(cache.get(redirect_cache_key(link.short_code))['url'], 'https://example.org/new')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link.original_url = 'https://example.org/edited'
+            link.save()
+        self.assertEqual(cache.get(redirect_cache_key(link.short_code))['url'], 'https://example.org/edited')
+
+    def test_concurrent_miss_waits_for_the_filling_request(self):
+        link = Link.objects.filter(owner=self.owner).first()
+        cache.delete(redirect_cache_key(link.short_code))
+        redis_client().set(FILL_LOCK_KEY.format(code=link.short_code), 1)
+        # The lock holder caches the entry; the waiter picks it up instead of loading
+        cache_links([link])
+        entry = fill_link(link.short_code, lambda: self.fail("loaded while another request fills"))
+        self.assertEqual(entry['id'], link.id)
+
+    def test_miss_loads_after_waiting_for_a_stuck_fill(self):
+        redis_client().set(FILL_LOCK_KEY.format(code='stuck'), 1)
+        self.assertEqual(fill_link('stuck', lambda: 'loaded'), 'loaded')
+
+    def test_warm_command_caches_top_links(self):
+        cache.clear()
+        call_command('warm_redirect_cache', top=5, batch_size=2, stdout=StringIO())
+        links = Link.objects.filter(owner=self.owner).order_by('-clicks_count', '-id')
+        cached = [cache.get(redirect_cache_key(link.short_code)) is not None for link in links]
+        self.assertEqual(cached, [True] * 5 + [False] * (len(cached) - 5))
+
+
+@skipUnless(fakeredis, "the visitor tests need fakeredis")
+class UniqueVisitorTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+
+    def click(self, ip, user_agent='Mozilla/5.0', days_ago=0):
+        return {
+            'link_id': self.link.id,
+            'timestamp': (timezone.now() - timedelta(days=days_ago)).isoformat(),
+            'ip_address': ip,
+            'user_agent': user_agent,
+            'referer': None,
+        }
+
+    def test_repeat_visits_count_once(self):
+        save_clicks([self.click('10.0.0.1'), self.click('10.0.0.1'), self.click('10.0.0.2')])
+        save_clicks([self.click('10.0.0.1', user_agent='curl/8.0'), self.click('10.0.0.2', days_ago=1)])
+        today = timezone.localdate()
+        self.assertEqual(unique_visitors(self.link, today, today), 3)
+        # 10.0.0.2 visited on both days
+        self.assertEqual(unique_visitors(self.link, today - timedelta(days=1), today), 3)
+
+    def test_analysis_page_shows_visitors(self):
+        save_clicks([self.click('10.0.0.1'), self.click('10.0.0.2')])
+        self.client.force_login(self.owner)
+        response = self.client.get(f'/analytics/{self.link.short_code}/')
+        self.assertEqual(response.context['range_visitors'], 2)
+
+
+@skipUnless(os.environ.get('TEST_REDIS_URL'), "set TEST_REDIS_URL to a disposable Redis to test stored sketches")
+class VisitorSketchStorageTests(TestCase):
+    """
+    Sketches are copied to the database as Redis' own HyperLogLog encoding,
+    which fakeredis doesn't have, so these run against a real server (which
+    they flush).
+    """
+    def setUp(self):
+        caches = {'default': {**settings.CACHES['default'], 'LOCATION': os.environ['TEST_REDIS_URL']}}
+        self.enterContext(override_settings(CACHES=caches))
+        redis_client().flushdb()
+        self.addCleanup(redis_client().flushdb)
+        self.link = Link.objects.create(original_url='https://example.com/')
+        self.day = timezone.localdate() - timedelta(days=40)
+
+    def visit(self, *ips):
+        timestamp = timezone.make_aware(datetime.combine(self.day, datetime_time(12)))
+        save_clicks([click_event({'REMOTE_ADDR': ip}, self.link.id, timestamp) for ip in ips])
+
+    def test_late_click_after_expiry_keeps_the_stored_visitors(self):
+        self.visit(*(f'10.0.0.{n}' for n in range(1, 6)))
+        self.assertEqual(persist_sketches(), 1)
+        redis_client().delete(visitor_key(self.link.id, self.day))
+
+        # A buffered or imported click for that day arrives after its key expired
+        self.visit('10.0.0.6')
+        self.assertEqual(persist_sketches(), 1)
+        redis_client().delete(visitor_key(self.link.id, self.day))
+        self.assertEqual(unique_visitors(self.link, self.day, self.day), 6)
+
+
+@skipUnless(fakeredis, "the analysis page tests need fakeredis")
+class LinkAnalysisRangeTests(SeededTestCase):
+    seed_clicks = 50
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        self.client.force_login(self.owner)
+
+    def range(self, **params):
+        response = self.client.get(f'/analytics/{self.link.short_code}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['start'], response.context['end']
+
+    def test_range_is_clamped(self):
+        today = timezone.localdate()
+        self.assertEqual(self.range(end='9999-12-31'), (today - timedelta(days=6), today))
+        self.assertEqual(self.range(start='1900-01-01'), (today - timedelta(days=365), today))
+        self.assertEqual(self.range(start='2026-13-01', end='nope'), (today - timedelta(days=6), today))
+
+
+@skipUnless(fakeredis, "the click dimension tests need fakeredis")
+class ClickDimensionTests(SeededTestCase):
+    CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0 Safari/537.36'
+    IPHONE = 'Mozilla/5.0 (iPhone; CPU iPhone OS 18_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.0 Mobile/15E148 Safari/604.1'
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+
+    def click(self, user_agent, referer=None):
+        return {
+            'link_id': self.link.id,
+            'timestamp': timezone.now().isoformat(),
+            'ip_address': '10.0.0.1',
+            'user_agent': user_agent,
+            'referer': referer,
+        }
+
+    def test_parse_user_agent(self):
+        self.assertEqual(parse_user_agent(self.CHROME), {'browser': 'Chrome', 'os': 'Windows', 'device': 'desktop'})
+        self.assertEqual(parse_user_agent(self.IPHONE), {'browser': 'Safari', 'os': 'iOS', 'device': 'mobile'})
+        self.assertEqual(parse_user_agent('curl/8.0')['device'], 'bot')
+
+    def test_values_are_stored_once(self):
+        save_clicks([self.click(self.CHROME, 'https://www.google.com/search?q=a'), self.click(self.CHROME)])
+        # The second batch is interned from the per-worker cache
+        with CaptureQueriesContext(connection) as queries:
+            save_clicks([self.click(self.CHROME, 'https://www.google.com/search?q=a')])
+        self.assertFalse([query for query in queries if 'core_useragent' in query['sql'] or 'core_referer' in query['sql']])
+        self.assertEqual(UserAgent.objects.count(), 1)
+        self.assertEqual(Referer.objects.get().domain, 'google.com')
+        self.assertEqual(Click.objects.filter(link=self.link, user_agent__browser='Chrome').count(), 3)
+
+    def test_analysis_page_breaks_down_clicks(self):
+        save_clicks([
+            self.click(self.CHROME, 'https://news.ycombinator.com/'),
+            self.click(self.IPHONE),
+            self.click(self.IPHONE, 'https://news.ycombinator.com/item?id=1'),
+        ])
+        self.client.force_login(self.owner)
+        before = self.client.get(f'/analytics/{self.link.short_code}/').context['breakdowns']
+        self.assertEqual(before['browsers'], [('Safari', 2), ('Chrome', 1)])
+        self.assertEqual(before['devices'], [('mobile', 2), ('desktop', 1)])
+        self.assertEqual(before['referers'], [('news.ycombinator.com', 2), ('Direct', 1)])
+
+        # Once rolled up, the raw clicks are no longer read
+        roll_up_clicks()
+        roll_up_clicks()
+        Click.objects.filter(link=self.link).delete()
+        self.assertEqual(self.client.get(f'/analytics/{self.link.short_code}/').context['breakdowns'], before)
+
+
+@skipUnless(fakeredis, "the bulk shorten tests need fakeredis")
+class BulkShortenTests(SeededTestCase):
+    seed_links = 0
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def shorten(self, links):
+        response = self.client.post('/api/links/bulk/', json.dumps({'links': links}), content_type='application/json')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_malformed_items_fail_alone(self):
+        results = self.shorten([
+            {'url': 'https://example.com/a', 'alias': 5},
+            {'url': ['https://example.com/b']},
+            {'url': 'https://example.com/c'},
+        ])
+        self.assertEqual([result['status'] for result in results], ['error', 'error', 'created'])
+        self.assertEqual(results[0]['error'], "Alias must be a string.")
+
+    def test_generated_code_conflict_is_retryable(self):
+        alias = Link.objects.create(owner=self.owner, original_url='https://example.com/', short_code='zzz')
+        # As if the alias was taken after the id's block was reserved
+        with mock.patch('core.bulk.allocate_link_ids', return_value=[decode('zzz')]):
+            [result] = self.shorten([{'url': 'https://example.com/new'}])
+        self.assertEqual(result, {'index': 0, 'status': 'error', 'error': "Could not create the link. Please try again."})
+        self.assertTrue(alias.is_custom)
+
+    def test_session_and_csrf_token_required(self):
+        body = json.dumps({'links': [{'url': 'https://example.com/a'}]})
+        response = Client().post('/api/links/bulk/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.owner)
+        client.get('/dashboard/')
+        response = client.post('/api/links/bulk/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = client.post(
+            '/api/links/bulk/', body, content_type='application/json', HTTP_X_CSRFTOKEN=client.cookies['csrftoken'].value,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['status'], 'created')
+
+
+@skipUnless(fakeredis, "the id allocator tests need fakeredis")
+class IdAllocatorTests(SeededTestCase):
+    seed_links = 20
+
+    def allocator(self):
+        return IdAllocator(RedisIdBlocks(10))
+
+    def test_blocks_skip_committed_ids_and_aliases(self):
+        alias = Link.objects.create(original_url='https://example.com/', short_code='zzz')
+        max_id = Link.objects.order_by('-id').values_list('id', flat=True).first()
+        alias.short_code = encode(max_id + ID_HEADROOM + 2)
+        alias.save()
+        # The counter is set up from the database
+        redis_client().flushdb()
+        ids = self.allocator().allocate(15)
+        self.assertEqual(len(set(ids)), 15)
+        self.assertGreater(min(ids), max_id + ID_HEADROOM)
+        self.assertNotIn(decode(alias.short_code), ids)
+
+    def test_a_recreated_counter_does_not_reissue_reserved_ids(self):
+        redis_client().set(REDIS_COUNTER_KEY, 100000)
+        old = self.allocator()
+        self.assertEqual(old.allocate(5), list(range(100001, 100006)))
+        high_water = old.high_water_mark()
+
+        redis_client().flushdb()
+        new = self.allocator()
+        # Starts over above the committed ids, which the worker holding 100006.. doesn't know yet
+        self.assertLess(new.allocate(1)[0], 100000)
+        self.assertGreaterEqual(old.high_water_mark(), high_water)
+
+        # Its next block raises the counter past its old ones, and the ids it still held are dropped
+        self.assertEqual(old.allocate(10), list(range(100011, 100021)))
+        new.allocate(9)
+        self.assertEqual(new.allocate(1), [100021])
+
+
+class Base62Tests(SimpleTestCase):
+    def test_boundaries(self):
+        for num, code in [(0, '0'), (9, '9'), (61, 'Z'), (62, '10'), (62 * 62 - 1, 'ZZ'), (62 * 62, '100'),
+                          (MAX_ID, 'aZl8N0y58M7')]:
+            self.assertEqual(encode(num), code)
+            self.assertEqual(decode(code), num)
+            self.assertTrue(is_generated_code(code))
+
+    def test_round_trip(self):
+        nums = [*range(5000), *range(MAX_ID - 5000, MAX_ID + 1), *(62 ** n + d for n in range(1, 11) for d in (-1, 0, 1))]
+        codes = encode_many(nums)
+        self.assertEqual(decode_many(codes), nums)
+        self.assertTrue(all(map(is_generated_code, codes)))
+
+    def test_codes_encode_never_returns(self):
+        for code in ['', '00', '01', 'abc-d', 'ab c', 'é', 'aZl8N0y58M8', '10000000000a']:
+            self.assertFalse(is_generated_code(code), code)
+        self.assertEqual(decode_many(['10', 'my-alias', '00']), [62, None, None])
+
+    def test_decode_rejects_invalid_characters(self):
+        for code in ['abc-d', 'ab c', 'é']:
+            with self.assertRaises(KeyError):
+                decode(code)
+
+
+@skipUnless(fakeredis, "the short code lookup tests need fakeredis")
+class ShortCodeLookupTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+
+    def test_generated_code_is_a_primary_key_fetch(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Link.objects.get_by_code(self.link.short_code), self.link)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('short_code', queries[0]['sql'].split('WHERE')[1])
+
+    def test_alias_shaped_like_a_generated_code(self):
+        # The link whose id 'zz' encodes carries an alias, and another link has 'zz' as its alias
+        with self.captureOnCommitCallbacks(execute=True):
+            renamed = Link.objects.create(
+                id=decode('zz'), owner=self.owner, original_url='https://example.org/renamed', short_code='renamed',
+            )
+            alias = Link.objects.create(owner=self.owner, original_url='https://example.org/zz', short_code='zz')
+        self.assertTrue(renamed.is_custom)
+        self.assertTrue(alias.is_custom)
+        self.assertTrue(is_generated_code('zz'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Link.objects.get_by_code('zz'), alias)
+        # The primary-key fetch finds no generated link, so the alias index answers
+        self.assertEqual(len(queries), 2)
+        self.assertIn('short_code', queries[1]['sql'].split('WHERE')[1])
+        self.assertEqual(Link.objects.get_by_code('renamed'), renamed)
+        self.assertEqual(Client().get('/zz')['Location'], alias.original_url)
+
+    def test_unknown_codes(self):
+        for code in ['zzzzzz', 'no-such-alias', '00', 'aZl8N0y58M8']:
+            self.assertIsNone(Link.objects.get_by_code(code), code)
+
+
+@skipUnless(fakeredis, "the duplicate link tests need fakeredis")
+class DuplicateLinkTests(SeededTestCase):
+    seed_links = 0
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def shorten(self, url, **data):
+        self.client.post('/shorten/', {'original_url': url, **data}, HTTP_HX_REQUEST='true')
+        return Link.objects.filter(owner=self.owner).count()
+
+    def test_canonical_url(self):
+        self.assertEqual(
+            canonical_url('HTTPS://Example.COM:443?utm_source=mail&b=2&a=1&fbclid=x#Intro'),
+            'https://example.com/?a=1&b=2#Intro',
+        )
+        self.assertEqual(canonical_url('http://example.com:8080/Path'), 'http://example.com:8080/Path')
+
+    def test_shorten_returns_the_existing_link(self):
+        self.assertEqual(self.shorten('https://example.com/page?b=2&a=1'), 1)
+        self.assertEqual(self.shorten('https://EXAMPLE.com:443/page?a=1&b=2&utm_campaign=spring'), 1)
+        self.assertEqual(self.shorten('https://example.com/page?a=1&b=3'), 2)
+        # An alias is always a new link
+        self.assertEqual(self.shorten('https://example.com/page?a=1&b=2', custom_code='spring-page'), 3)
+
+        other = User.objects.create(username='other', email='other@example.com')
+        self.client.force_login(other)
+        self.client.post('/shorten/', {'original_url': 'https://example.com/page?a=1&b=2'}, HTTP_HX_REQUEST='true')
+        self.assertEqual(Link.objects.filter(owner=other).count(), 1)
+
+    def test_bulk_shorten_reuses_links(self):
+        self.shorten('https://example.com/a')
+        response = self.client.post('/api/links/bulk/', json.dumps({'links': [
+            {'url': 'https://example.com/a?utm_source=api'},
+            {'url': 'https://example.com/b'},
+            {'url': 'https://example.com/b#'},
+            {'url': 'https://example.com/a', 'alias': 'page-a'},
+        ]}), content_type='application/json')
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['status'] for result in results], ['existing', 'created', 'existing', 'created'])
+        self.assertEqual(results[1]['short_code'], results[2]['short_code'])
+        self.assertEqual(Link.objects.filter(owner=self.owner).count(), 3)
+
+
+@skipUnless(fakeredis, "the leaderboard tests need fakeredis")
+class LeaderboardTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.links = list(Link.objects.filter(owner=self.owner).order_by('id'))
+        self.other = User.objects.create(username='other', email='other@example.com')
+        self.others_link = Link.objects.create(owner=self.other, original_url='https://example.org/', short_code='other1')
+
+    def clicks(self, link, n, days_ago=0):
+        timestamp = (timezone.now() - timedelta(days=days_ago)).isoformat()
+        return [
+            {'link_id': link.id, 'timestamp': timestamp, 'ip_address': None, 'user_agent': None, 'referer': None}
+        ] * n
+
+    def test_saved_clicks_rank_links(self):
+        save_clicks(self.clicks(self.links[0], 2) + self.clicks(self.links[1], 3) + self.clicks(self.others_link, 4))
+        save_clicks(self.clicks(self.links[0], 5, days_ago=2))
+        # Only this test's links: the global sets span every owner
+        mine = {link.id for link in self.links} | {self.others_link.id}
+        ranked = [(link_id, clicks) for link_id, clicks in top_links(GLOBAL_SCOPE, 'day') if link_id in mine]
+        self.assertEqual(ranked, [(self.others_link.id, 4), (self.links[1].id, 3), (self.links[0].id, 2)])
+        self.assertEqual(top_links(owner_scope(self.owner.id), 'week'), [(self.links[0].id, 7), (self.links[1].id, 3)])
+
+    def test_api_scopes(self):
+        save_clicks(self.clicks(self.links[0], 2) + self.clicks(self.others_link, 4))
+        self.client.force_login(self.owner)
+        response = self.client.get('/api/links/top/', {'window': 'week'})
+        self.assertEqual(
+            [(link['short_code'], link['clicks']) for link in response.json()['links']],
+            [(self.links[0].short_code, 2)],
+        )
+        self.assertEqual(self.client.get('/api/links/top/', {'scope': 'global'}).status_code, 403)
+
+        self.owner.is_staff = True
+        self.owner.save()
+        response = self.client.get('/api/links/top/', {'scope': 'global'})
+        self.assertEqual(response.json()['links'][0]['short_code'], 'other1')
+        self.assertContains(self.client.get('/internal/top-links/'), 'other1')
+
+
+@skipUnless(fakeredis, "the cacheable redirect tests need fakeredis")
+class CacheableRedirectTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        self.link.redirect_policy = Link.RedirectPolicy.PERMANENT
+        self.link.cache_max_age = 86400
+        # Re-caches the entry seed() warmed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.save()
+        # Cacheable since before the logged requests
+        self.link.policy_changes.update(changed_at=datetime(2026, 10, 1, tzinfo=datetime_timezone.utc))
+        self.plain = Link.objects.filter(owner=self.owner).exclude(id=self.link.id).first()
+
+    def log_line(self, code, status=301, at='17/Oct/2026:10:00:00 +0000'):
+        return (
+            f'203.0.113.7 - - [{at}] "GET /{code}?utm_source=x HTTP/1.1" {status} 0 '
+            f'"https://news.example.com/" "Mozilla/5.0 (X11; Linux x86_64)"\n'
+        )
+
+    def log_file(self, *lines):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        with tempfile.NamedTemporaryFile('w', suffix='.log', dir=directory, delete=False) as log:
+            log.writelines(lines)
+        return log.name
+
+    def test_cacheable_redirect_is_not_counted_by_the_app(self):
+        response = self.client.get(f'/{self.link.short_code}')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        self.assertEqual(self.client.get(f'/{self.plain.short_code}')['Cache-Control'], 'no-cache, no-store, must-revalidate')
+
+        fast = benchmarks.wsgi_get(RedirectDispatcher(WSGIHandler()), f'/{self.link.short_code}')
+        self.assertEqual(fast.status_code, 301)
+        self.assertEqual(fast.headers['Cache-Control'], 'public, max-age=86400')
+        self.assertFalse(Click.objects.filter(link=self.link).exists())
+
+    def test_access_log_ingestion(self):
+        line = self.log_line
+        path = self.log_file(
+            line(self.link.short_code),
+            line(self.link.short_code, at='17/Oct/2026:10:00:05 +0000'),
+            # Counted by the app already, an asset and a 404
+            line(self.plain.short_code, status=302),
+            '203.0.113.7 - - [17/Oct/2026:10:00:06 +0000] "GET /static/app.css HTTP/1.1" 200 512 "-" "-"\n',
+            line('nope', status=404),
+            # Not finished yet
+            line(self.link.short_code)[:40],
+        )
+
+        self.assertEqual(ingest_log(path), (5, 2))
+        click = Click.objects.filter(link=self.link).order_by('timestamp').first()
+        self.assertEqual(click.ip_address, '203.0.113.7')
+        self.assertEqual(click.referer.domain, 'news.example.com')
+        self.assertEqual(click.timestamp, datetime(2026, 10, 17, 10, 0, tzinfo=datetime_timezone.utc))
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.clicks_count, 2)
+
+        # Only the rest of the unfinished line is new
+        with open(path, 'a') as log:
+            log.write(line(self.link.short_code)[40:])
+        self.assertEqual(ingest_log(path), (1, 1))
+        self.assertEqual(ingest_log(path), (0, 0))
+
+    def test_access_log_counts_by_the_policy_at_request_time(self):
+        self.link.redirect_policy = Link.RedirectPolicy.UNCACHED
+        self.link.save()
+        self.plain.redirect_policy = Link.RedirectPolicy.TEMPORARY
+        self.plain.save()
+        at = lambda day: datetime(2026, 10, day, tzinfo=datetime_timezone.utc)
+        self.link.policy_changes.filter(policy=Link.RedirectPolicy.UNCACHED).update(changed_at=at(18))
+        self.plain.policy_changes.update(changed_at=at(18))
+
+        path = self.log_file(
+            self.log_line(self.link.short_code, at='17/Oct/2026:10:00:00 +0000'),
+            self.log_line(self.link.short_code, at='19/Oct/2026:10:00:00 +0000'),
+            self.log_line(self.plain.short_code, status=302, at='17/Oct/2026:10:00:00 +0000'),
+            self.log_line(self.plain.short_code, status=302, at='19/Oct/2026:10:00:00 +0000'),
+        )
+        self.assertEqual(ingest_log(path), (4, 2))
+        self.assertEqual(
+            sorted(Click.objects.values_list('link_id', 'timestamp__day')),
+            sorted([(self.link.id, 17), (self.plain.id, 19)]),
+        )
+
+    def test_access_log_rotation_keeps_the_rest_of_the_old_file(self):
+        path = self.log_file(self.log_line(self.link.short_code))
+        self.assertEqual(ingest_log(path), (1, 1))
+        # Written after the last run, then the log is rotated by renaming it
+        with open(path, 'a') as log:
+            log.write(self.log_line(self.link.short_code, at='17/Oct/2026:10:00:01 +0000'))
+        os.rename(path, f'{path}.1')
+        with open(path, 'w') as log:
+            log.write(self.log_line(self.link.short_code, at='17/Oct/2026:10:00:02 +0000'))
+
+        self.assertEqual(ingest_log(path), (2, 2))
+        self.assertEqual(ingest_log(path), (0, 0))
+        self.assertEqual(Click.objects.filter(link=self.link).count(), 3)
+
+
+@skipUnless(fakeredis, "the QR tests need fakeredis")
+class QrCodeTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        self.path = f'/qr/{self.link.short_code}/image/'
+        self.full_url = f'http://testserver/{self.link.short_code}'
+
+    def test_render_qr_draws_once(self):
+        png = render_qr(self.full_url)
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertEqual(cache.get(qr_cache_key(self.full_url)), png)
+        with mock.patch('core.qr._draw') as draw:
+            self.assertEqual(render_qr(self.full_url), png)
+        draw.assert_not_called()
+
+    def test_svg(self):
+        response = self.client.get(self.path, {'format': 'svg', 'size': 4})
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+        self.assertEqual(response.content, render_qr(self.full_url, 4, 'svg'))
+
+    def test_unsupported_parameters(self):
+        self.assertEqual(self.client.get(self.path, {'format': 'gif'}).status_code, 400)
+        self.assertEqual(self.client.get(self.path, {'size': 1000}).status_code, 400)
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{qr_digest(self.full_url)}"')
+        self.assertIn('public', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Another size is another image
+        self.assertEqual(self.client.get(self.path, {'size': 4}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_and_deleted_codes_are_never_not_modified(self):
+        etag = f'"{qr_digest("http://testserver/zzzzzz")}"'
+        self.assertEqual(self.client.get('/qr/zzzzzz/image/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+        etag = self.client.get(self.path)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        self.assertEqual(self.client.get(self.path, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_prerender_qr(self):
+        urls = [self.full_url, 'http://testserver/other']
+        self.assertEqual(prerender_qr(urls, sizes=(4, 10), formats=('png', 'svg')), 8)
+        self.assertEqual(prerender_qr(urls, sizes=(4, 10, 20), formats=('png', 'svg')), 4)
+        with mock.patch('core.qr._draw') as draw:
+            self.assertEqual(self.client.get(self.path, {'format': 'svg', 'size': 4}).status_code, 200)
+        draw.assert_not_called()
+
+    def test_prerender_qr_command(self):
+        out = StringIO()
+        call_command(
+            'prerender_qr', self.owner.username, '--base-url', 'https://nexl.ink', '--format', 'png', '--format', 'svg',
+            '--batch-size', '2', stdout=out,
+        )
+        self.assertIn(f"Rendered {self.seed_links * 2} QR images for {self.seed_links} links", out.getvalue())
+        self.assertIsNotNone(cache.get(qr_cache_key(f'https://nexl.ink/{self.link.short_code}', fmt='svg')))
+
+@skipUnless(fakeredis, "the export tests need fakeredis")
+class ClickExportTests(SeededTestCase):
+    seed_links = 10
+    seed_clicks = 300
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).order_by('-clicks_count').first()
+        self.client.force_login(self.owner)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_link_export_csv(self):
+        response = self.client.get(f'/analytics/{self.link.short_code}/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(self.content(response).decode())))
+        self.assertEqual(rows[0], ['short_code', 'timestamp', 'ip_address', 'user_agent', 'referer'])
+        self.assertEqual(len(rows) - 1, Click.objects.filter(link=self.link).count())
+        self.assertEqual({row[0] for row in rows[1:]}, {self.link.short_code})
+
+    def test_account_export_ndjson_gzip_with_date_range(self):
+        today = timezone.localdate()
+        response = self.client.get('/export/clicks/', {
+            'format': 'ndjson', 'gzip': '1', 'start': (today - timedelta(days=6)).isoformat(), 'end': today.isoformat(),
+        })
+        self.assertIn('clicks.ndjson.gz', response['Content-Disposition'])
+        lines = gzip.decompress(self.content(response)).decode().splitlines()
+        since = datetime.combine(today - timedelta(days=6), datetime_time.min, tzinfo=timezone.get_current_timezone())
+        self.assertEqual(len(lines), Click.objects.filter(link__owner=self.owner, timestamp__gte=since).count())
+        self.assertEqual(set(json.loads(lines[0])), {'short_code', 'timestamp', 'ip_address', 'user_agent', 'referer'})
+
+    def test_other_users_links_are_not_exported(self):
+        self.client.force_login(User.objects.create(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get(f'/analytics/{self.link.short_code}/export/').status_code, 404)
+
+
+@skipUnless(fakeredis, "the archive tests need fakeredis")
+class ClickArchiveTests(SeededTestCase):
+    seed_links = 10
+    seed_clicks = 300
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(CLICK_ARCHIVE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.link = Link.objects.filter(owner=self.owner).order_by('-clicks_count').first()
+        self.client.force_login(self.owner)
+        # A year back, well past any retention period
+        self.old_month = current_month()
+        for _ in range(12):
+            self.old_month = previous_month(self.old_month)
+        # The newest ids, as for clicks imported from logs or flushed late
+        self.old = list(Click.objects.filter(link=self.link).order_by('-id').values_list('id', flat=True)[:20])
+        Click.objects.filter(id__in=self.old).update(
+            timestamp=datetime.combine(self.old_month, datetime_time(12), tzinfo=datetime_timezone.utc),
+        )
+
+    def test_old_month_is_archived_and_still_exported(self):
+        total = Click.objects.filter(link=self.link).count()
+        results = archive_old_months(retain_months=3)
+        self.assertEqual(results[self.old_month], 20)
+        self.assertEqual(list(archived_months()), [self.old_month])
+        self.assertFalse(Click.objects.filter(id__in=self.old).exists())
+
+        response = self.client.get(f'/analytics/{self.link.short_code}/export/')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows) - 1, total)
+        self.assertEqual(rows[1][1][:7], f'{self.old_month:%Y-%m}')
+
+    def test_month_with_clicks_not_rolled_up_is_kept(self):
+        Click.objects.create(link=self.link, timestamp=datetime.combine(
+            self.old_month, datetime_time(13), tzinfo=datetime_timezone.utc,
+        ))
+        self.assertIsNone(archive_month(self.old_month))
+        self.assertEqual(archived_months(), {})
+        # The first run only marks the new click pending
+        roll_up_clicks()
+        roll_up_clicks()
+        self.assertEqual(archive_month(self.old_month), 21)
+
+
+@skipUnless(fakeredis, "the admin tests need fakeredis")
+class AdminTests(SeededTestCase):
+    seed_links = 30
+    seed_clicks = 200
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser(username='admin', email='admin@example.com', password='x'))
+
+    def test_click_list_opens_on_today(self):
+        response = self.client.get('/admin/core/click/')
+        today = timezone.localdate()
+        self.assertRedirects(
+            response,
+            f'/admin/core/click/?timestamp__year={today.year}&timestamp__month={today.month}&timestamp__day={today.day}',
+        )
+
+    def test_link_search(self):
+        link = Link.objects.filter(owner=self.owner).order_by('id').last()
+        results = self.client.get('/admin/core/link/', {'q': link.short_code}).context['cl'].result_list
+        self.assertIn(link, results)
+        results = self.client.get('/admin/core/link/', {'q': self.owner.email}).context['cl'].result_list
+        self.assertEqual(len(results), 30)
+        results = self.client.get('/admin/core/link/', {'q': f'example.com/{link.id}'}).context['cl'].result_list
+        self.assertEqual(list(results), [link])
+
+
+class LocalCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        local = LocalCache(maxsize=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        self.assertEqual(local.get('a'), 1)
+        local.set('c', 3)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual((local.get('a'), local.get('c')), (1, 3))
+        self.assertEqual(local.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        local = LocalCache(maxsize=10, ttl=60)
+        with mock.patch.object(link_cache.time, 'monotonic', return_value=1000.0):
+            local.set('a', 1)
+        with mock.patch.object(link_cache.time, 'monotonic', return_value=1059.0):
+            self.assertEqual(local.get('a'), 1)
+        with mock.patch.object(link_cache.time, 'monotonic', return_value=1061.0):
+            self.assertIsNone(local.get('a'))
+        self.assertEqual(local.stats()['size'], 0)
+
+    def test_disabled_when_size_is_zero(self):
+        local = LocalCache(maxsize=0, ttl=60)
+        local.set('a', 1)
+        self.assertIsNone(local.get('a'))
+
+
+@skipUnless(fakeredis, "the invalidation tests need fakeredis")
+class LinkInvalidationTests(SeededTestCase):
+    """An edit or delete in this worker evicts the link from another worker's local cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        self.code = self.link.short_code
+        self.original_url = self.link.original_url
+        # The other worker's local cache and stream position
+        self.other = LocalCache(100, 60)
+        self.position = None
+        with self.other_worker():
+            sync_invalidations(force=True)
+            self.assertEqual(get_cached_link(self.code)['url'], self.original_url)
+
+    @contextmanager
+    def other_worker(self):
+        with mock.patch.object(link_cache, 'local_links', self.other), \
+                mock.patch.object(link_cache, '_last_invalidation_id', self.position):
+            yield
+            self.position = link_cache._last_invalidation_id
+
+    def test_edit_evicts_the_other_workers_entry(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.original_url = 'https://example.org/moved'
+            self.link.save()
+        with self.other_worker():
+            # Stale until the worker syncs
+            self.assertEqual(self.other.get(self.code)['url'], self.original_url)
+            sync_invalidations(force=True)
+            self.assertIsNone(self.other.get(self.code))
+            self.assertEqual(get_cached_link(self.code)['url'], 'https://example.org/moved')
+
+    def test_delete_evicts_the_other_workers_entry(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        with self.other_worker():
+            sync_invalidations(force=True)
+            self.assertIsNone(self.other.get(self.code))
+            self.assertIsNone(get_cached_link(self.code))
+
+    async def test_async_sync_evicts_the_other_workers_entry(self):
+        await sync_to_async(self.delete_link)()
+        with self.other_worker():
+            await async_sync_invalidations(force=True)
+            self.assertIsNone(self.other.get(self.code))
+
+    def delete_link(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+
+
+@skipUnless(fakeredis, "the link filter tests need fakeredis")
+class LinkFilterTests(SeededTestCase):
+    """Unknown codes are turned away by Redis; the code of a link that exists never is."""
+
+    def setUp(self):
+        super().setUp()
+        self.links = list(Link.objects.filter(owner=self.owner))
+
+    def test_seeded_codes_pass_the_filter(self):
+        for link in self.links:
+            self.assertFalse(is_known_missing(link.short_code))
+        self.assertEqual(link_filter_stats()['rejected'], 0)
+
+    def test_unknown_code_is_rejected_without_a_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(Client().get('/zzzzzz').status_code, 404)
+            self.assertEqual(Client().get('/no-such-alias').status_code, 404)
+        stats = link_filter_stats()
+        self.assertEqual((stats['rejected'], stats['false_positives']), (2, 0))
+
+    def test_false_positive_is_remembered(self):
+        with mock.patch.object(link_cache.link_filter, 'check_result', return_value=True):
+            self.assertEqual(Client().get('/zzzzzz').status_code, 404)
+            # The negative cache answers the second lookup
+            with self.assertNumQueries(0):
+                self.assertEqual(Client().get('/zzzzzz').status_code, 404)
+        stats = link_filter_stats()
+        self.assertEqual((stats['false_positives'], stats['negative_cache_hits']), (1, 1))
+        self.assertEqual(stats['observed_false_positive_rate'], 1.0)
+
+    def test_new_links_are_never_rejected(self):
+        # Including an alias whose earlier lookup was cached as missing
+        remember_missing('launch')
+        self.assertTrue(is_known_missing('launch'))
+        with self.captureOnCommitCallbacks(execute=True):
+            alias = Link.objects.create(owner=self.owner, original_url='https://example.org/launch', short_code='launch')
+            generated = Link.objects.create(owner=self.owner, original_url='https://example.org/next')
+        for link in (alias, generated):
+            self.assertFalse(is_known_missing(link.short_code))
+            self.assertEqual(Client().get(f'/{link.short_code}')['Location'], link.original_url)
+
+    def test_register_link_code_clears_a_cached_miss(self):
+        remember_missing('launch')
+        register_link_code('launch')
+        self.assertFalse(is_known_missing('launch'))
+
+    def test_register_link_code_does_not_start_a_partial_filter(self):
+        redis_client().delete(link_cache.link_filter.key)
+        register_link_code('launch')
+        self.assertFalse(redis_client().exists(link_cache.link_filter.key))
+        # Without a filter nothing is rejected
+        self.assertFalse(is_known_missing(self.links[0].short_code))
+        self.assertFalse(link_filter_stats()['built'])
+
+    def test_rebuild_adds_links_the_filter_missed(self):
+        # on_commit never runs here, so the new link is not registered
+        link = Link.objects.create(owner=self.owner, original_url='https://example.org/unregistered')
+        self.assertTrue(is_known_missing(link.short_code))
+
+        out = StringIO()
+        call_command('rebuild_link_filter', stdout=out)
+        self.assertIn(f"Filter rebuilt with {len(self.links) + 1} codes", out.getvalue())
+        self.assertFalse(is_known_missing(link.short_code))
+        self.assertTrue(is_known_missing('zzzzzz'))
+
+        out = StringIO()
+        call_command('rebuild_link_filter', '--stats', stdout=out)
+        stats = json.loads(out.getvalue())
+        self.assertTrue(stats['built'])
+        self.assertEqual(stats['rejected'], 2)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_and_closes_when_probe_succeeds(self):
+        redis_up = False
+
+        def probe():
+            if not redis_up:
+                raise RedisConnectionError()
+
+        breaker = CircuitBreaker('test', 2, 0.01, probe, (RedisConnectionError,))
+
+        @breaker.guard(default='fallback')
+        def call():
+            raise RedisConnectionError()
+
+        self.assertEqual(call(), 'fallback')
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(call(), 'fallback')
+        self.assertTrue(breaker.is_open)
+
+        redis_up = True
+        deadline = time.monotonic() + 2
+        while breaker.is_open and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.drain_counts(), {'opened': 1, 'closed': 1, 'fallbacks': 2})
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('db:replica1', 1, 60, lambda: None, replicas.REPLICA_ERRORS)
+        self.enterContext(mock.patch.dict(replicas._breakers, {'replica1': self.breaker}))
+        replicas._checked.set('replica1', True)
+        self.addCleanup(replicas._checked.clear)
+        self.router = replicas.ReplicaRouter()
+        self.seen = []
+
+    def view(self, request):
+        self.seen.append(self.router.db_for_read(Link))
+        return HttpResponse()
+
+    def test_only_wrapped_views_read_from_replica(self):
+        self.assertIsNone(self.router.db_for_read(Link))
+        replicas.replica_reads(self.view)(RequestFactory().get('/dashboard/'))
+        self.assertEqual(self.seen, ['replica1'])
+        self.assertIsNone(self.router.db_for_read(Link))
+        self.assertEqual(self.router.db_for_write(Link), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+
+    def test_writers_are_pinned_to_primary(self):
+        request = RequestFactory().get('/dashboard/')
+        request.COOKIES[replicas.PIN_COOKIE] = '1'
+        replicas.replica_reads(self.view)(request)
+        self.assertEqual(self.seen, [None])
+
+    def test_failed_replica_falls_back_to_primary(self):
+        def view(request):
+            self.seen.append(self.router.db_for_read(Link))
+            if len(self.seen) == 1:
+                raise OperationalError("replica went away")
+            return HttpResponse()
+
+        replicas.replica_reads(view)(RequestFactory().get('/dashboard/'))
+        self.assertEqual(self.seen, ['replica1', None])
+        self.assertTrue(self.breaker.is_open)
+        self.assertIsNone(replicas.pick_replica())
+
+
+@skipUnless(fakeredis, "the replica routing tests need fakeredis")
+@skipUnless('replica1' in settings.DATABASES, "set DATABASE_REPLICA_URLS to test against a replica")
+class ReplicaRoutingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(100))
+        self.owner = User.objects.create(username='reader', email='reader@example.com')
+        self.client.force_login(self.owner)
+
+    def test_dashboard_reads_replica_until_user_writes(self):
+        with CaptureQueriesContext(connections['replica1']) as replica_queries:
+            self.assertEqual(self.client.get('/dashboard/').status_code, 200)
+        self.assertTrue(replica_queries)
+
+        self.client.post('/shorten/', {'original_url': 'https://example.com/new'})
+        with CaptureQueriesContext(connections['replica1']) as replica_queries:
+            self.client.get('/dashboard/')
+        self.assertFalse(replica_queries)
+
+
+@skipUnless(fakeredis, "the outage tests need fakeredis")
+class RedisOutageTests(SeededTestCase):
+    seed_links = 20
+    redis_settings = {'CLICK_RECORDING': 'buffered'}
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        # Open without the probe thread, which would close it again against fakeredis
+        redis_breaker.is_open = True
+        self.addCleanup(setattr, redis_breaker, 'is_open', False)
+
+    def test_redirect_falls_back_to_the_database(self):
+        response = Client().get(f'/{self.link.short_code}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], self.link.original_url)
+        # The click couldn't be buffered, so it was written synchronously
+        self.assertEqual(Click.objects.filter(link=self.link).count(), 1)
+
+    def test_unknown_code_is_still_a_404(self):
+        self.assertEqual(Client().get('/missing-code').status_code, 404)
+
+    def test_internal_stats_without_redis(self):
+        self.owner.is_staff = True
+        self.owner.save()
+        self.client.force_login(self.owner)
+        response = self.client.get('/internal/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['redis_breaker_open'])
+        self.assertIsNone(response.json()['click_queue_depth'])
+        self.assertIsNone(response.json()['link_filter'])
+
+
+@skipUnless(fakeredis, "the deferred click tests need fakeredis")
+class DeferredClickTests(TransactionTestCase):
+    """
+    The redirect hands its click to the background writer. A TransactionTestCase,
+    so the writer's own connection sees the seeded link and the test sees its click.
+    """
+
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(100, CLICK_RECORDING='deferred'))
+        self.owner = benchmarks.seed(links=1, clicks=0)
+        self.link = Link.objects.get(owner=self.owner)
+
+    def test_writer_thread_saves_the_click_after_the_redirect(self):
+        release = threading.Event()
+
+        def save_when_released(events):
+            release.wait(5)
+            return save_clicks(events)
+
+        with mock.patch('core.clicks.save_clicks', side_effect=save_when_released) as save:
+            with self.assertNumQueries(0):
+                response = Client().get(f'/{self.link.short_code}')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Click.objects.count(), 0)
+
+            release.set()
+            deadline = time.monotonic() + 5
+            while not Click.objects.exists() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        save.assert_called_once()
+        self.assertEqual(Click.objects.get().link_id, self.link.id)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.clicks_count, 1)
+
+
+@skipUnless(fakeredis, "the click buffer tests need fakeredis")
+class ClickBufferTests(SeededTestCase):
+    redis_settings = {'CLICK_RECORDING': 'buffered'}
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+
+    def push(self, n):
+        for _ in range(n):
+            record_click({'REMOTE_ADDR': '203.0.113.7', 'HTTP_USER_AGENT': 'Mozilla/5.0'}, self.link.id)
+        self.assertEqual(queue_depth(), n)
+
+    def assertClicks(self, n):
+        self.assertEqual(Click.objects.filter(link=self.link).count(), n)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.clicks_count, n)
+
+    def test_flush_saves_batches_and_empties_the_lists(self):
+        self.push(5)
+        buffer = ClickBuffer(batch_size=3, at_least_once=True, consumer='test')
+        self.assertEqual(buffer.flush(), (3, 3))
+        self.assertEqual(buffer.flush(), (2, 2))
+        self.assertEqual(buffer.flush(), (0, 0))
+        self.assertEqual(queue_depth(), 0)
+        self.assertFalse(redis_client().exists(buffer.processing_key))
+        self.assertClicks(5)
+
+    def test_queue_depth_is_unknown_while_redis_is_down(self):
+        self.push(2)
+        redis_breaker.is_open = True
+        self.addCleanup(setattr, redis_breaker, 'is_open', False)
+        self.assertIsNone(queue_depth())
+
+    def test_failed_batch_stays_in_the_processing_list(self):
+        self.push(4)
+        buffer = ClickBuffer(batch_size=10, at_least_once=True, consumer='test')
+        with mock.patch.object(Click.objects, 'bulk_create', side_effect=OperationalError("server closed the connection")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        # Kept in the consumer's processing list, nothing written
+        self.assertEqual(queue_depth(), 0)
+        self.assertEqual(redis_client().llen(buffer.processing_key), 4)
+        self.assertClicks(0)
+
+        # Retried before anything else if the same buffer flushes again
+        self.push(1)
+        self.assertEqual(buffer.flush(), (4, 4))
+        self.assertEqual(buffer.flush(), (1, 1))
+        self.assertClicks(5)
+
+    def test_crashed_batch_is_replayed_once_on_restart(self):
+        self.push(4)
+        buffer = ClickBuffer(batch_size=10, at_least_once=True, consumer='test')
+        with mock.patch.object(Click.objects, 'bulk_create', side_effect=OperationalError("server closed the connection")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+
+        out = StringIO()
+        call_command('flush_clicks', '--once', '--consumer', 'test', stdout=out)
+        self.assertIn("Replaying 4 clicks", out.getvalue())
+        self.assertFalse(redis_client().exists(buffer.processing_key))
+        self.assertEqual(ClickBuffer(consumer='test').recover(), 0)
+        self.assertClicks(4)
+
+
+@skipUnless(fakeredis, "the async redirect tests need fakeredis")
+class AsyncRedirectTests(SeededTestCase):
+    """The ASGI path: AsyncRedirectDispatcher on a cache hit, aredirect_url otherwise."""
+    seed_links = 20
+    redis_settings = {'CLICK_RECORDING': 'buffered'}
+
+    def setUp(self):
+        super().setUp()
+        self.link = Link.objects.filter(owner=self.owner).first()
+        self.code = self.link.short_code
+        local_links.clear()
+
+    async def redirect(self, code):
+        return await views.aredirect_url(AsyncRequestFactory().get(f'/{code}'), code)
+
+    async def test_cache_hit_is_answered_by_the_dispatcher(self):
+        async def django(scope, receive, send):
+            self.fail("the cached redirect reached Django")
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': f'/{self.code}', 'scheme': 'http',
+            'headers': [(b'user-agent', b'Mozilla/5.0')], 'client': ('203.0.113.7', 50000),
+        }
+        await AsyncRedirectDispatcher(django)(scope, None, send)
+        self.assertEqual(sent[0]['status'], 302)
+        self.assertIn((b'location', self.link.original_url.encode()), sent[0]['headers'])
+        self.assertEqual(queue_depth(), 1)
+
+    async def test_miss_is_filled_from_the_database(self):
+        cache.delete(redirect_cache_key(self.code))
+        response = await self.redirect(self.code)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], self.link.original_url)
+        self.assertEqual(cache.get(redirect_cache_key(self.code))['id'], self.link.id)
+        self.assertEqual(queue_depth(), 1)
+
+    async def test_unknown_code_is_a_404(self):
+        with self.assertRaises(Http404):
+            await self.redirect('missing-code')
+
+    async def test_redis_outage_falls_back_to_the_database(self):
+        redis_breaker.is_open = True
+        self.addCleanup(setattr, redis_breaker, 'is_open', False)
+        response = await self.redirect(self.code)
+        self.assertEqual(response['Location'], self.link.original_url)
+        # Not buffered, so written synchronously
+        self.assertEqual(await Click.objects.filter(link=self.link).acount(), 1)
+        with self.assertRaises(Http404):
+            await self.redirect('missing-code')
+
+
+@skipUnless(fakeredis, "the metrics tests need fakeredis")
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.enterContext(benchmarks.isolated_redis(
+            100, CLICK_RECORDING='buffered', METRICS_SAMPLE_RATE=1.0, METRICS_TOKEN='scrape-token',
+        ))
+        metrics.reset()
+        self.owner = benchmarks.seed(links=20, clicks=0)
+        self.code = Link.objects.filter(owner=self.owner).values_list('short_code', flat=True).first()
+
+    def scrape(self):
+        response = Client().get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requires_token_or_staff(self):
+        self.assertEqual(Client().get('/internal/metrics/').status_code, 403)
+        self.assertEqual(
+            Client().get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403,
+        )
+
+    def test_redirects_are_counted_per_view(self):
+        client = Client()
+        for _ in range(3):
+            client.get(f'/{self.code}')
+        body = self.scrape()
+        self.assertIn('nextlink_request_duration_seconds_count{view="redirect"} 3', body)
+        self.assertIn('nextlink_request_duration_seconds_bucket{view="redirect",le="+Inf"} 3', body)
+        self.assertIn('nextlink_db_queries_total{view="redirect"} 0', body)
+        # The first lookup fills this worker's local cache from Redis
+        self.assertIn('nextlink_link_cache_lookups_total{view="redirect",result="redis_hit"} 1', body)
+        self.assertIn('nextlink_link_cache_lookups_total{view="redirect",result="local_hit"} 2', body)
+
+    def test_queries_are_counted(self):
+        client = Client()
+        client.force_login(self.owner)
+        client.get('/dashboard/')
+        self.assertRegex(self.scrape(), r'nextlink_db_queries_total\{view="dashboard"\} [1-9]')
+
+    def test_unsampled_requests_are_not_recorded(self):
+        with self.settings(METRICS_SAMPLE_RATE=0.0):
+            Client().get(f'/{self.code}')
+        self.assertNotIn('view="redirect"', self.scrape())
@@ -1,13 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path('', views.landing, name='landing'),
     path('shorten/', views.shorten_url, name='shorten'),
+    path('api/links/bulk/', views.bulk_shorten, name='bulk_shorten'),
+    path('api/links/top/', views.top_links, name='top_links'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('profile/', views.profile, name='profile'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('analytics/<str:short_code>/', views.link_analysis, name='link_analysis'),
+    path('analytics/<str:short_code>/export/', views.export_link_clicks, name='export_link_clicks'),
+    path('export/clicks/', views.export_account_clicks, name='export_account_clicks'),
     path('qr/<str:short_code>/', views.generate_qr, name='generate_qr'),
-    path('<str:short_code>', views.redirect_url, name='redirect'),
+    path('qr/<str:short_code>/image/', views.qr_image, name='qr_image'),
+    path('internal/stats/', views.internal_stats, name='internal_stats'),
+    path('internal/top-links/', views.global_top_links, name='global_top_links'),
+    path('internal/metrics/', views.metrics, name='metrics'),
+    path(
+        '<str:short_code>',
+        views.aredirect_url if settings.ASYNC_REDIRECTS else views.redirect_url,
+        name='redirect',
+    ),
 ]
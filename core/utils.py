@@ -1,27 +1,102 @@
+import hashlib
 import string
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 BASE62_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+BASE = len(BASE62_ALPHABET)
+
+# Lookup tables so encoding and decoding are plain indexing, no str.index or powers.
+# Encoding emits two digits per divmod using the 62*62 digit pairs.
+_PAIRS = [a + b for a in BASE62_ALPHABET for b in BASE62_ALPHABET]
+_PAIR_BASE = BASE * BASE
+_DIGITS = {char: value for value, char in enumerate(BASE62_ALPHABET)}
+
+# Link ids are BigAutoField; anything longer can't be a generated code
+MAX_ID = 2 ** 63 - 1
+MAX_CODE_LENGTH = 11
+
 
 def encode(num):
     """Encodes a positive integer into a Base62 string."""
-    if num == 0:
-        return BASE62_ALPHABET[0]
+    if num < BASE:
+        return BASE62_ALPHABET[num]
     arr = []
-    base = len(BASE62_ALPHABET)
     while num:
-        num, rem = divmod(num, base)
-        arr.append(BASE62_ALPHABET[rem])
+        num, rem = divmod(num, _PAIR_BASE)
+        arr.append(_PAIRS[rem])
     arr.reverse()
-    return ''.join(arr)
+    code = ''.join(arr)
+    # The leading pair may be zero-padded
+    return code[1:] if code[0] == '0' else code
+
 
 def decode(string):
     """Decodes a Base62 string into a positive integer."""
-    base = len(BASE62_ALPHABET)
-    strlen = len(string)
     num = 0
-    idx = 0
     for char in string:
-        power = (strlen - (idx + 1))
-        num += BASE62_ALPHABET.index(char) * (base ** power)
-        idx += 1
+        num = num * BASE + _DIGITS[char]
     return num
+
+
+def encode_many(nums):
+    """Encodes a batch of ids, e.g. for bulk-created links."""
+    return [encode(num) for num in nums]
+
+
+def decode_many(codes):
+    """Decodes a batch of codes; codes that aren't generated ones map to None."""
+    return [decode(code) if is_generated_code(code) else None for code in codes]
+
+
+def is_generated_code(code):
+    """
+    True if code is exactly what encode() returns for some valid id: only
+    Base62 digits, no leading zero and within the id range.
+    """
+    if not code or len(code) > MAX_CODE_LENGTH:
+        return False
+    if code[0] == '0' and code != '0':
+        return False
+    if any(char not in _DIGITS for char in code):
+        return False
+    return decode(code) <= MAX_ID
+
+
+# Query parameters that only say where a click came from; two URLs differing in
+# these lead to the same page, so they're left out of the duplicate check
+TRACKING_PARAM_PREFIXES = ('utm_',)
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonical_url(url):
+    """
+    The form of url that duplicate detection compares: lowercase scheme and
+    host, no default port, '/' for an empty path, tracking parameters
+    dropped and the rest sorted. Path case and the fragment are kept, since
+    servers and pages may tell them apart.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    userinfo = parts.netloc.rpartition('@')[0]
+    netloc = f'{userinfo}@{host}' if userinfo else host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith(TRACKING_PARAM_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), parts.fragment))
+
+
+def url_hash(url):
+    """Hex BLAKE2b-128 of the canonical form of url, what Link.url_hash indexes."""
+    return hashlib.blake2b(canonical_url(url).encode(), digest_size=16).hexdigest()
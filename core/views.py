@@ -1,18 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponseRedirect, HttpResponse
-from django.core.cache import cache
+from django.http import HttpResponseRedirect, HttpResponsePermanentRedirect, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.views.decorators.http import require_POST, etag
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Count, F
-from django.db.models.functions import TruncDay
-from .models import Link, Click
+from django.utils.http import urlencode
+from django.utils.cache import patch_cache_control
+from django.db.models import Q
+from django.conf import settings
+from .models import Link
 from .utils import encode
+from .cache import (
+    get_cached_link, cache_link, fill_link, local_links, is_known_missing, remember_missing, link_filter_stats,
+    aget_cached_link, acache_link, afill_link, ais_known_missing, aremember_missing, is_cacheable,
+)
+from .breaker import REDIS_ERRORS, redis_breaker
+from .clicks import record_click, arecord_click, queue_depth
+from .bulk import parse_items, shorten_many, BulkRequestError
+from .rollups import clicks_per_day, clicks_per_hour
+from .visitors import unique_visitors
+from .dimensions import breakdowns
+from .leaderboards import GLOBAL_SCOPE, WINDOWS, leaderboard, owner_scope
+from .replicas import read_alias, replica_reads
+from .archive import archived_rows
+from .exports import export_queryset, export_clicks, export_filename, EXPORT_FORMATS
+from .pagination import keyset_page
+from .qr import render_qr, qr_digest, QR_FORMATS, QR_SIZES, DEFAULT_QR_SIZE
 from .forms import UserProfileForm
+from . import metrics as request_metrics
+from functools import partial
+import datetime
+import hmac
 import json
-import qrcode
-import io
-import base64
 
 def landing(request):
     recent_links = []
@@ -51,25 +71,31 @@ def shorten_url(request):
                     return render(request, 'core/partials/error_message.html', context)
                  return render(request, 'core/landing.html', {**context, 'recent_links': get_recent_links(request)})
             
-            if Link.objects.filter(short_code=custom_code).exists():
+            if Link.objects.alias_taken(custom_code):
                  context = {'error': 'That alias is already taken. Try another one.', 'original_url': original_url}
                  if request.htmx:
                     return render(request, 'core/partials/error_message.html', context)
                  return render(request, 'core/landing.html', {**context, 'recent_links': get_recent_links(request)})
         
+        # Shortening the same destination again returns the existing link; an alias always gets a new one
+        link = None
+        if not custom_code and settings.LINK_DEDUPLICATION:
+            link = Link.objects.duplicate_of(original_url, owner)
+
         # Create Link
-        try:
-            link = Link.objects.create(original_url=original_url, owner=owner, short_code=custom_code if custom_code else None)
-        except Exception as e:
-             # Fallback for race conditions
-             context = {'error': 'Something went wrong. Please try again.', 'original_url': original_url}
-             if request.htmx:
-                return render(request, 'core/partials/error_message.html', context)
-             return render(request, 'core/landing.html', {**context, 'recent_links': get_recent_links(request)})
+        if link is None:
+            try:
+                link = Link.objects.create(original_url=original_url, owner=owner, short_code=custom_code if custom_code else None)
+            except Exception as e:
+                 # Fallback for race conditions
+                 context = {'error': 'Something went wrong. Please try again.', 'original_url': original_url}
+                 if request.htmx:
+                    return render(request, 'core/partials/error_message.html', context)
+                 return render(request, 'core/landing.html', {**context, 'recent_links': get_recent_links(request)})
 
         # Session persistence for anonymous users
         if not owner:
-            recent_ids = request.session.get('recent_link_ids', [])
+            recent_ids = [link_id for link_id in request.session.get('recent_link_ids', []) if link_id != link.id]
             recent_ids.insert(0, link.id)
             request.session['recent_link_ids'] = recent_ids[:5]
             request.session.modified = True
@@ -81,6 +107,26 @@ def shorten_url(request):
         return redirect('dashboard' if owner else 'landing')
     return redirect('landing')
 
+@require_POST
+def bulk_shorten(request):
+    """
+    Creates many links in one request. Accepts JSON ({"links": [{"url": ..., "alias": ...}]})
+    or NDJSON and streams back one NDJSON result per item, in submission order.
+    Browser-only: session auth with a CSRF token, there are no per-user API tokens.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        items = parse_items(request)
+    except BulkRequestError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = shorten_many(items, request.user, request.build_absolute_uri('/'))
+    return StreamingHttpResponse(
+        (json.dumps(result) + '\n' for result in results),
+        content_type='application/x-ndjson',
+    )
+
 def get_recent_links(request):
     # Helper to re-fetch context if we need to render the page with an error
     recent_links = []
@@ -92,101 +138,301 @@ def get_recent_links(request):
         recent_links = [links_dict[link_id] for link_id in recent_ids if link_id in links_dict]
     return recent_links
 
-def redirect_url(request, short_code):
-    # 1. Check Redis (Cache Hit)
-    cached_url = cache.get(f"url_{short_code}")
-    
-    link = None
-    if not cached_url:
-        # Cache Miss: Lookup in DB
-        link = get_object_or_404(Link, short_code=short_code)
-        cached_url = link.original_url
-        cache.set(f"url_{short_code}", cached_url, timeout=3600*24)
-    else:
-        # We still need link object for DB updates if we want to be exact,
-        # but for performance, we often just do a late write or async.
-        # Here we'll get it to record the Click model.
-        link = get_object_or_404(Link, short_code=short_code)
-
-    # 2. Record Analytics (Click Model)
-    Click.objects.create(
-        link=link,
-        ip_address=request.META.get('REMOTE_ADDR'),
-        user_agent=request.META.get('HTTP_USER_AGENT'),
-        referer=request.META.get('HTTP_REFERER')
-    )
-
-    # 3. Update Link aggregate count
-    Link.objects.filter(id=link.id).update(clicks_count=F('clicks_count') + 1)
-    
-    response = HttpResponseRedirect(cached_url, status=302)
+def _redirect_response(entry):
+    if is_cacheable(entry):
+        # Served by browsers and CDNs until max-age; the clicks come from their access logs
+        redirect_class = HttpResponsePermanentRedirect if entry['permanent'] else HttpResponseRedirect
+        response = redirect_class(entry['url'])
+        response['Cache-Control'] = f"public, max-age={entry['max_age']}"
+        return response
+    response = HttpResponseRedirect(entry['url'], status=302)
     response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response['Pragma'] = 'no-cache'
     response['Expires'] = '0'
     return response
 
+def _load_link(short_code):
+    # A primary-key fetch for generated codes
+    link = Link.objects.get_by_code(short_code)
+    if link is None:
+        remember_missing(short_code)
+        return None
+    return cache_link(link)
+
+async def _aload_link(short_code):
+    link = await Link.objects.aget_by_code(short_code)
+    if link is None:
+        await aremember_missing(short_code)
+        return None
+    return await acache_link(link)
+
+def _resolve_link(short_code):
+    """The cache entry for short_code, or None if no such link exists."""
+    # Check Redis (Cache Hit)
+    entry = get_cached_link(short_code)
+
+    if entry is None:
+        # Unknown codes (scanners, typos) are rejected without touching the DB
+        if is_known_missing(short_code):
+            return None
+
+        # Cache Miss: one request per code looks it up in the DB, the others wait for it
+        entry = fill_link(short_code, partial(_load_link, short_code))
+    return entry
+
+def redirect_url(request, short_code):
+    # 1. Look the code up: Redis, the membership filter, then the DB
+    entry = _resolve_link(short_code)
+    if entry is None:
+        raise Http404("No Link matches the given query.")
+
+    # 2. Record Analytics (Click Model + Link aggregate count).
+    # The cache entry carries the link id, so a hit needs no Link lookup and,
+    # in 'deferred' mode, no synchronous DB work at all.
+    if not is_cacheable(entry):
+        record_click(request.META, entry['id'])
+
+    return _redirect_response(entry)
+
+async def aredirect_url(request, short_code):
+    """
+    redirect_url for ASGI deployments (ASYNC_REDIRECTS=True). Redis calls go
+    through redis.asyncio, so a worker keeps serving other redirects while
+    one waits; only cache misses reach the ORM.
+    """
+    entry = await aget_cached_link(short_code)
+
+    if entry is None:
+        if await ais_known_missing(short_code):
+            raise Http404("No Link matches the given query.")
+
+        entry = await afill_link(short_code, partial(_aload_link, short_code))
+        if entry is None:
+            raise Http404("No Link matches the given query.")
+
+    if not is_cacheable(entry):
+        await arecord_click(request.META, entry['id'])
+
+    return _redirect_response(entry)
+
+# Longest range the analysis page covers; each day costs a rollup row, a Redis key and breakdown rows
+ANALYSIS_MAX_DAYS = 366
+
+def _parse_date(value):
+    """A date from the query string, or None if missing, malformed or after today (nothing to count there)."""
+    try:
+        parsed = datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+    if parsed is not None and parsed > timezone.localdate():
+        return None
+    return parsed
+
 @login_required
+@replica_reads
 def link_analysis(request, short_code):
     link = get_object_or_404(Link, short_code=short_code, owner=request.user)
-    
-    # Aggregate clicks by day for the last 7 days
-    seven_days_ago = timezone.now() - timezone.timedelta(days=7)
-    clicks_data = Click.objects.filter(link=link, timestamp__gte=seven_days_ago) \
-        .annotate(day=TruncDay('timestamp')) \
-        .values('day') \
-        .annotate(count=Count('id')) \
-        .order_by('day')
-
-    # Format for Chart.js
+
+    # Date range from the query string, last 7 days by default
+    today = timezone.localdate()
+    end = _parse_date(request.GET.get('end')) or today
+    start = _parse_date(request.GET.get('start')) or end - datetime.timedelta(days=6)
+    if start > end:
+        start, end = end, start
+    start = max(start, end - datetime.timedelta(days=ANALYSIS_MAX_DAYS - 1))
+
+    # Served from the rollup tables, so the cost follows the range, not the click volume
     labels = []
     values = []
-    for entry in clicks_data:
-        labels.append(entry['day'].strftime('%b %d'))
-        values.append(entry['count'])
+    if start == end:
+        for hour, count in clicks_per_hour(link, start).items():
+            labels.append(hour.strftime('%H:%M'))
+            values.append(count)
+    else:
+        for day, count in clicks_per_day(link, start, end).items():
+            labels.append(day.strftime('%b %d'))
+            values.append(count)
 
     context = {
         'link': link,
         'chart_labels': json.dumps(labels),
         'chart_values': json.dumps(values),
         'total_clicks': link.clicks_count,
+        'range_clicks': sum(values),
+        # Approximate (HyperLogLog), None while Redis is unavailable
+        'range_visitors': unique_visitors(link, start, end),
+        'breakdowns': breakdowns(link, start, end),
+        'start': start,
+        'end': end,
+        'presets': [
+            (days, (today - datetime.timedelta(days=days - 1)).isoformat(), today.isoformat())
+            for days in (7, 30, 90)
+        ],
     }
     return render(request, 'core/analysis.html', context)
 
+def _export_response(request, name, **filters):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponse("Unsupported export format", status=400)
+    compress = request.GET.get('gzip') == '1'
+    # Rows are read and encoded as the response is sent, never held in memory;
+    # that happens after the view returns, so the replica is chosen now
+    clicks = export_queryset(**filters).using(read_alias())
+    response = StreamingHttpResponse(
+        export_clicks(clicks, fmt, compress, archived=archived_rows(**filters)),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(name, fmt, compress)}"'
+    return response
+
+@login_required
+@replica_reads
+def export_link_clicks(request, short_code):
+    link = get_object_or_404(Link, short_code=short_code, owner=request.user)
+    return _export_response(
+        request, f'clicks-{link.short_code}',
+        link=link, start=_parse_date(request.GET.get('start')), end=_parse_date(request.GET.get('end')),
+    )
+
+@login_required
+@replica_reads
+def export_account_clicks(request):
+    return _export_response(
+        request, 'clicks',
+        owner=request.user, start=_parse_date(request.GET.get('start')), end=_parse_date(request.GET.get('end')),
+    )
+
+def _short_url(request, short_code):
+    return f"{request.scheme}://{request.get_host()}/{short_code}"
+
+def _qr_params(request):
+    fmt = request.GET.get('format', 'png')
+    try:
+        size = int(request.GET.get('size', DEFAULT_QR_SIZE))
+    except ValueError:
+        size = None
+    if fmt not in QR_FORMATS or size not in QR_SIZES:
+        return None
+    return size, fmt
+
+def _qr_etag(request, short_code):
+    params = _qr_params(request)
+    # No ETag for unknown or deleted codes, so If-None-Match can't turn their 404 into a 304
+    if params is None or _resolve_link(short_code) is None:
+        return None
+    return qr_digest(_short_url(request, short_code), *params)
+
+@etag(_qr_etag)
+def qr_image(request, short_code):
+    params = _qr_params(request)
+    if params is None:
+        return HttpResponse("Unsupported QR size or format", status=400)
+    # Answered from the cache _qr_etag just filled
+    if _resolve_link(short_code) is None:
+        raise Http404("Link not found")
+
+    size, fmt = params
+    response = HttpResponse(render_qr(_short_url(request, short_code), size, fmt), content_type=QR_FORMATS[fmt])
+    # The image only depends on the short URL, so browsers and CDNs can keep it
+    patch_cache_control(response, public=True, max_age=settings.QR_CACHE_TIMEOUT)
+    return response
+
 @login_required
 def generate_qr(request, short_code):
     link = get_object_or_404(Link, short_code=short_code, owner=request.user)
-    full_url = f"{request.scheme}://{request.get_host()}/{link.short_code}"
-    
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(full_url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    
+    full_url = _short_url(request, link.short_code)
+
     if request.htmx:
+        # The modal points at qr_image, which the browser caches
         return render(request, 'core/partials/qr_code_modal.html', {
-            'qr_image': img_str,
             'link': link,
             'full_url': full_url
         })
-    
+
     # Fallback for direct download or similar
-    response = HttpResponse(buffer.getvalue(), content_type="image/png")
+    response = HttpResponse(render_qr(full_url), content_type="image/png")
     response['Content-Disposition'] = f'attachment; filename="qr_{short_code}.png"'
     return response
 
+DASHBOARD_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    'clicks': ('-clicks_count', '-id'),
+}
+DASHBOARD_SORT_OPTIONS = [('newest', 'Newest first'), ('oldest', 'Oldest first'), ('clicks', 'Most clicks')]
+
 @login_required
+@replica_reads
 def dashboard(request):
+    q = request.GET.get('q', '').strip()
+    sort = request.GET.get('sort')
+    if sort not in DASHBOARD_SORTS:
+        sort = 'newest'
+    cursor = request.GET.get('cursor')
+
     links = Link.objects.filter(owner=request.user)
+    if q:
+        links = links.filter(Q(short_code__startswith=q) | Q(original_url__icontains=q))
+    # One page at a time, seeking on the (owner, sort key, id) indexes
+    links, next_cursor = keyset_page(links, DASHBOARD_SORTS[sort], cursor, settings.DASHBOARD_PAGE_SIZE)
+
     # Pre-format dates to avoid template filter issues
     for link in links:
         link.formatted_date = link.created_at.strftime("%b %d, %Y")
-    return render(request, 'core/dashboard.html', {'links': links})
+
+    context = {
+        'links': links,
+        'q': q,
+        'sort': sort,
+        'sort_options': DASHBOARD_SORT_OPTIONS,
+        'cursor': cursor,
+        'next_query': urlencode({'q': q, 'sort': sort, 'cursor': next_cursor}) if next_cursor else '',
+    }
+    # Infinite scroll and live search only swap the table rows
+    if request.htmx:
+        return render(request, 'core/partials/link_rows.html', context)
+    # From the Redis leaderboard, None while Redis is unavailable
+    context['top_links'] = leaderboard(owner_scope(request.user.id), 'week', 5)
+    return render(request, 'core/dashboard.html', context)
+
+def top_links(request):
+    """
+    The busiest links of the user (scope=mine) or of the whole site
+    (scope=global, staff only) today or over the last 7 days (window=day|week).
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    scope = request.GET.get('scope', 'mine')
+    window = request.GET.get('window', 'day')
+    if scope not in ('mine', 'global') or window not in WINDOWS:
+        return JsonResponse({'error': 'Unknown scope or window.'}, status=400)
+    if scope == 'global' and not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 100)
+    except ValueError:
+        limit = 10
+
+    entries = leaderboard(GLOBAL_SCOPE if scope == 'global' else owner_scope(request.user.id), window, limit)
+    if entries is None:
+        return JsonResponse({'error': 'Leaderboard unavailable.'}, status=503)
+    return JsonResponse({
+        'scope': scope,
+        'window': window,
+        'links': [
+            {
+                'short_code': link.short_code,
+                'short_url': _short_url(request, link.short_code),
+                'original_url': link.original_url,
+                'clicks': clicks,
+            }
+            for link, clicks in entries
+        ],
+    })
 
 @login_required
+@replica_reads
 def profile(request):
     links_count = Link.objects.filter(owner=request.user).count()
     context = {
@@ -208,3 +454,40 @@ def edit_profile(request):
     else:
         form = UserProfileForm(instance=request.user)
     return render(request, 'core/edit_profile.html', {'form': form})
+
+@staff_member_required
+def internal_stats(request):
+    # Local cache counters belong to the worker process that serves this request
+    return JsonResponse({
+        'redis_breaker_open': redis_breaker.is_open,
+        'local_link_cache': local_links.stats(),
+        'click_queue_depth': queue_depth(),
+        'link_filter': link_filter_stats(),
+    })
+
+@staff_member_required
+def global_top_links(request):
+    context = {
+        'leaderboards': [
+            ('Today', leaderboard(GLOBAL_SCOPE, 'day', 25)),
+            ('Last 7 days', leaderboard(GLOBAL_SCOPE, 'week', 25)),
+        ],
+    }
+    return render(request, 'core/top_links.html', context)
+
+def _metrics_authorized(request):
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header, f'Bearer {token}'):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+def metrics(request):
+    # Prometheus sends a bearer token rather than following a login redirect
+    if not _metrics_authorized(request):
+        return HttpResponse("Forbidden", status=403)
+    try:
+        body = request_metrics.render()
+    except REDIS_ERRORS:
+        return HttpResponse("Metrics store unavailable", status=503)
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nexlink_project.settings')
 
 application = get_asgi_application()
+
+# Imported once Django is set up; answers cached redirects before the middleware stack
+from core.dispatch import AsyncRedirectDispatcher  # noqa: E402
+
+application = AsyncRedirectDispatcher(application)
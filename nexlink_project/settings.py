@@ -57,12 +57,14 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
@@ -117,6 +119,17 @@ DATABASES = {
     'default': env.db('DATABASE_URL')
 }
 
+# Optional read replicas (comma-separated database URLs) for the analytics, dashboard,
+# profile, export and admin list pages; see core/replicas.py. In tests they mirror default.
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), 1):
+    DATABASES[f'replica{number}'] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# Replicas further behind than this many seconds are skipped; health is rechecked every interval
+REPLICA_MAX_LAG = env.float('REPLICA_MAX_LAG', default=5.0)
+REPLICA_CHECK_INTERVAL = env.float('REPLICA_CHECK_INTERVAL', default=5.0)
+# After a write, the user's reads stay on the primary this long (read-your-writes)
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+
 
 # Redis Caching
 CACHES = {
@@ -125,6 +138,9 @@ CACHES = {
         'LOCATION': env('REDIS_URL'),
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # Tight timeouts so a slow Redis costs milliseconds before the breaker opens
+            'SOCKET_CONNECT_TIMEOUT': env.float('REDIS_CONNECT_TIMEOUT', default=0.5),
+            'SOCKET_TIMEOUT': env.float('REDIS_SOCKET_TIMEOUT', default=0.25),
             'CONNECTION_POOL_KWARGS': {
                 'ssl_cert_reqs': None  # Useful for Upstash/managed Redis with self-signed certs
             }
@@ -132,6 +148,97 @@ CACHES = {
     }
 }
 
+# After REDIS_BREAKER_THRESHOLD consecutive Redis errors a worker stops calling Redis
+# and serves redirects from its local cache and the DB; it probes Redis every
+# REDIS_BREAKER_COOLDOWN seconds in the background until it answers again
+REDIS_BREAKER_THRESHOLD = env.int('REDIS_BREAKER_THRESHOLD', default=5)
+REDIS_BREAKER_COOLDOWN = env.float('REDIS_BREAKER_COOLDOWN', default=5.0)
+
+# Per-worker in-process cache in front of Redis for short code lookups
+LINK_CACHE_LOCAL_SIZE = env.int('LINK_CACHE_LOCAL_SIZE', default=10000)
+LINK_CACHE_LOCAL_TTL = env.int('LINK_CACHE_LOCAL_TTL', default=60)
+# Max seconds an edited or deleted link can keep resolving from another worker's local cache
+LINK_CACHE_SYNC_INTERVAL = env.float('LINK_CACHE_SYNC_INTERVAL', default=2.0)
+
+# Bloom filter over all short codes (built by `manage.py rebuild_link_filter`)
+# and short-lived negative entries, so lookups of unknown codes skip the DB
+LINK_FILTER_ENABLED = env.bool('LINK_FILTER_ENABLED', default=True)
+LINK_FILTER_CAPACITY = env.int('LINK_FILTER_CAPACITY', default=10_000_000)
+LINK_FILTER_ERROR_RATE = env.float('LINK_FILTER_ERROR_RATE', default=0.01)
+NEGATIVE_CACHE_TIMEOUT = env.int('NEGATIVE_CACHE_TIMEOUT', default=60)
+
+# Concurrent cache misses for one code wait for a single DB lookup: the lock
+# expires after LINK_FILL_LOCK_TIMEOUT seconds, waiters give up after LINK_FILL_WAIT
+LINK_FILL_LOCK_TIMEOUT = env.int('LINK_FILL_LOCK_TIMEOUT', default=5)
+LINK_FILL_WAIT = env.float('LINK_FILL_WAIT', default=1.0)
+
+# Link ids are reserved in blocks so a link (and its code) is created with one INSERT:
+#   'sequence' - a PostgreSQL sequence (its INCREMENT BY is the block size)
+#   'redis'    - INCRBY on a Redis counter, LINK_ID_BLOCK_SIZE ids at a time
+#   'auto'     - 'sequence' on PostgreSQL, 'redis' otherwise
+LINK_ID_ALLOCATOR = env('LINK_ID_ALLOCATOR', default='auto')
+LINK_ID_BLOCK_SIZE = env.int('LINK_ID_BLOCK_SIZE', default=100)
+
+# Upper bound on links accepted by one call to the bulk shorten API
+BULK_SHORTEN_MAX_ITEMS = env.int('BULK_SHORTEN_MAX_ITEMS', default=50000)
+
+# Shortening a URL an owner already shortened (after canonicalization) returns the existing link
+LINK_DEDUPLICATION = env.bool('LINK_DEDUPLICATION', default=True)
+
+# Admin lists of links and clicks: unfiltered tables estimated at this many rows or more
+# show the PostgreSQL statistics estimate, and filtered counts give up after ADMIN_COUNT_TIMEOUT ms
+ADMIN_EXACT_COUNT_LIMIT = env.int('ADMIN_EXACT_COUNT_LIMIT', default=10000)
+ADMIN_COUNT_TIMEOUT = env.int('ADMIN_COUNT_TIMEOUT', default=200)
+
+# Serve redirects from the async view; enable when running under ASGI (uvicorn)
+ASYNC_REDIRECTS = env.bool('ASYNC_REDIRECTS', default=False)
+# Answer cached redirects in wsgi.py/asgi.py, before the middleware stack (see core/dispatch.py)
+REDIRECT_FAST_PATH = env.bool('REDIRECT_FAST_PATH', default=True)
+
+# Seconds rendered QR images are kept in the cache and by browsers/CDNs
+QR_CACHE_TIMEOUT = env.int('QR_CACHE_TIMEOUT', default=60 * 60 * 24 * 30)
+
+# Days a link's per-day unique visitor sketch stays in Redis after its last click;
+# older ranges are restored from the copies `manage.py rollup_clicks` keeps in the DB
+VISITOR_SKETCH_TTL_DAYS = env.int('VISITOR_SKETCH_TTL_DAYS', default=8)
+
+# Site-wide daily top-link sets are trimmed to the LEADERBOARD_SIZE busiest links by
+# `manage.py rollup_clicks`; merged week views are rebuilt every LEADERBOARD_MERGE_TTL seconds
+LEADERBOARD_SIZE = env.int('LEADERBOARD_SIZE', default=10000)
+LEADERBOARD_MERGE_TTL = env.int('LEADERBOARD_MERGE_TTL', default=60)
+
+# `manage.py archive_clicks` keeps this many months of raw clicks (the current one
+# included) in the database and moves older ones to gzipped CSV files in
+# CLICK_ARCHIVE_DIR; 0 keeps everything. Rollups and exports still cover archived months.
+CLICK_RETENTION_MONTHS = env.int('CLICK_RETENTION_MONTHS', default=0)
+CLICK_ARCHIVE_DIR = env('CLICK_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'clicks'))
+
+# Links per dashboard page (more load as the user scrolls)
+DASHBOARD_PAGE_SIZE = env.int('DASHBOARD_PAGE_SIZE', default=25)
+
+# Per-view latency, SQL and redirect cache metrics, served at /internal/metrics/
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+# Share of requests measured (1.0 = all)
+METRICS_SAMPLE_RATE = env.float('METRICS_SAMPLE_RATE', default=1.0)
+# Seconds each worker keeps samples in memory before adding them to Redis
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=10.0)
+# Bearer token for Prometheus scrapes; staff users can always read the endpoint
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
+# Click recording on redirects:
+#   'sync'     - write the Click row and counter during the request
+#   'deferred' - hand clicks to a background thread so cache hits do no DB work
+#   'buffered' - append clicks to a Redis list drained by `manage.py flush_clicks`
+CLICK_RECORDING = env('CLICK_RECORDING', default='sync')
+# Clicks held in memory by the deferred writer before falling back to sync writes
+CLICK_QUEUE_MAXSIZE = env.int('CLICK_QUEUE_MAXSIZE', default=10000)
+# Clicks written per bulk INSERT by the deferred writer and flush_clicks
+CLICK_BATCH_SIZE = env.int('CLICK_BATCH_SIZE', default=500)
+# Seconds flush_clicks sleeps when the buffer is empty
+CLICK_FLUSH_INTERVAL = env.float('CLICK_FLUSH_INTERVAL', default=1.0)
+# Keep each batch in Redis until it is committed (replayed after a crash)
+CLICK_AT_LEAST_ONCE = env.bool('CLICK_AT_LEAST_ONCE', default=True)
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nexlink_project.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up; answers cached redirects before the middleware stack
+from core.dispatch import RedirectDispatcher  # noqa: E402
+
+application = RedirectDispatcher(application)